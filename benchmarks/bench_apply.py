@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Compare applying a change set one command at a time against ChangeApplier
+running domains concurrently, using a stand-in for defaults(1) that takes
+a few milliseconds per call, like a cfprefsd round trip.
+
+usage: python benchmarks/bench_apply.py [num-domains] [keys-per-domain]
+"""
+
+import os
+import stat
+import sys
+import tempfile
+
+from prefsniff.apply import ChangeApplier, SubprocessRunner
+from prefsniff.changetypes import PSChangeTypeDictAdd, PSChangeTypeInt
+
+FAKE_DEFAULTS = """#!/bin/sh
+sleep 0.005
+exit 0
+"""
+
+
+def make_changes(num_domains, num_keys):
+    changes = []
+    for i in range(num_domains):
+        domain = "com.example.app%d" % i
+        for j in range(num_keys):
+            changes.append(PSChangeTypeInt(domain, False, "key%d" % j, j))
+        changes.append(PSChangeTypeDictAdd(
+            domain, False, "settings", "enabled", True))
+    return changes
+
+
+def main():
+    num_domains = 20
+    num_keys = 10
+    if len(sys.argv) > 1:
+        num_domains = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_keys = int(sys.argv[2])
+    changes = make_changes(num_domains, num_keys)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fake_defaults = os.path.join(tmpdir, "defaults")
+        with open(fake_defaults, "w") as f:
+            f.write(FAKE_DEFAULTS)
+        os.chmod(fake_defaults, stat.S_IRWXU)
+        runner = SubprocessRunner(command=fake_defaults)
+
+        print("%d commands across %d domains" % (len(changes), num_domains))
+        for workers in (1, 4, 8, 16):
+            report = ChangeApplier(runner, max_workers=workers).apply(changes)
+            assert report.ok
+            print("max_workers=%-3d %8.1f ms  (%.1f ms in commands)" %
+                  (workers, report.elapsed * 1000, report.command_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Compare BinaryPlistReader against plistlib.load() for finding the
+top-level changes between two multi-megabyte binary plists.
+
+usage: python benchmarks/bench_bplist.py [num-top-level-keys]
+"""
+
+import copy
+import os
+import plistlib
+import sys
+import tempfile
+import time
+
+from prefsniff.bplist import BinaryPlistReader, changed_subsets
+from prefsniff.plistdiff import PlistDiff
+
+
+def make_prefs(num_keys):
+    prefs = {}
+    for i in range(num_keys):
+        prefs["com.example.key%d" % i] = {
+            "item%d" % j: {"name": "Recent document %d-%d" % (i, j),
+                           "bookmark": os.urandom(64),
+                           "count": j}
+            for j in range(100)}
+    return prefs
+
+
+def plistlib_diff(path1, path2):
+    with open(path1, "rb") as f:
+        before = plistlib.load(f)
+    with open(path2, "rb") as f:
+        after = plistlib.load(f)
+    return PlistDiff(before, after)
+
+
+def lazy_diff(path1, path2):
+    with BinaryPlistReader.from_path(path1) as before, \
+            BinaryPlistReader.from_path(path2) as after:
+        return PlistDiff(*changed_subsets(before, after))
+
+
+def bench(func, path1, path2, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        diff = func(path1, path2)
+    return (time.perf_counter() - start) / rounds, diff
+
+
+def main():
+    num_keys = 200
+    if len(sys.argv) > 1:
+        num_keys = int(sys.argv[1])
+    before = make_prefs(num_keys)
+    after = copy.deepcopy(before)
+    after["com.example.key7"]["item3"]["count"] += 1
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path1 = os.path.join(tmpdir, "before.plist")
+        path2 = os.path.join(tmpdir, "after.plist")
+        with open(path1, "wb") as f:
+            plistlib.dump(before, f, fmt=plistlib.FMT_BINARY)
+        with open(path2, "wb") as f:
+            plistlib.dump(after, f, fmt=plistlib.FMT_BINARY)
+        print("file size: %.1f MB" % (os.path.getsize(path1) / 1e6))
+
+        rounds = 3
+        full, full_diff = bench(plistlib_diff, path1, path2, rounds)
+        lazy, lazy_diff_ = bench(lazy_diff, path1, path2, rounds)
+        assert list(full_diff.entries) == list(lazy_diff_.entries)
+        print("plistlib.load + diff:     %8.1f ms" % (full * 1000))
+        print("BinaryPlistReader + diff: %8.1f ms  (%.1fx)" %
+              (lazy * 1000, full / lazy))
+
+
+if __name__ == "__main__":
+    main()
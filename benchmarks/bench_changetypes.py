@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Measure the memory and time cost of change records, and of printing their
+commands directly versus the old dict() and PSChangeTypeFactory round trip.
+
+usage: python benchmarks/bench_changetypes.py [num-changes]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from prefsniff.changetypes import (
+    PSChangeTypeArrayAdd,
+    PSChangeTypeBool,
+    PSChangeTypeDict,
+    PSChangeTypeDictAdd,
+    PSChangeTypeFactory,
+    PSChangeTypeInt,
+    PSChangeTypeKeyDeleted,
+    PSChangeTypeString
+)
+
+DOMAIN = "com.example.app"
+SETTINGS = {"enabled": True, "count": 3}
+
+
+def make_changes(num_changes):
+    changes = []
+    for i in range(num_changes):
+        key = "key%d" % i
+        kind = i % 6
+        if kind == 0:
+            change = PSChangeTypeInt(DOMAIN, False, key, i)
+        elif kind == 1:
+            change = PSChangeTypeString(DOMAIN, False, key, "value")
+        elif kind == 2:
+            change = PSChangeTypeBool(DOMAIN, False, key, True)
+        elif kind == 3:
+            change = PSChangeTypeKeyDeleted(DOMAIN, False, key)
+        elif kind == 4:
+            change = PSChangeTypeDictAdd(DOMAIN, False, key, "sub", SETTINGS)
+        else:
+            change = PSChangeTypeArrayAdd(DOMAIN, False, key, [i])
+        changes.append(change)
+    # a few whole-dictionary rewrites, which serialize the most
+    changes.append(PSChangeTypeDict(DOMAIN, False, "settings", SETTINGS))
+    return changes
+
+
+def round_trip_commands(changes):
+    # what main() used to do for every change
+    return [PSChangeTypeFactory.ps_change_type_from_dict(dict(ch)).shell_command()
+            for ch in changes]
+
+
+def direct_commands(changes):
+    return [ch.shell_command() for ch in changes]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    num_changes = 100000
+    if len(sys.argv) > 1:
+        num_changes = int(sys.argv[1])
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    changes = make_changes(num_changes)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del changes
+    gc.collect()
+    # time it again without tracemalloc's overhead
+    build, changes = timed(make_changes, num_changes)
+    count = len(changes)
+    print("%d changes" % count)
+    print("construct:   %8.2f us/change, %6.0f bytes/change" %
+          (build / count * 1e6, (after - before) / count))
+
+    round_trip, commands = timed(round_trip_commands, changes)
+    direct, direct_cmds = timed(direct_commands, changes)
+    assert commands == direct_cmds
+    print("round trip:  %8.2f us/change" % (round_trip / count * 1e6))
+    print("direct:      %8.2f us/change  (%.1fx)" %
+          (direct / count * 1e6, round_trip / direct))
+
+
+if __name__ == "__main__":
+    main()
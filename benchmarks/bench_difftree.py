@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Time diff-tree's work on a generated golden Preferences tree and an
+exported copy in which some plists differ: pairing plists by domain,
+then diffing the pairs in this process and across a pool of worker
+processes. Reports throughput in files per second.
+
+usage: python benchmarks/bench_difftree.py [num-plists] [workers]
+"""
+
+import os
+import plistlib
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import as_completed
+
+from prefsniff.pathindex import pair_trees
+from prefsniff.prefsniff import (
+    DIFF_TREE_BATCH,
+    ChangeFormatter,
+    _diff_plist_pairs,
+    process_pool
+)
+
+
+def make_tree(root, num_plists, rng, uuid, changed):
+    os.makedirs(os.path.join(root, "ByHost"))
+    for i in range(num_plists):
+        pref = {"setting%d" % k: [k, "value %d" % k, {"nested": k}]
+                for k in range(40)}
+        if i in changed:
+            pref["setting%d" % rng.randrange(40)] = rng.random()
+        if i % 10 == 0:
+            name = os.path.join("ByHost", "com.example.app%d.%s.plist" % (
+                i, uuid))
+        else:
+            name = "com.example.app%d.plist" % i
+        fmt = plistlib.FMT_BINARY if i % 2 else plistlib.FMT_XML
+        with open(os.path.join(root, name), "wb") as f:
+            plistlib.dump(pref, f, fmt=fmt)
+
+
+def diff_pairs(pairs, formatter, workers):
+    batches = [pairs[i:i + DIFF_TREE_BATCH]
+               for i in range(0, len(pairs), DIFF_TREE_BATCH)]
+    differing = 0
+    if not workers:
+        for batch in batches:
+            differing += sum(1 for r in _diff_plist_pairs(batch, formatter)
+                             if r[4])
+        return differing
+    pool = process_pool(workers)
+    futures = [pool.submit(_diff_plist_pairs, batch, formatter)
+               for batch in batches]
+    for future in as_completed(futures):
+        differing += sum(1 for r in future.result() if r[4])
+    pool.shutdown()
+    return differing
+
+
+def main():
+    num_plists = 2000
+    workers = os.cpu_count() or 1
+    if len(sys.argv) > 1:
+        num_plists = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    rng = random.Random(0)
+    changed = set(rng.sample(range(num_plists), num_plists // 5))
+    formatter = ChangeFormatter()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        golden = os.path.join(tmpdir, "golden")
+        export = os.path.join(tmpdir, "export")
+        make_tree(golden, num_plists, rng, "000E4DFD-62C8-5DC5-A2A4-42AFE04AAB87",
+                  set())
+        make_tree(export, num_plists, rng, "5B1E0C3A-1D2F-4E5A-9B8C-7D6E5F4A3B2C",
+                  changed)
+        files = 2 * num_plists
+
+        start = time.perf_counter()
+        pairs = pair_trees(golden, export)
+        pair_elapsed = time.perf_counter() - start
+        assert len(pairs) == num_plists
+
+        print("%d plists per tree, %d differ" % (num_plists, len(changed)))
+        print("pairing:       %8.1f ms" % (pair_elapsed * 1e3))
+        for n in (0, workers):
+            start = time.perf_counter()
+            differing = diff_pairs(pairs, formatter, n)
+            elapsed = time.perf_counter() - start
+            assert differing == len(changed), differing
+            print("%2d workers:    %8.0f files/sec" % (n, files / elapsed))
+
+
+if __name__ == "__main__":
+    main()
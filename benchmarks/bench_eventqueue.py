@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Push an event storm (many writes to a few hundred plists, as during a
+bulk defaults import) through an unbounded queue.Queue and through a
+BoundedEventQueue under each overflow policy, with a consumer that
+takes a fixed time per event. Reports how deep each queue got, how
+long events waited, and how many events the consumer had to handle.
+
+usage: python benchmarks/bench_eventqueue.py [num-events] [num-paths]
+"""
+
+import random
+import sys
+import threading
+import time
+from queue import Queue
+
+from watchdog.events import FileModifiedEvent
+
+from prefsniff.eventqueue import OVERFLOW_POLICIES, BoundedEventQueue
+
+QUEUE_SIZE = 1000
+# how long the consumer spends on each event
+HANDLE_SECONDS = 0.00002
+
+
+def run(event_queue, events):
+    handled = []
+    done = threading.Event()
+
+    def consume():
+        while not done.is_set() or event_queue.qsize():
+            try:
+                _, _, _, queued_at = event_queue.get(True, 0.01)
+            except Exception:
+                continue
+            handled.append(time.perf_counter() - queued_at)
+            deadline = time.perf_counter() + HANDLE_SECONDS
+            while time.perf_counter() < deadline:
+                pass
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    high_water = 0
+    start = time.perf_counter()
+    for event in events:
+        event_queue.put(("modified", event, 1, time.perf_counter()))
+        high_water = max(high_water, event_queue.qsize())
+    done.set()
+    consumer.join()
+    elapsed = time.perf_counter() - start
+    handled.sort()
+    return high_water, len(handled), handled[len(handled) // 2], \
+        handled[-1], elapsed
+
+
+class _TimedBoundedEventQueue(BoundedEventQueue):
+    # carries each event's queueing time alongside it
+    def put(self, item):
+        event_type, event, raw_event_count, queued_at = item
+        event.queued_at = queued_at
+        super().put((event_type, event, raw_event_count))
+
+    def get(self, block=True, timeout=None):
+        event_type, event, raw_event_count = super().get(block, timeout)
+        return event_type, event, raw_event_count, event.queued_at
+
+
+def main():
+    num_events = 100000
+    num_paths = 300
+    if len(sys.argv) > 1:
+        num_events = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_paths = int(sys.argv[2])
+    rng = random.Random(0)
+    paths = ["/Users/me/Library/Preferences/com.example.app%d.plist" % i
+             for i in range(num_paths)]
+    print("%d events for %d paths, queue size %d" % (
+        num_events, num_paths, QUEUE_SIZE))
+    print("%-12s %10s %10s %12s %12s %10s" % (
+        "queue", "max depth", "handled", "median wait", "max wait", "seconds"))
+    queues = [("unbounded", Queue())]
+    for policy in OVERFLOW_POLICIES:
+        queues.append((policy, _TimedBoundedEventQueue(QUEUE_SIZE, policy)))
+    for name, event_queue in queues:
+        events = [FileModifiedEvent(rng.choice(paths))
+                  for _ in range(num_events)]
+        high_water, handled, median_wait, max_wait, elapsed = run(
+            event_queue, events)
+        print("%-12s %10d %10d %10.1fms %10.1fms %10.2f" % (
+            name, high_water, handled, median_wait * 1e3, max_wait * 1e3,
+            elapsed))
+
+
+if __name__ == "__main__":
+    main()
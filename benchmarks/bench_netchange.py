@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compare two ways of keeping track of the net change to a large plist
+while a few of its settings are toggled back and forth. One folds each
+iteration's changes into a NetChangeAccumulator. The other re-diffs the
+current plist against the original after every iteration. Reports the
+time per iteration for each, and how many commands each iteration
+prints compared with the net result.
+
+usage: python benchmarks/bench_netchange.py [num-keys] [iterations]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from prefsniff.prefsniff import NetChangeAccumulator, PrefSniff
+
+
+def main():
+    num_keys = 20000
+    iterations = 200
+    if len(sys.argv) > 1:
+        num_keys = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+    original = {"key%d" % i: {"value": i, "name": "setting %d" % i}
+                for i in range(num_keys)}
+    original["toggle"] = False
+    original["counter"] = 0
+    versions = [original]
+    for i in range(iterations):
+        pref = dict(versions[-1])
+        pref["toggle"] = not pref["toggle"]
+        if i % 10 == 0:
+            pref["counter"] += 1
+        versions.append(pref)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "com.example.net.plist")
+        open(path, "wb").close()
+        # every iteration diffs against the last, either way, so only
+        # what's done on top of that is timed
+        diffs = [PrefSniff(path, before=before, after=after)
+                 for before, after in zip(versions, versions[1:])]
+        printed = sum(len(d.changes) for d in diffs)
+
+        net = NetChangeAccumulator(path)
+        start = time.perf_counter()
+        for d in diffs:
+            net.update(d)
+        net_changes = net.net_changes()
+        accumulated = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for after in versions[1:]:
+            rediffed = PrefSniff(path, before=original, after=after)
+        rediff = time.perf_counter() - start
+        assert net_changes.commands == rediffed.commands
+
+    print("%d keys, %d iterations" % (num_keys, iterations))
+    print("accumulate: %10.2f us/iteration" % (accumulated / iterations * 1e6))
+    print("re-diff:    %10.2f us/iteration" % (rediff / iterations * 1e6))
+    print("commands: %d printed per change, %d net" % (
+        printed, len(net_changes.changes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Compare printing changes line by line, as the CLI used to, against
+rendering them in one piece through BufferedOutputWriter, as text and
+as NDJSON, with output redirected to a file.
+
+usage: python benchmarks/bench_output.py [num-changes]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from prefsniff.changetypes import PSChangeTypeInt, PSChangeTypeString
+from prefsniff.output import BufferedOutputWriter, change_records, ndjson_lines
+
+STARS = "*****************************"
+
+
+def make_changes(num_changes):
+    return [PSChangeTypeInt("com.example.app", False, "key%d" % i, i)
+            if i % 2 else
+            PSChangeTypeString("com.example.app", False, "key%d" % i, "v")
+            for i in range(num_changes)]
+
+
+def print_per_line(changes, f):
+    # one print per command and separator, each flushed, as when
+    # stdout is unbuffered
+    print(STARS, file=f, flush=True)
+    print("", file=f, flush=True)
+    for ch in changes:
+        print(ch.shell_command(), file=f, flush=True)
+        print("", file=f, flush=True)
+    print(STARS, file=f, flush=True)
+
+
+def buffered_text(changes, f):
+    with BufferedOutputWriter(f) as writer:
+        for ch in changes:
+            writer.write(ch.shell_command() + "\n\n")
+
+
+def buffered_ndjson(changes, f):
+    now = time.time()
+    with BufferedOutputWriter(f) as writer:
+        for ch in changes:
+            writer.write(ndjson_lines(
+                change_records([ch], "/tmp/com.example.app.plist", now)))
+
+
+def main():
+    num_changes = 100000
+    if len(sys.argv) > 1:
+        num_changes = int(sys.argv[1])
+    changes = make_changes(num_changes)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, func in (("print per line", print_per_line),
+                           ("buffered text", buffered_text),
+                           ("buffered ndjson", buffered_ndjson)):
+            path = os.path.join(tmpdir, "out")
+            with open(path, "w") as f:
+                start = time.perf_counter()
+                func(changes, f)
+                elapsed = time.perf_counter() - start
+            print("%-16s %8.2f us/change  %6.1f MB" % (
+                name, elapsed / num_changes * 1e6, os.path.getsize(path) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
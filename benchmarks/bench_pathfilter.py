@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Compare checking paths against include/exclude patterns one at a time
+against checking them with a PathFilter, which compiles every pattern
+into a single regular expression.
+
+usage: python benchmarks/bench_pathfilter.py [num-paths] [num-patterns]
+"""
+
+import random
+import re
+import sys
+import time
+
+from prefsniff.pathfilter import PathFilter, glob_to_regex
+
+
+def make_paths(rng, num_paths):
+    vendors = ["com.apple", "com.google", "org.mozilla", "com.microsoft"]
+    paths = []
+    for i in range(num_paths):
+        name = "%s.app%d" % (rng.choice(vendors), rng.randrange(200))
+        if i % 5 == 0:
+            name += ".000E4DFD-62C8-5DC5-A2A4-42AFE04AAB87"
+            directory = "/Users/me/Library/Preferences/ByHost/"
+        else:
+            directory = "/Users/me/Library/Preferences/"
+        suffix = rng.choice([".plist", ".plist", ".plist", ".plist.tmp"])
+        paths.append(directory + name + suffix)
+    return paths
+
+
+def one_at_a_time(paths, includes, excludes):
+    # each pattern compiled on its own and tried in turn
+    plist = re.compile(r".*\.plist\Z")
+    includes = [re.compile(glob_to_regex(p)) for p in includes]
+    excludes = [re.compile(glob_to_regex(p)) for p in excludes]
+    passed = 0
+    for path in paths:
+        if not plist.match(path):
+            continue
+        if not any(r.match(path) for r in includes):
+            continue
+        if any(r.match(path) for r in excludes):
+            continue
+        passed += 1
+    return passed
+
+
+def combined(paths, includes, excludes):
+    path_filter = PathFilter(include=includes, exclude=excludes)
+    for path in paths:
+        path_filter.accept(path)
+    return path_filter.passed
+
+
+def main():
+    num_paths = 100000
+    num_patterns = 16
+    if len(sys.argv) > 1:
+        num_paths = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_patterns = int(sys.argv[2])
+    rng = random.Random(0)
+    paths = make_paths(rng, num_paths)
+    includes = ["com.apple.app%d*" % i for i in range(num_patterns)]
+    excludes = ["ByHost/*", "*app1[0-9]*"]
+
+    start = time.perf_counter()
+    expected = one_at_a_time(paths, includes, excludes)
+    separate_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    passed = combined(paths, includes, excludes)
+    combined_elapsed = time.perf_counter() - start
+    assert passed == expected, (passed, expected)
+
+    print("%d paths, %d include patterns, %d passed" % (
+        num_paths, len(includes), passed))
+    print("one at a time: %8.0f paths/sec" % (num_paths / separate_elapsed))
+    print("combined:      %8.0f paths/sec" % (num_paths / combined_elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Compare working out each plist's domain with PrefSniff.getdomain(), as
+every diff used to, against looking it up in a PlistPathIndex, for a
+generated Preferences-like tree with a ByHost subdirectory.
+
+usage: python benchmarks/bench_pathindex.py [num-plists] [lookups]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from prefsniff.pathindex import PlistPathIndex
+from prefsniff.prefsniff import PrefSniff
+
+
+def make_tree(root, num_plists):
+    byhost_dir = os.path.join(root, "ByHost")
+    os.mkdir(byhost_dir)
+    paths = []
+    for i in range(num_plists):
+        if i % 4:
+            path = os.path.join(root, "com.example.app%d.plist" % i)
+        else:
+            path = os.path.join(
+                byhost_dir,
+                "com.example.app%d.000E4DFD-62C8-5DC5-A2A4-42AFE04AAB87.plist" % i)
+        open(path, "wb").close()
+        paths.append(path)
+    return paths
+
+
+def main():
+    num_plists = 500
+    lookups = 100000
+    if len(sys.argv) > 1:
+        num_plists = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        lookups = int(sys.argv[2])
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = make_tree(root, num_plists)
+        order = [paths[i % num_plists] for i in range(lookups)]
+
+        start = time.perf_counter()
+        for path in order:
+            PrefSniff.getdomain(path, byhost=PrefSniff.is_byhost(path))
+        getdomain_elapsed = time.perf_counter() - start
+
+        index = PlistPathIndex(root)
+        start = time.perf_counter()
+        index.build()
+        build_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for path in order:
+            index.get(path).domain
+        index_elapsed = time.perf_counter() - start
+
+        for path in paths:
+            info = index.get(path)
+            assert info.domain == PrefSniff.getdomain(path, info.byhost)
+        assert index.misses == 0
+
+    print("%d plists, %d lookups" % (num_plists, lookups))
+    print("getdomain:   %8.2f us/lookup" % (getdomain_elapsed / lookups * 1e6))
+    print("index build: %8.2f ms" % (build_elapsed * 1e3))
+    print("index get:   %8.2f us/lookup" % (index_elapsed / lookups * 1e6))
+    print("speedup:     %8.1fx" % (getdomain_elapsed / index_elapsed))
+
+
+if __name__ == "__main__":
+    main()
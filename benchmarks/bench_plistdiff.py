@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Compare PlistDiff against the original two-level _dict_compare on
+large, symbolichotkeys-shaped preference dictionaries. PlistDiff is
+timed as a watch uses it: handed the "before" plist's digests from the
+previous diff, and hashing the "after" plist for the next one.
+
+usage: python benchmarks/bench_plistdiff.py [num-hotkeys]
+"""
+
+import copy
+import plistlib
+import sys
+import tempfile
+import time
+
+from prefsniff.plistdiff import PlistDictPlan, PlistDiff
+from prefsniff.prefsniff import PrefSniff
+
+
+def make_hotkeys(count):
+    hotkeys = {}
+    for i in range(count):
+        hotkeys[str(i)] = {
+            "enabled": bool(i % 2),
+            "value": {"parameters": [65535, i % 128, 1048576],
+                      "type": "standard"}}
+    return {"AppleSymbolicHotKeys": hotkeys,
+            "AppleSymbolicHotKeysVersion": 1}
+
+
+def count_nodes(value):
+    count = 1
+    if isinstance(value, dict):
+        for v in value.values():
+            count += count_nodes(v)
+    elif isinstance(value, list):
+        for v in value:
+            count += count_nodes(v)
+    return count
+
+
+def legacy_compare(before, after):
+    # what PrefSniff did before PlistDiff: compare the top level,
+    # then compare one level down inside each modified dictionary
+    added, removed, modified, same = PrefSniff._dict_compare(
+        None, before, after)
+    for key, val in modified.items():
+        if isinstance(val[1], dict):
+            PrefSniff._dict_compare(None, val[0], val[1])
+    return modified
+
+
+def new_compare(before, after, before_digests):
+    diff = PlistDiff(before, after, before_digests=before_digests)
+    for key, val in diff.modified.items():
+        if isinstance(val[0], dict) and isinstance(val[1], dict):
+            PlistDictPlan(diff, key)
+    diff.after_digests()
+    return diff
+
+
+def bench(func, rounds, *args):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - start) / rounds
+
+
+def reparse(value):
+    # both sides of a real diff come fresh from plistlib
+    return plistlib.loads(plistlib.dumps(value, fmt=plistlib.FMT_BINARY))
+
+
+def scenarios(before):
+    unchanged = copy.deepcopy(before)
+
+    toggled = copy.deepcopy(before)
+    hotkeys = toggled["AppleSymbolicHotKeys"]
+    first = next(iter(hotkeys))
+    hotkeys[first]["enabled"] = not hotkeys[first]["enabled"]
+
+    deep = copy.deepcopy(before)
+    hotkeys = deep["AppleSymbolicHotKeys"]
+    for i, entry in enumerate(hotkeys.values()):
+        if i % 100 == 0:
+            entry["value"]["parameters"][1] += 1
+
+    retyped = copy.deepcopy(before)
+    hotkeys = retyped["AppleSymbolicHotKeys"]
+    # invisible to ==, so the legacy comparison misses it entirely
+    hotkeys[first]["enabled"] = int(hotkeys[first]["enabled"])
+
+    removed = copy.deepcopy(before)
+    hotkeys = removed["AppleSymbolicHotKeys"]
+    del hotkeys[first]["value"]["type"]
+
+    return [("unchanged", unchanged),
+            ("one toggle", toggled),
+            ("1% deep edits", deep),
+            ("bool -> int", retyped),
+            ("deep key removal", removed)]
+
+
+def command_bytes(before, after):
+    with tempfile.NamedTemporaryFile(suffix=".plist") as f:
+        plistlib.dump(before, f)
+        f.flush()
+        diffs = PrefSniff(f.name, before=before, after=after)
+        return sum(len(cmd) for cmd in diffs.commands)
+
+
+def main():
+    count = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    before = reparse(make_hotkeys(count))
+    print("nodes: %d" % count_nodes(before))
+    before_digests = PlistDiff(before, before).after_digests()
+    rounds = 20
+    for name, after in scenarios(before):
+        after = reparse(after)
+        legacy = bench(legacy_compare, rounds, before, after)
+        new = bench(new_compare, rounds, before, after, before_digests)
+        print("%-18s legacy: %7.3f ms  PlistDiff: %7.3f ms  command bytes: %d" %
+              (name, legacy * 1000, new * 1000, command_bytes(before, after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Record a synthetic burst of preference activity, rewrites of plists
+in a Preferences-like directory with some writes leaving a plist
+unchanged, then replay it through the whole pipeline as fast as
+possible. Reports the log's size, throughput in events per second,
+and per-event latency.
+
+usage: python benchmarks/bench_replay.py [num-plists] [num-events]
+"""
+
+import io
+import os
+import plistlib
+import random
+import sys
+import tempfile
+import time
+
+from watchdog.events import FileModifiedEvent
+
+from prefsniff.eventlog import EventLogWriter
+from prefsniff.output import BufferedOutputWriter
+from prefsniff.prefsniff import ChangeFormatter, replay_event_log
+
+
+def make_pref(rng):
+    return {"setting%d" % k: rng.choice([True, k, "value %d" % k, [k, 0]])
+            for k in range(30)}
+
+
+def write_plist(path, pref, fmt):
+    with open(path, "wb") as f:
+        plistlib.dump(pref, f, fmt=fmt)
+
+
+def read_plist(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def main():
+    num_plists = 200
+    num_events = 5000
+    if len(sys.argv) > 1:
+        num_plists = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_events = int(sys.argv[2])
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, "Preferences")
+        os.makedirs(root)
+        plists = []
+        for i in range(num_plists):
+            path = os.path.join(root, "com.example.app%d.plist" % i)
+            fmt = plistlib.FMT_BINARY if i % 2 else plistlib.FMT_XML
+            pref = make_pref(rng)
+            write_plist(path, pref, fmt)
+            plists.append((path, fmt, pref))
+        log_path = os.path.join(tmpdir, "events.log")
+        with EventLogWriter(log_path) as recorder:
+            for path, _, _ in plists:
+                recorder.baseline(path, read_plist(path))
+            for _ in range(num_events):
+                path, fmt, pref = rng.choice(plists)
+                # a quarter of saves don't change anything
+                if rng.random() < 0.75:
+                    pref["setting%d" % rng.randrange(30)] = rng.random()
+                write_plist(path, pref, fmt)
+                recorder.record("modified", FileModifiedEvent(path), 1,
+                                read_plist(path))
+        log_size = os.path.getsize(log_path)
+
+        formatter = ChangeFormatter(output_format="ndjson")
+        writer = BufferedOutputWriter(io.StringIO())
+        start = time.perf_counter()
+        latencies = replay_event_log(log_path, formatter, writer,
+                                     status_file=io.StringIO())
+        elapsed = time.perf_counter() - start
+        writer.close()
+
+    latencies.sort()
+    print("%d plists, %d events, log %d bytes" % (
+        num_plists, len(latencies), log_size))
+    print("throughput: %8.0f events/sec" % (len(latencies) / elapsed))
+    for label, fraction in (("p50", 0.5), ("p99", 0.99)):
+        print("latency %s: %6.1f us" % (
+            label, latencies[int(len(latencies) * fraction)] * 1e6))
+    print("latency max: %6.1f us" % (latencies[-1] * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Round-trip randomly generated plist pairs through change generation and
+DefaultsEmulator, checking that the generated commands (and the planned
+ones) turn each "before" plist into its "after", and reporting how many
+cases per second that runs at.
+
+Values are limited to what defaults write can express: no data or date
+values, and no line breaks in strings, which XML fragments don't preserve.
+
+usage: python benchmarks/bench_roundtrip.py [num-cases] [seed]
+"""
+
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+from prefsniff.emulator import round_trip
+from prefsniff.plan import ChangePlanner
+from prefsniff.prefsniff import PrefSniff
+
+STRING_CHARS = "abcxyz <>&'\"\t-é☃"
+
+
+def random_scalar(rng):
+    kind = rng.randrange(5)
+    if kind == 0:
+        return rng.choice([True, False])
+    if kind == 1:
+        return rng.randint(-1 << 40, 1 << 40)
+    if kind == 2:
+        return rng.choice([0.0, -1.5, 3.25, 1e20, rng.random()])
+    return "".join(rng.choice(STRING_CHARS) for _ in range(rng.randrange(8)))
+
+
+def random_value(rng, depth):
+    kind = rng.randrange(6)
+    if depth > 0 and kind == 0:
+        return random_dict(rng, depth - 1)
+    if depth > 0 and kind == 1:
+        return [random_value(rng, depth - 1) for _ in range(rng.randrange(5))]
+    return random_scalar(rng)
+
+
+def random_dict(rng, depth, size=4):
+    return {"k%d" % rng.randrange(size * 2): random_value(rng, depth)
+            for _ in range(rng.randrange(size + 1))}
+
+
+def mutate(rng, value, depth):
+    if isinstance(value, dict):
+        value = dict(value)
+        for _ in range(rng.randrange(1, 4)):
+            op = rng.randrange(4)
+            keys = list(value)
+            if op == 0 or not keys:
+                value["k%d" % rng.randrange(10)] = random_value(rng, depth)
+            elif op == 1:
+                del value[rng.choice(keys)]
+            else:
+                key = rng.choice(keys)
+                value[key] = mutate(rng, value[key], depth - 1)
+        return value
+    if isinstance(value, list):
+        value = list(value)
+        op = rng.randrange(4)
+        if op == 0 or not value:
+            value.extend(random_value(rng, depth)
+                         for _ in range(rng.randrange(1, 3)))
+        elif op == 1:
+            del value[rng.randrange(len(value))]
+        elif op == 2:
+            value.insert(rng.randrange(len(value)), random_value(rng, depth))
+        else:
+            i = rng.randrange(len(value))
+            value[i] = mutate(rng, value[i], depth - 1)
+        return value
+    return random_value(rng, max(depth, 0))
+
+
+def main():
+    num_cases = 2000
+    seed = 0
+    if len(sys.argv) > 1:
+        num_cases = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        seed = int(sys.argv[2])
+    rng = random.Random(seed)
+    planner = ChangePlanner()
+    cases = []
+    for _ in range(num_cases):
+        before = random_dict(rng, 3, size=8)
+        after = mutate(rng, copy.deepcopy(before), 3)
+        cases.append((before, after))
+
+    # PrefSniff stats the plist to work out its domain
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "com.example.fuzz.plist")
+        open(path, "wb").close()
+
+        start = time.perf_counter()
+        for i, (before, after) in enumerate(cases):
+            diffs = PrefSniff(path, before=before, after=after)
+            if not round_trip(diffs):
+                print("case %d: changes don't round trip" % i)
+                print("before: %r\nafter:  %r" % (before, after))
+                for change in diffs.changes:
+                    print("  " + change.shell_command())
+                sys.exit(1)
+        diff_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, (before, after) in enumerate(cases):
+            diffs = PrefSniff(path, before=before, after=after)
+            plan = planner.plan(diffs)
+            if not round_trip(diffs, plan.changes):
+                print("case %d: %s plan doesn't round trip" % (i, plan.strategy))
+                print(plan.shell_script())
+                sys.exit(1)
+        plan_elapsed = time.perf_counter() - start
+
+    print("%d cases, seed %d: all round trip" % (num_cases, seed))
+    print("changes: %8.0f cases/sec" % (num_cases / diff_elapsed))
+    print("planned: %8.0f cases/sec" % (num_cases / plan_elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Time snapshotting a generated Preferences-like tree into a SnapshotStore:
+a first snapshot, which reads everything, a second after a few plists
+have changed, which reads only those, and diffing the tree against the
+first snapshot. Also reports how big the store is.
+
+usage: python benchmarks/bench_snapshot.py [num-plists] [num-changed]
+"""
+
+import os
+import plistlib
+import random
+import sys
+import tempfile
+import time
+
+from prefsniff.prefsniff import diff_snapshot
+from prefsniff.snapshot import SnapshotStore
+
+# an hour ago, so nothing looks like it was modified racily
+OLD_MTIME = time.time() - 3600
+
+
+def write_plist(path, pref, fmt):
+    with open(path, "wb") as f:
+        plistlib.dump(pref, f, fmt=fmt)
+    os.utime(path, (OLD_MTIME, OLD_MTIME))
+
+
+def make_pref(rng, i):
+    return {"setting%d" % k: rng.choice([True, k, "value %d" % k, [k, i]])
+            for k in range(rng.randrange(5, 60))}
+
+
+def main():
+    num_plists = 2000
+    num_changed = 20
+    if len(sys.argv) > 1:
+        num_plists = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_changed = int(sys.argv[2])
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, "Preferences")
+        os.makedirs(os.path.join(root, "ByHost"))
+        paths = []
+        for i in range(num_plists):
+            name = "com.example.app%d.plist" % i
+            if i % 10 == 0:
+                name = os.path.join("ByHost", name)
+            path = os.path.join(root, name)
+            fmt = plistlib.FMT_BINARY if i % 2 else plistlib.FMT_XML
+            write_plist(path, make_pref(rng, i), fmt)
+            paths.append((path, fmt))
+        tree_bytes = sum(os.path.getsize(p) for p, _ in paths)
+        store_path = os.path.join(tmpdir, "snapshots.db")
+
+        with SnapshotStore(store_path) as store:
+            start = time.perf_counter()
+            first, scan = store.take(root)
+            first_elapsed = time.perf_counter() - start
+            first_size = os.path.getsize(store_path)
+
+            for path, fmt in rng.sample(paths, num_changed):
+                write_plist(path, make_pref(rng, -1), fmt)
+
+            start = time.perf_counter()
+            _, second_scan = store.take(root)
+            second_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            changed = sum(1 for _ in diff_snapshot(store, first))
+            diff_elapsed = time.perf_counter() - start
+        store_size = os.path.getsize(store_path)
+
+    print("%d plists, %d bytes" % (num_plists, tree_bytes))
+    print("first snapshot:  %8.1f ms, %d read, store %d bytes" % (
+        first_elapsed * 1e3, len(scan.data), first_size))
+    print("second snapshot: %8.1f ms, %d read, store %d bytes" % (
+        second_elapsed * 1e3, len(second_scan.data), store_size))
+    print("diff-snapshot:   %8.1f ms, %d changed plists" % (
+        diff_elapsed * 1e3, changed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Measure what --stats costs: diff and render the same small change many
+times with stats disabled (NULL_STATS) and enabled (PipelineStats).
+
+usage: python benchmarks/bench_stats.py [iterations]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from prefsniff.prefsniff import ChangeFormatter, PrefSniff
+from prefsniff.stats import NULL_STATS, RENDER, PipelineStats
+
+
+def run(path, before, after, formatter, stats, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        diffs = PrefSniff(path, before=before, after=after, stats=stats)
+        with stats.timer(RENDER):
+            formatter.render(diffs)
+    return time.perf_counter() - start
+
+
+def main():
+    iterations = 20000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    before = {"key%d" % i: i for i in range(20)}
+    after = dict(before, key3=-1, added="yes")
+    formatter = ChangeFormatter()
+
+    # PrefSniff stats the plist to work out its domain
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "com.example.stats.plist")
+        open(path, "wb").close()
+        # warm up
+        run(path, before, after, formatter, NULL_STATS, iterations // 10)
+        # best of several alternating runs, to keep noise out
+        disabled = enabled = float("inf")
+        for _ in range(5):
+            disabled = min(disabled, run(path, before, after, formatter,
+                                         NULL_STATS, iterations))
+            enabled = min(enabled, run(path, before, after, formatter,
+                                       PipelineStats(), iterations))
+
+    print("%d diffs" % iterations)
+    print("disabled: %8.2f us/diff" % (disabled / iterations * 1e6))
+    print("enabled:  %8.2f us/diff (%+.1f%%)" % (
+        enabled / iterations * 1e6, (enabled / disabled - 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Count how many times plists are read per save under each --trigger.
+Each save is written in small chunks, the way a slow writer would.
+Saves take turns at rewriting the plist in place, deleting it and
+creating it afresh, and saving it atomically, by writing a temp file
+and renaming it over the plist. A consumer thread reads and
+parses the plist for every event that's queued, as a watcher does, and
+counts reads and failed parses. close-write needs inotify, so this only
+runs on Linux.
+
+usage: python benchmarks/bench_trigger.py [num-saves] [coalesce-ms]
+"""
+
+import os
+import plistlib
+import sys
+import tempfile
+import threading
+import time
+
+from prefsniff.bplist import load_plist
+from prefsniff.eventqueue import BoundedEventQueue, event_path
+from prefsniff.pathfilter import PathFilter
+from prefsniff.prefsniff import TRIGGERS, PrefChangedEventHandler
+
+NUM_PLISTS = 10
+CHUNK = 4096
+
+
+IN_PLACE = 0
+CREATE = 1
+ATOMIC = 2
+
+
+def save(path, data, how):
+    target = path
+    if how == ATOMIC:
+        target = path + ".tmp"
+    elif how == CREATE:
+        os.unlink(path)
+    with open(target, "wb") as f:
+        for i in range(0, len(data), CHUNK):
+            f.write(data[i:i + CHUNK])
+            f.flush()
+            # give the observer a chance to see the file half written
+            time.sleep(0.0005)
+    if how == ATOMIC:
+        os.replace(target, path)
+
+
+def consume(event_queue, counts):
+    while True:
+        event_type, event, _ = event_queue.get()
+        if event_type is None:
+            break
+        if event_type == "deleted":
+            continue
+        try:
+            with open(event_path(event_type, event), "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        counts["reads"] += 1
+        try:
+            load_plist(data)
+        except Exception:
+            counts["failed"] += 1
+
+
+def run(trigger, num_saves, coalesce_window):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, "com.example.app%d.plist" % i)
+                 for i in range(NUM_PLISTS)]
+        for path in paths:
+            save(path, plistlib.dumps({}), IN_PLACE)
+        event_queue = BoundedEventQueue()
+        handler = PrefChangedEventHandler(
+            None, event_queue, coalesce_window=coalesce_window,
+            path_filter=PathFilter(), trigger=trigger)
+        observer = handler.observer(tmpdir, recursive=True)
+        observer.start()
+        counts = {"reads": 0, "failed": 0}
+        consumer = threading.Thread(target=consume,
+                                    args=(event_queue, counts))
+        consumer.start()
+
+        start = time.perf_counter()
+        for i in range(num_saves):
+            pref = {"setting%d" % k: "value %d %d" % (k, i)
+                    for k in range(1000)}
+            save(paths[i % NUM_PLISTS], plistlib.dumps(pref), i % 3)
+        elapsed = time.perf_counter() - start
+        # let the last events through
+        time.sleep(0.5 + coalesce_window)
+        observer.stop()
+        observer.join()
+        handler.stop()
+        event_queue.put((None, None, 0))
+        consumer.join()
+    print("%-12s %6.2f reads/save, %6.2f failed parses/save (%.1f saves/sec)" % (
+        trigger, counts["reads"] / num_saves, counts["failed"] / num_saves,
+        num_saves / elapsed))
+
+
+def main():
+    if not sys.platform.startswith("linux"):
+        print("close-write needs inotify, which is only available on Linux")
+        sys.exit(1)
+    num_saves = 200
+    coalesce_window = 0.0
+    if len(sys.argv) > 1:
+        num_saves = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        coalesce_window = int(sys.argv[2]) / 1000.0
+    print("%d saves of %d plists, coalescing %d ms" % (
+        num_saves, NUM_PLISTS, coalesce_window * 1000))
+    for trigger in TRIGGERS:
+        run(trigger, num_saves, coalesce_window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Compare PlistXmlFragSerializer against the original plistlib/ElementTree
+round trip, for dictionaries and arrays of various sizes.
+
+usage: python benchmarks/bench_xmlfrag.py
+"""
+
+import plistlib
+import time
+import xml.etree.ElementTree as ET
+
+from prefsniff.xmlfrag import PlistXmlFragSerializer
+
+
+def legacy_to_xmlfrag(value):
+    # PSChangeTypeCompositeBase.to_xmlfrag() before PlistXmlFragSerializer
+    plist_str = plistlib.dumps(value, fmt=plistlib.FMT_XML).decode('utf-8')
+    plist_str = "".join([line.strip() for line in plist_str.splitlines()])
+    tree = ET.ElementTree(ET.fromstring(plist_str))
+    children = list(tree.getroot())
+    return ET.tostring(children[0]).decode()
+
+
+def make_dict(size):
+    return {"key%d" % i: {"enabled": bool(i % 2),
+                          "value": {"parameters": [65535, i, 1048576],
+                                    "type": "standard"}}
+            for i in range(size)}
+
+
+def make_array(size):
+    return ["/Users/someone/Documents/Recent File %d.txt" % i
+            for i in range(size)]
+
+
+def bench(func, value, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(value)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    uncached = PlistXmlFragSerializer(cache_size=0)
+    cached = PlistXmlFragSerializer()
+    print("%-12s %12s %12s %12s %8s" %
+          ("value", "legacy", "direct", "memoized", "speedup"))
+    for name, make in (("dict", make_dict), ("array", make_array)):
+        for size in (1, 10, 100, 1000, 10000):
+            value = make(size)
+            assert legacy_to_xmlfrag(value) == uncached.serialize(value)
+            rounds = max(3, 20000 // (size * 10))
+            legacy = bench(legacy_to_xmlfrag, value, rounds)
+            direct = bench(uncached.serialize, value, rounds)
+            # warm the cache so this measures repeat serializations
+            cached.serialize(value)
+            memoized = bench(cached.serialize, value, rounds)
+            print("%-12s %9.1f us %9.1f us %9.1f us %7.1fx" %
+                  ("%s[%d]" % (name, size), legacy * 1e6, direct * 1e6,
+                   memoized * 1e6, legacy / direct))
+
+
+if __name__ == "__main__":
+    main()
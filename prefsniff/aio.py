@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+from queue import Empty as QueueEmpty
+from typing import AsyncIterator
+
+from .eventqueue import BLOCK, BoundedEventQueue, event_path
+from .prefsniff import (
+    PlistTreeBaselines,
+    PrefChangedEventHandler,
+    PrefSniff,
+    PrefWatchSession,
+    diff_plist_file
+)
+from .stats import PipelineStats
+
+
+class _AsyncEventQueue:
+    """
+    BoundedEventQueue that wakes an event loop, for watchdog's threads
+
+    put() has the loop put the watch on ``ready``, at most once however
+    many events are waiting.
+    """
+
+    def __init__(self, loop, ready, maxsize=BoundedEventQueue.MAXSIZE,
+                 overflow=BLOCK):
+        self._loop = loop
+        self._ready = ready
+        self._queue = BoundedEventQueue(maxsize, overflow)
+        # whether the watch is on ``ready``; only touched on the loop
+        self._scheduled = False
+        self.watch = None
+
+    def put(self, item):
+        self._queue.put(item)
+        try:
+            self._loop.call_soon_threadsafe(self.schedule)
+        except RuntimeError:
+            # the loop closed while the watch was being stopped
+            pass
+
+    def schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self._ready.put_nowait(self)
+
+    def get_nowait(self):
+        """
+        The next queued event, or None, rescheduling the watch if there are more
+        """
+        self._scheduled = False
+        try:
+            item = self._queue.get_nowait()
+        except QueueEmpty:
+            # coalesced into an event already handled
+            return None
+        if self._queue.qsize():
+            self.schedule()
+        return item
+
+    def close(self):
+        self._queue.close()
+
+
+class _FileWatch:
+    def __init__(self, path, event_queue, coalesce_window, stats, recorder):
+        self.session = PrefWatchSession(
+            path, coalesce_window=coalesce_window, event_queue=event_queue,
+            stats=stats, recorder=recorder)
+
+    def start(self):
+        self.session.start()
+
+    def stop(self):
+        self.session.stop()
+
+    def diff_event(self, event):
+        return self.session.diff_event(event)
+
+
+class _DirectoryWatch:
+    """
+    Recursive watch of every plist under a directory, as in PrefsWatcher
+    """
+
+    def __init__(self, path, event_queue, coalesce_window, stats, recorder):
+        self.path = path
+        self.tree = PlistTreeBaselines(path, stats=stats, recorder=recorder)
+        self.event_handler = PrefChangedEventHandler(
+            None, event_queue, coalesce_window=coalesce_window,
+            path_filter=self.tree.path_filter)
+        self.observer = None
+
+    def start(self):
+        self.observer = self.event_handler.watch(self.path, self.tree.load,
+                                                 recursive=True)
+
+    def stop(self):
+        if self.observer is not None:
+            self.event_handler.unwatch(self.observer)
+            self.observer = None
+
+    def diff_event(self, event) -> PrefSniff:
+        path = self.tree.changed_path(event)
+        if path is None or event[0] == "deleted":
+            # a deleted plist's baseline is kept for diffing its
+            # replacement against
+            return None
+        result = diff_plist_file(*self.tree.diff_args(path, event[2]))
+        self.tree.finish(event, result)
+        return result.diffs
+
+
+async def watch(*paths, coalesce_window=0.1, executor=None,
+                queue_size=BoundedEventQueue.MAXSIZE, overflow=BLOCK,
+                stats: PipelineStats = None,
+                recorder=None) -> AsyncIterator[PrefSniff]:
+    """
+    Asynchronously yield a PrefSniff for each change to any of ``paths``
+
+    Each path may be a plist file or a directory of plists. Plists are read
+    and diffed in ``executor``; the other arguments are as for PrefsWatcher.
+    Unreadable plists are reported on stderr and skipped::
+
+        async for diffs in watch("~/Library/Preferences/com.apple.dock.plist"):
+            for change in diffs.changes:
+                print(change.shell_command())
+    """
+    loop = asyncio.get_running_loop()
+    # each watch's event queue, whenever it has events waiting
+    ready = asyncio.Queue()
+    event_queues = []
+    try:
+        for path in paths:
+            path = os.path.expanduser(path)
+            if os.path.isdir(path):
+                watch_cls = _DirectoryWatch
+            else:
+                watch_cls = _FileWatch
+            event_queue = _AsyncEventQueue(loop, ready, queue_size, overflow)
+            target = watch_cls(path, event_queue, coalesce_window, stats,
+                               recorder)
+            event_queue.watch = target
+            event_queues.append(event_queue)
+            await loop.run_in_executor(executor, target.start)
+
+        while True:
+            event_queue = await ready.get()
+            event = event_queue.get_nowait()
+            if event is None:
+                continue
+            try:
+                diffs = await loop.run_in_executor(
+                    executor, event_queue.watch.diff_event, event)
+            except Exception as e:
+                print("ERROR: %s: %s" % (event_path(event[0], event[1]), e),
+                      file=sys.stderr)
+                continue
+            if diffs is not None:
+                yield diffs
+    finally:
+        for event_queue in event_queues:
+            event_queue.close()
+        # joining an observer blocks, so it's done off the loop
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, event_queue.watch.stop)
+            for event_queue in event_queues))
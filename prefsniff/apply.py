@@ -0,0 +1,172 @@
+import subprocess
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from .changetypes import PSChangeTypeBase
+
+
+class CommandResult:
+    """
+    Outcome of running one change's command
+    """
+
+    def __init__(self, change, argv, returncode, stdout="", stderr="",
+                 elapsed=0.0):
+        self.change = change
+        self.argv = argv
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        # seconds spent running the command
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return "%s(argv=%r, returncode=%r, elapsed=%.3f)" % (
+            self.__class__.__name__, self.argv, self.returncode, self.elapsed)
+
+
+class CommandRunner:
+    """
+    Runs the argv of a single change; subclass and override run()
+    """
+
+    def run(self, argv: List[str], input=None) -> CommandResult:
+        """
+        Run argv, feeding it ``input`` bytes on stdin if not None
+        """
+        raise NotImplementedError("Need to subclass and override run()")
+
+
+class SubprocessRunner(CommandRunner):
+    """
+    Runs each command as a subprocess
+
+    If ``command`` is given, it replaces argv[0], e.g., to run changes
+    against a stand-in for defaults(1) on a system that doesn't have it.
+    """
+
+    def __init__(self, command=None, timeout=None):
+        self.command = command
+        self.timeout = timeout
+
+    def run(self, argv, input=None):
+        if self.command is not None:
+            argv = [self.command] + argv[1:]
+        try:
+            proc = subprocess.run(argv, input=input,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  timeout=self.timeout)
+        except subprocess.TimeoutExpired as e:
+            return CommandResult(None, argv, None,
+                                 stderr="timed out after %s seconds" % e.timeout)
+        except OSError as e:
+            return CommandResult(None, argv, None, stderr=str(e))
+        return CommandResult(None, argv, proc.returncode,
+                             proc.stdout.decode("utf-8", "replace"),
+                             proc.stderr.decode("utf-8", "replace"))
+
+
+class ApplyReport:
+    """
+    Per-command results of applying a set of changes
+
+    ``results`` is in the same order as the changes that were applied.
+    Changes that weren't run because an earlier change to the same domain
+    failed are in ``skipped``.
+    """
+
+    def __init__(self):
+        self.results: List[CommandResult] = []
+        self.skipped: List[PSChangeTypeBase] = []
+        # wall-clock seconds for the whole batch
+        self.elapsed = 0.0
+
+    @property
+    def failures(self) -> List[CommandResult]:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def ok(self):
+        return not self.skipped and not self.failures
+
+    @property
+    def command_time(self):
+        """
+        Total seconds spent running commands, across all workers
+        """
+        return sum(r.elapsed for r in self.results)
+
+
+class ChangeApplier:
+    """
+    Applies a list of changes, running independent domains concurrently
+
+    Changes are grouped by domain (and whether they're -currentHost), and
+    each group is run in its original order on one of up to
+    ``max_workers`` threads, since later changes to a domain may depend
+    on earlier ones, e.g., a -dict-add after the dictionary is rewritten.
+    If ``stop_on_error`` is True, a failed command skips the rest of its
+    domain's changes, but not other domains'.
+    """
+    MAX_WORKERS = 8
+
+    def __init__(self, runner: CommandRunner = None, max_workers=MAX_WORKERS,
+                 stop_on_error=True):
+        if runner is None:
+            runner = SubprocessRunner()
+        self.runner = runner
+        self.max_workers = max_workers
+        self.stop_on_error = stop_on_error
+
+    @staticmethod
+    def group_by_domain(changes):
+        groups = OrderedDict()
+        for index, change in enumerate(changes):
+            group = groups.setdefault((change.domain, change.byhost), [])
+            group.append((index, change))
+        return groups
+
+    def apply(self, changes: List[PSChangeTypeBase]) -> ApplyReport:
+        for change in changes:
+            if not isinstance(change, PSChangeTypeBase):
+                raise TypeError("not a change: %r" % (change,))
+        report = ApplyReport()
+        start = time.perf_counter()
+        groups = self.group_by_domain(changes)
+        results = [None] * len(changes)
+        skipped = [False] * len(changes)
+        if self.max_workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(
+                    lambda group: self._apply_group(group, results, skipped),
+                    groups.values()))
+        else:
+            for group in groups.values():
+                self._apply_group(group, results, skipped)
+        report.results = [r for r in results if r is not None]
+        report.skipped = [ch for ch, skip in zip(changes, skipped) if skip]
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _apply_group(self, group, results, skipped):
+        # each group only writes to its own indices of results and skipped
+        failed = False
+        for index, change in group:
+            if failed:
+                skipped[index] = True
+                continue
+            argv = change.argv(quote=False)
+            start = time.perf_counter()
+            result = self.runner.run(argv, input=change.input_data())
+            result.change = change
+            result.elapsed = time.perf_counter() - start
+            results[index] = result
+            if not result.ok and self.stop_on_error:
+                failed = True
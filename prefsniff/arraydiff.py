@@ -0,0 +1,51 @@
+from typing import List
+
+from .plistdiff import PlistHasher
+
+SAME = "same"
+# new elements added only to the end; defaults(1) can do this with -array-add
+APPEND = "append"
+# anything else: removals, insertions or replacements, reordering
+EDIT = "edit"
+
+
+class ArrayDiff:
+    """
+    Element-wise comparison of two plist arrays
+
+    Elements are reduced to PlistHasher keys so each comparison is O(1)
+    and type-exact. Only the common prefix is needed: defaults(1) can
+    append to an array but not insert into or remove from one, so any
+    change other than an append means rewriting the array.
+    """
+
+    def __init__(self, list1: List, list2: List, hasher: PlistHasher = None):
+        if hasher is None:
+            hasher = PlistHasher()
+        self.list1 = list1
+        self.list2 = list2
+        self.appended = []
+
+        keys1 = [hasher.node_key(v) for v in list1]
+        keys2 = [hasher.node_key(v) for v in list2]
+
+        prefix = 0
+        shortest = min(len(keys1), len(keys2))
+        while prefix < shortest and keys1[prefix] == keys2[prefix]:
+            prefix += 1
+        self.prefix_len = prefix
+
+        if prefix == len(keys1) and prefix == len(keys2):
+            self.kind = SAME
+        elif prefix == len(keys1):
+            self.kind = APPEND
+            self.appended = list2[prefix:]
+        else:
+            self.kind = EDIT
+
+    @property
+    def can_append(self):
+        """
+        Whether the change can be expressed as ``defaults write ... -array-add``
+        """
+        return self.kind == APPEND
@@ -0,0 +1,362 @@
+import datetime
+import mmap
+import plistlib
+import struct
+from hashlib import blake2b
+from typing import Dict, Tuple
+from xml.parsers.expat import ExpatError
+
+BPLIST_MAGIC = b"bplist00"
+
+_INT_FORMATS = {1: "B", 2: "H", 4: "L", 8: "Q"}
+_UNDEFINED = object()
+
+_ARRAY = 0xA0
+_DICT = 0xD0
+_CONTAINERS = (_ARRAY, _DICT)
+
+# what reading a truncated or corrupt file can raise, all reported as
+# plistlib.InvalidFileException, as plistlib itself would
+_DECODE_ERRORS = (struct.error, ValueError, IndexError, TypeError,
+                  KeyError, OverflowError)
+
+# What parsing a corrupt plist can raise: plistlib.InvalidFileException,
+# which is a ValueError, or ExpatError for XML that isn't well formed. A
+# BinaryPlistReader may only raise it once a value is decoded, long
+# after the plist was loaded
+PLIST_ERRORS = (ValueError, ExpatError)
+
+
+class BinaryPlistReader:
+    """
+    Lazily decoded view of a binary (bplist00) plist whose root is a dictionary
+
+    Only the trailer, offset table and root dictionary's key objects are
+    read up front. Values are decoded on first access and cached, exactly
+    as plistlib would decode them. For change detection, raw_digest() hashes
+    a value's encoded object bytes without decoding it, so keys whose bytes
+    are unchanged between two versions of a file need never be decoded;
+    see changed_subsets().
+
+    from_path() memory-maps the file, which is only safe if the file is
+    replaced rather than rewritten in place while the reader is in use;
+    from_bytes() is for data that's already been read.
+
+    Since values are decoded lazily, a corrupt file may only be found out
+    when a value is looked up or digested, which raises
+    plistlib.InvalidFileException just as the constructor does.
+    """
+
+    def __init__(self, buf):
+        # bytes or mmap; both slice to bytes and index to ints
+        self._buf = buf
+        self._mmap = None
+        if self._buf[:8] != BPLIST_MAGIC or len(self._buf) < 40:
+            raise plistlib.InvalidFileException()
+        # (count, int size) -> struct.Struct, for reading ref lists
+        self._structs = {}
+        self._keys = None
+        # top-level key -> object ref of its value
+        self._value_refs: Dict[str, int] = {}
+        try:
+            (offset_size, self._ref_size, num_objects, top_object,
+             offset_table_offset) = struct.unpack(
+                ">6xBBQQQ", self._buf[-32:])
+            self._offsets = self._read_ints(
+                offset_table_offset, num_objects, offset_size)
+            self._table_offset = offset_table_offset
+            self._objects = [_UNDEFINED] * num_objects
+
+            token = self._buf[self._offsets[top_object]]
+            if token & 0xF0 != _DICT:
+                raise plistlib.InvalidFileException(
+                    "root object is not a dict")
+            key_refs, value_refs = self._container_refs(top_object)
+            for key_ref, value_ref in zip(key_refs, value_refs):
+                self._value_refs[self._decode(key_ref)] = value_ref
+        except plistlib.InvalidFileException:
+            raise
+        except _DECODE_ERRORS:
+            raise plistlib.InvalidFileException()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        return cls(bytes(data))
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            reader = cls(mapped)
+        except Exception:
+            mapped.close()
+            raise
+        reader._mmap = mapped
+        return reader
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def encoded_size(self) -> int:
+        """
+        Length of the binary plist, in bytes
+        """
+        return len(self._buf)
+
+    # mapping interface over the top-level dictionary
+    def keys(self):
+        return self._value_refs.keys()
+
+    def __iter__(self):
+        return iter(self._value_refs)
+
+    def __len__(self):
+        return len(self._value_refs)
+
+    def __contains__(self, key):
+        return key in self._value_refs
+
+    def __getitem__(self, key):
+        return self._decode(self._value_refs[key])
+
+    def get(self, key, default=None):
+        if key not in self._value_refs:
+            return default
+        return self[key]
+
+    def items(self):
+        return ((k, self[k]) for k in self._value_refs)
+
+    def to_dict(self) -> Dict:
+        """
+        Fully decoded root dictionary, as plistlib.loads() would return it
+        """
+        return {k: self[k] for k in self._value_refs}
+
+    def raw_digest(self, key) -> bytes:
+        """
+        Digest of the encoded bytes of ``key``'s value and everything it references
+
+        Equal digests mean equal values. Unequal digests almost always mean
+        unequal values, but not quite: the same value can be encoded
+        differently (e.g., an integer in a wider field than needed).
+        """
+        ref = self._value_refs[key]
+        try:
+            return self._digest(ref)
+        except _DECODE_ERRORS:
+            raise plistlib.InvalidFileException()
+
+    def _read_ints(self, offset, count, size):
+        end = offset + count * size
+        if end > len(self._buf):
+            raise ValueError("truncated integer table")
+        if size in _INT_FORMATS:
+            unpacker = self._structs.get((count, size))
+            if unpacker is None:
+                unpacker = struct.Struct(
+                    ">%d%s" % (count, _INT_FORMATS[size]))
+                self._structs[(count, size)] = unpacker
+            return unpacker.unpack_from(self._buf, offset)
+        return tuple(int.from_bytes(self._buf[i:i + size], "big")
+                     for i in range(offset, end, size))
+
+    def _size(self, offset, token_low) -> Tuple[int, int]:
+        # returns (count, offset of first byte after the count)
+        if token_low != 0xF:
+            return token_low, offset + 1
+        size = 1 << (self._buf[offset + 1] & 0x3)
+        count = int.from_bytes(self._buf[offset + 2:offset + 2 + size], "big")
+        return count, offset + 2 + size
+
+    def _container_refs(self, ref):
+        # returns (refs, None) for an array, (key refs, value refs) for a dict
+        offset = self._offsets[ref]
+        token = self._buf[offset]
+        count, start = self._size(offset, token & 0x0F)
+        if token & 0xF0 == _DICT:
+            refs = self._read_ints(start, count * 2, self._ref_size)
+            return refs[:count], refs[count:]
+        return self._read_ints(start, count, self._ref_size), None
+
+    def _object_keys(self):
+        # Per-object comparison keys. A scalar's key is its encoded bytes,
+        # which are self-delimiting: objects are written back to back, so
+        # each one ends where the next one in file order begins. Anything a
+        # writer left between objects just becomes part of the preceding
+        # object's key, which can only make keys differ spuriously, never
+        # match spuriously. Containers start out as None and get a digest
+        # over their token, size, and children's keys once one is needed.
+        if self._keys is None:
+            buf = self._buf
+            starts = sorted(set(self._offsets))
+            ends = dict(zip(starts, starts[1:] + [self._table_offset]))
+            self._keys = [
+                None if buf[offset] & 0xF0 in _CONTAINERS
+                else buf[offset:ends[offset]]
+                for offset in self._offsets]
+        return self._keys
+
+    def _digest(self, ref):
+        keys = self._object_keys()
+        key = keys[ref]
+        if key is not None:
+            return key
+        # mark as in progress, in case of a reference cycle
+        keys[ref] = b""
+
+        offset = self._offsets[ref]
+        token = self._buf[offset]
+        count, start = self._size(offset, token & 0x0F)
+        if token & 0xF0 == _DICT:
+            refs = self._read_ints(start, count * 2, self._ref_size)
+        else:
+            refs = self._read_ints(start, count, self._ref_size)
+        child_keys = [keys[child] for child in refs]
+        if None in child_keys:
+            child_keys = [self._digest(child) for child in refs]
+        # Container keys are a fixed 17 bytes, so with scalars being
+        # self-delimiting, the concatenated child keys are unambiguous.
+        prefix = bytes((token & 0xF0,))
+        key = prefix + blake2b(
+            prefix + count.to_bytes(8, "big") + b"".join(child_keys),
+            digest_size=16).digest()
+        keys[ref] = key
+        return key
+
+    def _decode(self, ref):
+        try:
+            result = self._objects[ref]
+            if result is not _UNDEFINED:
+                return result
+            buf = self._buf
+            offset = self._offsets[ref]
+            token = buf[offset]
+        except _DECODE_ERRORS:
+            raise plistlib.InvalidFileException()
+        token_high = token & 0xF0
+        token_low = token & 0x0F
+
+        try:
+            if token == 0x00:
+                result = None
+            elif token == 0x08:
+                result = False
+            elif token == 0x09:
+                result = True
+            elif token == 0x0F:
+                result = b""
+            elif token_high == 0x10:
+                result = int.from_bytes(
+                    buf[offset + 1:offset + 1 + (1 << token_low)],
+                    "big", signed=token_low >= 3)
+            elif token == 0x22:
+                result = struct.unpack(">f", buf[offset + 1:offset + 5])[0]
+            elif token == 0x23:
+                result = struct.unpack(">d", buf[offset + 1:offset + 9])[0]
+            elif token == 0x33:
+                seconds = struct.unpack(">d", buf[offset + 1:offset + 9])[0]
+                # binary plist dates count from 1/1/2001
+                result = (datetime.datetime(2001, 1, 1) +
+                          datetime.timedelta(seconds=seconds))
+            elif token_high == 0x40:
+                count, start = self._size(offset, token_low)
+                result = bytes(buf[start:start + count])
+                if len(result) != count:
+                    raise plistlib.InvalidFileException()
+            elif token_high == 0x50:
+                count, start = self._size(offset, token_low)
+                result = bytes(buf[start:start + count]).decode("ascii")
+            elif token_high == 0x60:
+                count, start = self._size(offset, token_low)
+                result = bytes(
+                    buf[start:start + count * 2]).decode("utf-16be")
+            elif token_high == 0x80:
+                result = plistlib.UID(int.from_bytes(
+                    buf[offset + 1:offset + 2 + token_low], "big"))
+            elif token_high == _ARRAY:
+                refs, _ = self._container_refs(ref)
+                result = []
+                self._objects[ref] = result
+                result.extend(self._decode(child) for child in refs)
+            elif token_high == _DICT:
+                key_refs, value_refs = self._container_refs(ref)
+                result = {}
+                self._objects[ref] = result
+                for k, v in zip(key_refs, value_refs):
+                    result[self._decode(k)] = self._decode(v)
+            else:
+                raise plistlib.InvalidFileException()
+        except plistlib.InvalidFileException:
+            raise
+        except _DECODE_ERRORS:
+            raise plistlib.InvalidFileException()
+
+        self._objects[ref] = result
+        return result
+
+
+def load_plist(data: bytes):
+    """
+    Parse plist data, lazily if it's a binary plist with a dictionary at its root
+
+    Returns a BinaryPlistReader, or for XML and other plists, whatever
+    plistlib.loads() returns.
+    """
+    if data[:8] == BPLIST_MAGIC:
+        try:
+            return BinaryPlistReader.from_bytes(data)
+        except plistlib.InvalidFileException:
+            pass
+    return plistlib.loads(data)
+
+
+def materialize(pref):
+    """
+    Fully decoded form of a plist returned by load_plist()
+    """
+    if isinstance(pref, BinaryPlistReader):
+        return pref.to_dict()
+    return pref
+
+
+def changed_subsets(before, after) -> Tuple[Dict, Dict]:
+    """
+    Reduce two plists to just the top-level keys that may differ
+
+    When both are BinaryPlistReaders, keys present in both whose raw
+    digests match are dropped without being decoded, and only the rest
+    are decoded. Diffing the returned pair yields exactly the changes
+    diffing the full plists would. Preferences are dictionaries, so a
+    plist with anything else at its root, as a file caught mid-write can
+    appear to have, raises plistlib.InvalidFileException.
+    """
+    if not (isinstance(before, BinaryPlistReader) and
+            isinstance(after, BinaryPlistReader)):
+        before = materialize(before)
+        after = materialize(after)
+        if not (isinstance(before, dict) and isinstance(after, dict)):
+            raise plistlib.InvalidFileException("root object is not a dict")
+        return before, after
+    before_subset = {}
+    after_subset = {}
+    for key in after.keys():
+        if key in before and before.raw_digest(key) == after.raw_digest(key):
+            continue
+        after_subset[key] = after[key]
+        if key in before:
+            before_subset[key] = before[key]
+    for key in before.keys():
+        if key not in after:
+            before_subset[key] = before[key]
+    return before_subset, after_subset
@@ -1,16 +1,13 @@
-import inspect
 import plistlib
-import xml.etree.ElementTree as ET
 from abc import ABCMeta
 from shlex import quote as cmd_quote
 from typing import Dict
 
-from py_dict_repr.py_dict_repr import DictRepr
-
 from .exceptions import (
     PSChangeTypeException,
     PSChangeTypeNotImplementedException
 )
+from .xmlfrag import plist_to_xmlfrag
 
 
 class PSChangeTypeRegistry(type):
@@ -49,7 +46,17 @@ class PSChangeTypeFactory:
         return obj
 
 
-class PSChangeTypeBase(DictRepr, metaclass=PSChangeTypeMeta):
+class PSChangeTypeBase(metaclass=PSChangeTypeMeta):
+    """
+    One defaults(1) command
+
+    Change objects are numerous and short-lived, so every subclass declares
+    __slots__, and none has a per-instance __dict__. They behave as
+    read-only mappings of keys() for dict(change); to_dict() is the cheap
+    way to get the same thing.
+    """
+    __slots__ = ("command", "action", "domain", "key", "type", "value",
+                 "converted_value", "byhost")
     CHANGE_TYPE = None
     COMMAND = "defaults"
     ACTION = None
@@ -73,6 +80,26 @@ class PSChangeTypeBase(DictRepr, metaclass=PSChangeTypeMeta):
                  "domain", "key", "type", "value", "byhost"]
         return _keys
 
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        # (key, value) pairs, as DictRepr used to yield
+        return self.items()
+
+    def items(self):
+        return ((k, getattr(self, k)) for k in self.keys())
+
+    def to_dict(self) -> Dict:
+        """
+        The change's fields as a plain dictionary, suitable for from_dict()
+
+        Values are shared with the change rather than copied.
+        """
+        return {k: getattr(self, k) for k in self.keys()}
+
     @classmethod
     def from_dict(cls, ch_type_dict: Dict):
         domain = ch_type_dict["domain"]
@@ -124,6 +151,12 @@ class PSChangeTypeBase(DictRepr, metaclass=PSChangeTypeMeta):
 
         return value_argv
 
+    def input_data(self):
+        """
+        Bytes the command expects on stdin, if any
+        """
+        return None
+
     def shell_command(self):
         argv = self.argv(quote=True)
         command = ' '.join(argv)
@@ -131,12 +164,14 @@ class PSChangeTypeBase(DictRepr, metaclass=PSChangeTypeMeta):
 
 
 class PSChangeTypeString(PSChangeTypeBase):
+    __slots__ = ()
     CHANGE_TYPE = "string"
     ACTION = "write"
     TYPE = "string"
 
 
 class PSChangeTypeKeyDeleted(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "deleted"
     ACTION = "delete"
     TYPE = None
@@ -146,6 +181,7 @@ class PSChangeTypeKeyDeleted(PSChangeTypeString):
 
 
 class PSChangeTypeFloat(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "float"
     TYPE = "float"
 
@@ -160,6 +196,7 @@ class PSChangeTypeFloat(PSChangeTypeString):
 
 
 class PSChangeTypeInt(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "int"
     TYPE = "int"
 
@@ -173,6 +210,7 @@ class PSChangeTypeInt(PSChangeTypeString):
 
 
 class PSChangeTypeBool(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "bool"
     TYPE = "bool"
 
@@ -184,37 +222,18 @@ class PSChangeTypeBool(PSChangeTypeString):
 
 
 class PSChangeTypeCompositeBase(PSChangeTypeBase):
+    __slots__ = ()
     CHANGE_TYPE = None
     TYPE = None
 
     def to_xmlfrag(self, value):
-
-        # create plist-serialized form of changed objects
-        plist_str = plistlib.dumps(value, fmt=plistlib.FMT_XML).decode('utf-8')
-
-        # remove newlines and tabs from plist
-        plist_str = "".join([line.strip() for line in plist_str.splitlines()])
-        # parse the plist xml doc, so we can pull out the important parts.
-        tree = ET.ElementTree(ET.fromstring(plist_str))
-        # get elements inside <plist> </plist>
-        children = list(tree.getroot())
-        # there can only be one element inside <plist>
-        if len(children) < 1:
-            fn = inspect.getframeinfo(inspect.currentframe()).function
-            raise PSChangeTypeException(
-                "%s: Empty dictionary for key %s" % (fn, str(self.key)))
-        if len(children) > 1:
-            fn = inspect.getframeinfo(inspect.currentframe()).function
-            raise PSChangeTypeException(
-                "%s: Something went wrong for key %s. Can only support one dictionary for dict change." % (fn, self.dict_key))
-        # extract changed objects out of the plist element
-        # python 2 & 3 compat
-        # https://stackoverflow.com/questions/15304229/convert-python-elementtree-to-string#15304351
-        xmlfrag = ET.tostring(children[0]).decode()
-        return xmlfrag
+        # serialize straight to an XML fragment, e.g.
+        # <dict><key>enabled</key><true /></dict>
+        return plist_to_xmlfrag(value)
 
 
 class PSChangeTypeArray(PSChangeTypeCompositeBase):
+    __slots__ = ()
     CHANGE_TYPE = "array"
     ACTION = "write"
     TYPE = None
@@ -228,6 +247,7 @@ class PSChangeTypeArray(PSChangeTypeCompositeBase):
 
 
 class PSChangeTypeDict(PSChangeTypeCompositeBase):
+    __slots__ = ()
     CHANGE_TYPE = "dict"
     ACTION = "write"
     # We have to omit the -dict type
@@ -243,6 +263,7 @@ class PSChangeTypeDict(PSChangeTypeCompositeBase):
 
 
 class PSChangeTypeDictAdd(PSChangeTypeCompositeBase):
+    __slots__ = ("subkey",)
     CHANGE_TYPE = "dict-add"
     ACTION = "write"
     TYPE = "dict-add"
@@ -280,11 +301,84 @@ class PSChangeTypeDictAdd(PSChangeTypeCompositeBase):
     #     return " %s '%s'" % (self.dict_key, xmlfrag)
 
 
+class PSChangeTypeDictAddMultiple(PSChangeTypeCompositeBase):
+    """
+    Several -dict-add sub-key/value pairs for the same key in one command
+    """
+    __slots__ = ()
+    CHANGE_TYPE = "dict-add-multiple"
+    ACTION = "write"
+    TYPE = "dict-add"
+
+    def __init__(self, domain, byhost, key, value):
+        if not isinstance(value, dict):
+            raise PSChangeTypeException(
+                "Dict of sub-keys to add required for -dict-add prefs change.")
+        super().__init__(domain, byhost, key, value)
+        self.converted_value = self._generate_value_string(value)
+
+    def _generate_value_string(self, value):
+        values = []
+        for subkey, subval in value.items():
+            values.append(subkey)
+            values.append(self.to_xmlfrag(subval))
+        return values
+
+
+class PSChangeTypeImport(PSChangeTypeBase):
+    """
+    Replace an entire domain with the plist fed to defaults import on stdin
+    """
+    __slots__ = ("_plist_data",)
+    CHANGE_TYPE = "import"
+    ACTION = "import"
+    TYPE = None
+    HEREDOC_DELIMITER = "PREFSNIFF_PLIST"
+
+    def __init__(self, domain, byhost, value):
+        if not isinstance(value, dict):
+            raise PSChangeTypeException(
+                "Dict required for import prefs change.")
+        super().__init__(domain, byhost, None, value)
+        self.converted_value = None
+        # serialize up front, so a value plistlib can't handle fails here
+        self._plist_data = plistlib.dumps(value, fmt=plistlib.FMT_XML)
+
+    @classmethod
+    def from_dict(cls, ch_type_dict: Dict):
+        domain = ch_type_dict["domain"]
+        byhost = ch_type_dict["byhost"]
+        value = ch_type_dict["value"]
+        obj = cls(domain, byhost, value)
+        return obj
+
+    def argv(self, quote=True):
+        argv = [self.command]
+        if self.byhost:
+            argv.append("-currentHost")
+        argv.append(self._quote(self.action, quote=quote))
+        argv.append(self._quote(self.domain, quote=quote))
+        argv.append("-")
+        return argv
+
+    def input_data(self):
+        return self._plist_data
+
+    def shell_command(self):
+        plist_str = self._plist_data.decode("utf-8")
+        delimiter = self.HEREDOC_DELIMITER
+        while delimiter in plist_str.splitlines():
+            delimiter += "_"
+        command = ' '.join(self.argv(quote=True))
+        return "%s <<'%s'\n%s%s" % (command, delimiter, plist_str, delimiter)
+
+
 class PSChangeTypeArrayAdd(PSChangeTypeArray):
+    __slots__ = ()
     CHANGE_TYPE = "array-add"
     TYPE = "array-add"
 
-    def __init__(self, domain, key, byhost, value):
+    def __init__(self, domain, byhost, key, value):
         super().__init__(domain, byhost, key, value)
         self.converted_value = self._generate_value_string(value)
 
@@ -296,6 +390,7 @@ class PSChangeTypeArrayAdd(PSChangeTypeArray):
 
 
 class PSChangeTypeData(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "data"
 
     def __init__(self, domain, byhost, key, value):
@@ -304,6 +399,7 @@ class PSChangeTypeData(PSChangeTypeString):
 
 
 class PSChangeTypeDate(PSChangeTypeString):
+    __slots__ = ()
     CHANGE_TYPE = "date"
 
     def __init__(self, domain, byhost, key, value):
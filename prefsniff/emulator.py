@@ -0,0 +1,194 @@
+import copy
+import plistlib
+from typing import Dict, List
+from xml.parsers.expat import ExpatError
+
+from .apply import CommandResult, CommandRunner
+from .bplist import materialize
+from .changetypes import PSChangeTypeBase
+from .exceptions import DefaultsEmulatorException
+from .plistdiff import PlistHasher
+
+_TRUE_STRINGS = ("true", "yes", "1")
+_FALSE_STRINGS = ("false", "no", "0")
+
+
+class DefaultsEmulator(CommandRunner):
+    """
+    In-memory stand-in for defaults(1), for checking generated commands
+
+    Understands the subset of defaults that prefsniff generates: typed and
+    untyped (XML fragment) writes, -dict-add, -array-add, delete, and
+    import. Domains are plain dictionaries keyed by (domain, byhost), so
+    "com.apple.dock" and a plist path are just different names. As a
+    CommandRunner it can also stand in for the real thing under
+    ChangeApplier.
+    """
+
+    def __init__(self):
+        # (domain, byhost) -> top-level dictionary
+        self.domains: Dict = {}
+
+    def set_domain(self, domain, plist: Dict, byhost=False):
+        self.domains[(domain, byhost)] = copy.deepcopy(plist)
+
+    def get_domain(self, domain, byhost=False) -> Dict:
+        return self.domains.get((domain, byhost), {})
+
+    def run(self, argv, input=None):
+        try:
+            self.execute(argv, input=input)
+        except DefaultsEmulatorException as e:
+            return CommandResult(None, argv, 1, stderr=str(e))
+        return CommandResult(None, argv, 0)
+
+    def apply(self, changes: List[PSChangeTypeBase]):
+        """
+        Run each change's command, raising DefaultsEmulatorException on the
+        first one that fails
+        """
+        for change in changes:
+            if not isinstance(change, PSChangeTypeBase):
+                # e.g., an error message in place of an unsupported change
+                raise DefaultsEmulatorException("not a change: %s" % change)
+            self.execute(change.argv(quote=False), input=change.input_data())
+
+    def execute(self, argv, input=None):
+        args = list(argv[1:])
+        byhost = False
+        if args and args[0] == "-currentHost":
+            byhost = True
+            args.pop(0)
+        if len(args) < 2:
+            raise DefaultsEmulatorException("too few arguments: %r" % argv)
+        action, domain, args = args[0], args[1], args[2:]
+        if action == "write":
+            self._write(domain, byhost, args)
+        elif action == "delete":
+            self._delete(domain, byhost, args)
+        elif action == "import":
+            self._import(domain, byhost, args, input)
+        else:
+            raise DefaultsEmulatorException("unsupported action: %s" % action)
+
+    def _write(self, domain, byhost, args):
+        if len(args) < 2:
+            raise DefaultsEmulatorException("write needs a key and a value")
+        prefs = self.domains.setdefault((domain, byhost), {})
+        key, type_arg, values = args[0], args[1], args[2:]
+        if not type_arg.startswith("-"):
+            if values:
+                raise DefaultsEmulatorException(
+                    "unexpected arguments: %r" % values)
+            prefs[key] = self._parse_value(type_arg)
+        elif type_arg == "-dict-add":
+            # like defaults(1), only a missing key may be created, never
+            # a value of another type replaced
+            existing = prefs.get(key, {})
+            if not isinstance(existing, dict):
+                raise DefaultsEmulatorException(
+                    "value for key %s is not a dictionary" % key)
+            existing.update(self._parse_pairs(values))
+            prefs[key] = existing
+        elif type_arg == "-array-add":
+            existing = prefs.get(key, [])
+            if not isinstance(existing, list):
+                raise DefaultsEmulatorException(
+                    "value for key %s is not an array" % key)
+            existing.extend(self._parse_value(v) for v in values)
+            prefs[key] = existing
+        elif type_arg == "-dict":
+            prefs[key] = self._parse_pairs(values)
+        elif type_arg == "-array":
+            prefs[key] = [self._parse_value(v) for v in values]
+        else:
+            if len(values) != 1:
+                raise DefaultsEmulatorException(
+                    "%s takes one value, got %r" % (type_arg, values))
+            prefs[key] = self._parse_typed(type_arg, values[0])
+
+    def _delete(self, domain, byhost, args):
+        if not args:
+            self.domains.pop((domain, byhost), None)
+            return
+        prefs = self.domains.get((domain, byhost), {})
+        if args[0] not in prefs:
+            raise DefaultsEmulatorException(
+                "key %s does not exist in domain %s" % (args[0], domain))
+        del prefs[args[0]]
+
+    def _import(self, domain, byhost, args, input):
+        if args != ["-"]:
+            raise DefaultsEmulatorException(
+                "only importing from stdin is supported")
+        try:
+            plist = plistlib.loads(input)
+        except (plistlib.InvalidFileException, ExpatError, TypeError) as e:
+            raise DefaultsEmulatorException("couldn't parse import: %s" % e)
+        if not isinstance(plist, dict):
+            raise DefaultsEmulatorException("imported plist isn't a dictionary")
+        self.domains[(domain, byhost)] = plist
+
+    def _parse_pairs(self, values):
+        if len(values) % 2:
+            raise DefaultsEmulatorException(
+                "key/value pairs expected, got %r" % values)
+        pairs = {}
+        for i in range(0, len(values), 2):
+            pairs[values[i]] = self._parse_value(values[i + 1])
+        return pairs
+
+    @staticmethod
+    def _parse_value(value):
+        # defaults parses untyped values as property lists, falling back
+        # to a plain string
+        if not value.startswith("<"):
+            return value
+        document = '<plist version="1.0">%s</plist>' % value
+        try:
+            return plistlib.loads(document.encode("utf-8"))
+        except (plistlib.InvalidFileException, ExpatError, ValueError):
+            return value
+
+    @staticmethod
+    def _parse_typed(type_arg, value):
+        try:
+            if type_arg == "-string":
+                return value
+            if type_arg in ("-int", "-integer"):
+                return int(value)
+            if type_arg == "-float":
+                return float(value)
+            if type_arg in ("-bool", "-boolean"):
+                if value.lower() in _TRUE_STRINGS:
+                    return True
+                if value.lower() in _FALSE_STRINGS:
+                    return False
+                raise ValueError(value)
+            if type_arg == "-data":
+                return bytes.fromhex(value)
+        except ValueError:
+            raise DefaultsEmulatorException(
+                "invalid value for %s: %r" % (type_arg, value))
+        raise DefaultsEmulatorException("unsupported type: %s" % type_arg)
+
+
+def round_trip(diffs, changes=None, hasher=None) -> bool:
+    """
+    Check that a PrefSniff's changes turn its "before" plist into its "after"
+
+    ``changes`` defaults to diffs.changes; pass e.g. a ChangePlan's changes
+    to check those instead. Comparison is type-exact, so writing 1 where
+    True was expected counts as a failure.
+    """
+    if changes is None:
+        changes = diffs.changes
+    if hasher is None:
+        hasher = PlistHasher()
+    emulator = DefaultsEmulator()
+    before = materialize(diffs.before)
+    after = materialize(diffs.after)
+    emulator.set_domain(diffs.pref_domain, before, byhost=diffs.byhost)
+    emulator.apply(changes)
+    return hasher.same(emulator.get_domain(diffs.pref_domain, diffs.byhost),
+                       after)
@@ -0,0 +1,246 @@
+import os
+import struct
+import time
+import zlib
+from typing import Iterator
+
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent
+)
+
+from . import pathindex
+from .eventqueue import event_path
+from .exceptions import PSniffException
+from .pathindex import PlistPathInfo
+
+MAGIC = b"PSNIFFEV\x01"
+
+# record kinds
+BASELINE = 0
+EVENT_KINDS = {"created": 1, "deleted": 2, "modified": 3, "moved": 4}
+EVENT_TYPES = {kind: event_type for event_type, kind in EVENT_KINDS.items()}
+_EVENT_CLASSES = {"created": FileCreatedEvent,
+                  "deleted": FileDeletedEvent,
+                  "modified": FileModifiedEvent}
+
+# data lengths with special meanings
+DATA_MISSING = 0xFFFFFFFF
+DATA_UNCHANGED = 0xFFFFFFFE
+
+# path facts that can't be worked out from the path alone on another
+# machine
+ROOT_OWNED = 0x01
+STANDARD = 0x02
+
+# kind, path facts, seconds since recording started, raw event count,
+# path length, data length
+_RECORD = struct.Struct("<BBdHHI")
+
+
+class EventLogException(PSniffException):
+    pass
+
+
+class EventLogRecord:
+    """
+    One plist's baseline, or one event and what the plist looked like after it
+
+    ``event_type`` is None for a baseline. ``data`` is None if the watcher
+    didn't read the plist, e.g. because it had been deleted or hadn't
+    changed.
+    """
+    __slots__ = ("event_type", "flags", "time", "raw_event_count", "path",
+                 "data")
+
+    def __init__(self, event_type, flags, time, raw_event_count, path, data):
+        self.event_type = event_type
+        self.flags = flags
+        self.time = time
+        self.raw_event_count = raw_event_count
+        self.path = path
+        self.data = data
+
+    def event(self):
+        """
+        A watchdog event standing in for the one recorded
+        """
+        if self.event_type == "moved":
+            # only where it was moved to is recorded
+            return FileMovedEvent("", self.path)
+        return _EVENT_CLASSES[self.event_type](self.path)
+
+    def path_info(self) -> PlistPathInfo:
+        """
+        The plist's path facts as they were where it was recorded
+        """
+        byhost = pathindex.is_byhost(self.path)
+        root_owned = bool(self.flags & ROOT_OWNED)
+        standard = bool(self.flags & STANDARD)
+        domain = pathindex.plist_domain(
+            self.path, byhost, pathindex.is_nsglobaldomain(self.path),
+            root_owned, standard, self.path)
+        return PlistPathInfo(domain, byhost, root_owned, standard)
+
+
+class RecordedPathIndex:
+    """
+    Stands in for a PlistPathIndex when replaying, with the path facts in the log
+
+    The plists needn't exist, so update() changes nothing and get() is
+    whatever was last recorded for a path.
+    """
+
+    def __init__(self):
+        # plist path -> (record flags, PlistPathInfo)
+        self._paths = {}
+
+    def add(self, record: EventLogRecord):
+        known = self._paths.get(record.path)
+        if known is None or known[0] != record.flags:
+            self._paths[record.path] = (record.flags, record.path_info())
+
+    def update(self, event_type, event):
+        pass
+
+    def get(self, path) -> PlistPathInfo:
+        known = self._paths.get(path)
+        if known is None:
+            return None
+        return known[1]
+
+
+class EventLogWriter:
+    """
+    Records watch events, and the plist data they led to, to a compact binary log
+
+    Each record is a fixed-size header, the plist's path, and its data,
+    zlib-compressed. Data that's the same as what was last recorded for
+    the same path isn't stored again. The header carries the path facts
+    that depend on the recording machine, whether the plist is root
+    owned and in a standard preferences directory, so a replay generates
+    the same commands anywhere. baseline() records what a plist
+    looked like when watching started, and record() an event along with
+    the data the watcher read for it; the log never reads plists itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._start = time.monotonic()
+        # path -> last data recorded for it
+        self._last = {}
+        # path -> its path facts, as record flags
+        self._flags = {}
+        self.records = 0
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def baseline(self, path, data, path_info: PlistPathInfo = None):
+        self._note_path_info(path, path_info)
+        self._write(BASELINE, 1, path, data)
+
+    def record(self, event_type, event, raw_event_count, data,
+               path_info: PlistPathInfo = None):
+        """
+        Record a queued event, and the data read for it, or None if none was
+        """
+        path = event_path(event_type, event)
+        self._note_path_info(path, path_info)
+        self._write(EVENT_KINDS[event_type], raw_event_count, path, data)
+        # so a recording cut short by a kill loses little
+        self._file.flush()
+
+    def _note_path_info(self, path, path_info):
+        if path_info is not None:
+            flags = 0
+            if path_info.root_owned:
+                flags |= ROOT_OWNED
+            if path_info.standard:
+                flags |= STANDARD
+            self._flags[path] = flags
+        elif path not in self._flags:
+            # gone before its owner could be looked up
+            flags = 0
+            if pathindex.is_standard_path(path):
+                flags |= STANDARD
+            self._flags[path] = flags
+
+    def _write(self, kind, raw_event_count, path, data):
+        encoded_path = os.fsencode(path)
+        if data is None:
+            payload = b""
+            data_len = DATA_MISSING
+        elif self._last.get(path) == data:
+            payload = b""
+            data_len = DATA_UNCHANGED
+        else:
+            self._last[path] = data
+            payload = zlib.compress(data)
+            data_len = len(payload)
+        self._file.write(_RECORD.pack(
+            kind, self._flags.get(path, 0), time.monotonic() - self._start,
+            min(raw_event_count, 0xFFFF), len(encoded_path), data_len))
+        self._file.write(encoded_path)
+        self._file.write(payload)
+        self.records += 1
+
+
+def read_event_log(path) -> Iterator[EventLogRecord]:
+    """
+    Yield the records in an event log, in the order they were recorded
+
+    A record cut short at the end of the log, as when prefsniff was
+    killed while recording, ends the log.
+    """
+    # path -> last data read for it
+    last = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise EventLogException("%s isn't a prefsniff event log" % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if not header:
+                break
+            if len(header) < _RECORD.size:
+                break
+            kind, flags, when, raw_event_count, path_len, data_len = \
+                _RECORD.unpack(header)
+            encoded_path = f.read(path_len)
+            if len(encoded_path) < path_len:
+                break
+            plist_path = os.fsdecode(encoded_path)
+            if data_len == DATA_MISSING:
+                data = None
+            elif data_len == DATA_UNCHANGED:
+                data = last.get(plist_path)
+            else:
+                payload = f.read(data_len)
+                if len(payload) < data_len:
+                    break
+                try:
+                    data = zlib.decompress(payload)
+                except zlib.error as e:
+                    raise EventLogException(
+                        "corrupt record in %s: %s" % (path, e))
+                last[plist_path] = data
+            if kind == BASELINE:
+                event_type = None
+            else:
+                try:
+                    event_type = EVENT_TYPES[kind]
+                except KeyError:
+                    raise EventLogException(
+                        "unknown record kind %d in %s" % (kind, path))
+            yield EventLogRecord(event_type, flags, when, raw_event_count,
+                                 plist_path, data)
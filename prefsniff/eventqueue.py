@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+
+OVERFLOW_POLICIES = [BLOCK, DROP_OLDEST, COALESCE]
+
+
+def event_path(event_type, event):
+    """
+    The path an event is about: for moves, where the file ended up
+    """
+    if event_type == "moved":
+        return event.dest_path
+    return event.src_path
+
+
+class BoundedEventQueue:
+    """
+    Queue of (event_type, event, raw_event_count) tuples holding at most ``maxsize``
+
+    What put() does when the queue is full depends on ``overflow``:
+
+    - BLOCK: wait for room, holding up the observer's thread and leaving
+      events to back up in the kernel.
+    - DROP_OLDEST: discard the oldest queued event to make room.
+    - COALESCE: fold events into any event already queued for the same
+      path, which keeps its place in line but takes on the new event's
+      type and adds its raw event count. This happens whether or not the
+      queue is full, since a plist is read when its event is handled,
+      not when the event arrives, so a second event for it would be
+      redundant. When the queue is full of distinct paths, put() waits.
+
+    ``depth``, ``high_water``, ``dropped`` and ``coalesced`` say how the
+    queue has coped. close() wakes any put() that's waiting, and makes
+    later ones do nothing, so an observer can always be stopped.
+    """
+    MAXSIZE = 10000
+
+    def __init__(self, maxsize=MAXSIZE, overflow=BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy: %s" % overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        # queued [event_type, event, raw_event_count] lists
+        self._items = deque()
+        # path -> queued list, when coalescing
+        self._by_path = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def qsize(self):
+        return len(self._items)
+
+    def put(self, item):
+        event_type, event, raw_event_count = item
+        path = None
+        if self.overflow == COALESCE:
+            path = event_path(event_type, event)
+        with self._cond:
+            while not self._closed:
+                if path is not None:
+                    queued = self._by_path.get(path)
+                    if queued is not None:
+                        queued[0] = event_type
+                        queued[1] = event
+                        queued[2] += raw_event_count
+                        self.coalesced += 1
+                        return
+                if len(self._items) < self.maxsize:
+                    break
+                if self.overflow == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                self._cond.wait()
+            if self._closed:
+                return
+            queued = [event_type, event, raw_event_count]
+            self._items.append(queued)
+            if path is not None:
+                self._by_path[path] = queued
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if not self._items:
+                if not block:
+                    raise Empty
+                deadline = None
+                if timeout is not None:
+                    deadline = time.monotonic() + timeout
+                while not self._items:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Empty
+                    self._cond.wait(remaining)
+            queued = self._items.popleft()
+            if self._by_path:
+                path = event_path(queued[0], queued[1])
+                if self._by_path.get(path) is queued:
+                    del self._by_path[path]
+            self._cond.notify_all()
+            return tuple(queued)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def metrics(self):
+        return {"depth": self.depth,
+                "high_water": self.high_water,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced}
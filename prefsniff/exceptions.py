@@ -8,3 +8,7 @@ class PSChangeTypeException(PSniffException):
 
 class PSChangeTypeNotImplementedException(PSChangeTypeException):
     pass
+
+
+class DefaultsEmulatorException(PSniffException):
+    pass
@@ -0,0 +1,105 @@
+import base64
+import datetime
+import json
+import threading
+from typing import Dict, Iterator
+
+from .changetypes import PSChangeTypeBase
+
+
+def _json_default(value):
+    # plist types JSON has no equivalent for
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError("can't serialize %s" % type(value).__name__)
+
+
+def change_records(changes, path, timestamp, raw_event_count=1) -> Iterator[Dict]:
+    """
+    One NDJSON record per change: its keys() fields, plus where and when
+    the change came from
+
+    Entries that aren't changes (error messages standing in for changes
+    that can't be expressed) become records with a change_type of "error".
+    """
+    when = datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).isoformat()
+    for change in changes:
+        if isinstance(change, PSChangeTypeBase):
+            record = change.to_dict()
+        else:
+            record = {"change_type": "error", "error": str(change)}
+        record["path"] = path
+        record["timestamp"] = when
+        record["raw_event_count"] = raw_event_count
+        yield record
+
+
+def ndjson_lines(records) -> str:
+    return "".join(json.dumps(record, default=_json_default) + "\n"
+                   for record in records)
+
+
+class BufferedOutputWriter:
+    """
+    Buffers text for a stream, writing it out in large chunks
+
+    Buffered text is written once ``max_bytes`` have accumulated, or
+    ``max_delay`` seconds after the first unwritten text was buffered,
+    whichever comes first, so a reader tailing the stream never waits
+    longer than ``max_delay``. A ``max_delay`` of 0 writes through
+    immediately.
+    """
+    MAX_BYTES = 64 * 1024
+    MAX_DELAY = 0.25
+
+    def __init__(self, stream, max_bytes=MAX_BYTES, max_delay=MAX_DELAY):
+        self.stream = stream
+        # measured in characters, which is close enough
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._chunks = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._timer = None
+        self.flushes = 0
+
+    def write(self, text: str):
+        if not text:
+            return
+        with self._lock:
+            self._chunks.append(text)
+            self._size += len(text)
+            if self._size >= self.max_bytes or not self.max_delay:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._chunks:
+            return
+        self.stream.write("".join(self._chunks))
+        self.stream.flush()
+        self._chunks = []
+        self._size = 0
+        self.flushes += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,121 @@
+import re
+
+PLIST_PATTERN = r".*\.plist\Z"
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a glob into a regular expression matching whole paths
+
+    ``*`` and ``?`` don't match across a ``/``, but ``**`` does. A glob that
+    doesn't start with ``/`` matches the trailing components of a path, so
+    "com.apple.*" matches any plist whose name starts with "com.apple."
+    and "ByHost/*" matches anything directly under a ByHost directory.
+    """
+    i = 0
+    n = len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if i < n and pattern[i] == "*":
+                i += 1
+                parts.append(".*")
+            else:
+                parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            # a ] straight after the [ or [! is part of the set
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            end = pattern.find("]", j)
+            if end < 0:
+                parts.append(re.escape(c))
+                continue
+            # as fnmatch.translate() does: backslashes are literal, so are
+            # escaped before anything else adds one
+            chars = pattern[i:end].replace("\\", "\\\\")
+            i = end + 1
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith(("^", "[")):
+                chars = "\\" + chars
+            parts.append("[%s]" % chars)
+        else:
+            parts.append(re.escape(c))
+    regex = "".join(parts) + r"\Z"
+    if not pattern.startswith("/"):
+        regex = "(?:.*/)?" + regex
+    return regex
+
+
+class PathFilter:
+    """
+    Include and exclude patterns, checked with as few matches as possible
+
+    A path passes if it's a plist, matches any include pattern (or there
+    are none), and matches no exclude pattern. Globs are translated by
+    glob_to_regex() and combined into a single pattern up front, so
+    checking an event's path against them is one match() however many
+    there are. Regular expressions are searched for anywhere in the
+    path, each on its own, since a user's pattern may have flags or
+    backreferences that only work at the start of a pattern of its own.
+
+    accept() also counts the paths it passes and drops, which is how
+    PrefChangedEventHandler uses it.
+    """
+
+    def __init__(self, include=None, exclude=None, include_regex=None,
+                 exclude_regex=None):
+        includes = [glob_to_regex(p) for p in include or []]
+        excludes = [glob_to_regex(p) for p in exclude or []]
+
+        pattern = "(?=%s)" % PLIST_PATTERN
+        if excludes:
+            pattern = "(?!%s)" % "|".join(excludes) + pattern
+        if includes and not include_regex:
+            pattern += "(?:%s)" % "|".join(includes)
+        self.pattern = pattern
+        self._match = re.compile(pattern, re.DOTALL).match
+        # with include regexes, an include glob is just one more way in
+        self._include_match = None
+        if includes and include_regex:
+            self._include_match = re.compile(
+                "|".join(includes), re.DOTALL).match
+        self._include_searches = [re.compile(r, re.DOTALL).search
+                                  for r in include_regex or []]
+        self._exclude_searches = [re.compile(r, re.DOTALL).search
+                                  for r in exclude_regex or []]
+        self.passed = 0
+        self.dropped = 0
+
+    def matches(self, path) -> bool:
+        if self._match(path) is None:
+            return False
+        for search in self._exclude_searches:
+            if search(path) is not None:
+                return False
+        if not self._include_searches:
+            return True
+        if self._include_match is not None and \
+                self._include_match(path) is not None:
+            return True
+        for search in self._include_searches:
+            if search(path) is not None:
+                return True
+        return False
+
+    def accept(self, path) -> bool:
+        """
+        Like matches(), but counts the outcome
+        """
+        if not self.matches(path):
+            self.dropped += 1
+            return False
+        self.passed += 1
+        return True
@@ -0,0 +1,258 @@
+import os
+from functools import lru_cache
+from pwd import getpwuid
+from typing import List, Tuple
+
+STANDARD_PATHS = ["~/Library/Preferences",
+                  "/Library/Preferences"]
+
+PLIST_SUFFIX = ".plist"
+
+
+@lru_cache(maxsize=None)
+def _user_name(uid):
+    try:
+        return getpwuid(uid).pw_name
+    except KeyError:
+        # no such user here, e.g. a plist copied from another machine,
+        # so certainly not root
+        return None
+
+
+def is_nsglobaldomain(plistpath):
+    return os.path.basename(plistpath).startswith(".GlobalPreferences")
+
+
+def is_byhost(plistpath):
+    return os.path.basename(os.path.dirname(plistpath)) == "ByHost"
+
+
+def is_root_owned(plistpath, st=None):
+    if st is None:
+        st = os.stat(plistpath)
+    return _user_name(st.st_uid) == "root"
+
+
+def is_standard_path(plistpath, standard_paths=STANDARD_PATHS):
+    for path in standard_paths:
+        # the path may be spelled out with or without the ~
+        if plistpath.startswith(path):
+            return True
+        if plistpath.startswith(os.path.expanduser(path)):
+            return True
+    return False
+
+
+def plist_domain(plistpath, byhost, globaldomain, root_owned, standard,
+                 real_path):
+    """
+    The defaults(1) domain for a plist, given the facts about its path
+    """
+    # if root owned (like in /Library/Preferences), need to specify fully qualified
+    # literal filename rather than a namespace
+    if root_owned:
+        return real_path
+    if not standard:
+        return real_path
+    if globaldomain:
+        return "NSGlobalDomain"
+    return domain_name(plistpath, byhost)
+
+
+def domain_name(plistpath, byhost):
+    """
+    The domain a plist's file name implies, whatever directory it's in
+    """
+    if is_nsglobaldomain(plistpath):
+        return "NSGlobalDomain"
+    # get just the filename, and strip off .plist
+    base = os.path.splitext(os.path.basename(plistpath))[0]
+    if byhost:
+        # e.g.,
+        # '~/Library/Preferences/ByHost/com.apple.windowserver.000E4DFD-62C8-5DC5-A2A4-42AFE04AAB87.plist
+        # strip off UUID, leaving e.g., com.apple.windowserver
+        return os.path.splitext(base)[0]
+    return base
+
+
+def pair_trees(root_a, root_b) -> List[Tuple]:
+    """
+    Pair up the plists under two directories by the domains they're for
+
+    Plists are paired by their directory relative to the root and by
+    domain_name(), so ByHost plists pair up even though each machine puts
+    its own UUID in their names. Returns (path in A, info, path in
+    B, info) tuples, sorted by domain, with None for the path and info
+    on the side a plist is missing from. If two plists in one tree map
+    to the same domain, only the last one found is used.
+    """
+    sides = []
+    for root in (root_a, root_b):
+        plists = {}
+        for path, info, _ in PlistPathIndex(root).walk():
+            relpath = os.path.relpath(path, root)
+            key = (os.path.dirname(relpath),
+                   domain_name(relpath, is_byhost(relpath)))
+            plists[key] = (path, info)
+        sides.append(plists)
+    pairs = []
+    missing = (None, None)
+    for key in sorted(set(sides[0]) | set(sides[1])):
+        pairs.append(sides[0].get(key, missing) + sides[1].get(key, missing))
+    return pairs
+
+
+class PlistPathInfo:
+    """
+    What a plist's path says about its defaults(1) domain
+    """
+    __slots__ = ("domain", "byhost", "root_owned", "standard")
+
+    def __init__(self, domain, byhost, root_owned, standard):
+        self.domain = domain
+        self.byhost = byhost
+        self.root_owned = root_owned
+        self.standard = standard
+
+    def __repr__(self):
+        return "%s(domain=%r, byhost=%r, root_owned=%r, standard=%r)" % (
+            self.__class__.__name__, self.domain, self.byhost,
+            self.root_owned, self.standard)
+
+    @classmethod
+    def for_path(cls, plistpath, st=None, real_path=None,
+                 standard_paths=STANDARD_PATHS):
+        """
+        Work out a plist's path facts, stat()ing it unless ``st`` is given
+        """
+        byhost = is_byhost(plistpath)
+        root_owned = is_root_owned(plistpath, st)
+        standard = is_standard_path(plistpath, standard_paths)
+        if real_path is None:
+            real_path = os.path.realpath(plistpath)
+        domain = plist_domain(plistpath, byhost, is_nsglobaldomain(plistpath),
+                              root_owned, standard, real_path)
+        return cls(domain, byhost, root_owned, standard)
+
+
+class PlistPathIndex:
+    """
+    Path facts for every plist under a directory, kept current from watch events
+
+    build() walks the tree once with os.scandir(), resolving each
+    directory's real path once rather than each file's. After that,
+    update() keeps the index in step with created, deleted and moved
+    files and directories, so get() is a dictionary lookup for any plist
+    that was already there or arrived by one of those events. A plist the
+    index hasn't seen, e.g. because its created event was coalesced into
+    a later one, is looked up the slow way once and added.
+    """
+
+    def __init__(self, root, standard_paths=STANDARD_PATHS):
+        self.root = root
+        self.standard_paths = standard_paths
+        # plist path -> PlistPathInfo
+        self._paths = {}
+        # get()s that had to stat the plist
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def paths(self):
+        return sorted(self._paths)
+
+    def build(self) -> int:
+        """
+        (Re)index every plist under the root, returning how many there are
+        """
+        self._paths.clear()
+        self._scan(self.root)
+        return len(self._paths)
+
+    def walk(self):
+        """
+        (Re)index every plist under the root, yielding (path, info, stat result) for each
+        """
+        self._paths.clear()
+        return self._walk(self.root)
+
+    def _scan(self, dirpath):
+        for _ in self._walk(dirpath):
+            pass
+
+    def _walk(self, dirpath):
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            # e.g., removed before we got to it
+            return
+        real_dir = os.path.realpath(dirpath)
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._walk(entry.path)
+                    continue
+                if not entry.name.endswith(PLIST_SUFFIX) or not entry.is_file():
+                    continue
+                real_path = None
+                if not entry.is_symlink():
+                    real_path = os.path.join(real_dir, entry.name)
+                st = entry.stat()
+                info = PlistPathInfo.for_path(
+                    entry.path, st=st, real_path=real_path,
+                    standard_paths=self.standard_paths)
+            except OSError:
+                continue
+            self._paths[entry.path] = info
+            yield entry.path, info, st
+
+    def get(self, path) -> PlistPathInfo:
+        info = self._paths.get(path)
+        if info is None:
+            self.misses += 1
+            info = PlistPathInfo.for_path(
+                path, standard_paths=self.standard_paths)
+            self._paths[path] = info
+        return info
+
+    def _add(self, path):
+        if not path.endswith(PLIST_SUFFIX):
+            return
+        try:
+            self._paths[path] = PlistPathInfo.for_path(
+                path, standard_paths=self.standard_paths)
+        except OSError:
+            # gone again already
+            self._paths.pop(path, None)
+
+    def _remove_tree(self, dirpath):
+        prefix = os.path.join(dirpath, "")
+        for path in [p for p in self._paths if p.startswith(prefix)]:
+            del self._paths[path]
+
+    def update(self, event_type, event):
+        """
+        Apply a watchdog event, as queued by PrefChangedEventHandler
+        """
+        if event.is_directory:
+            if event_type in ("deleted", "moved"):
+                self._remove_tree(event.src_path)
+            if event_type == "created":
+                self._scan(event.src_path)
+            elif event_type == "moved":
+                self._scan(event.dest_path)
+            return
+        if event_type == "created":
+            self._add(event.src_path)
+        elif event_type == "deleted":
+            self._paths.pop(event.src_path, None)
+        elif event_type == "moved":
+            self._paths.pop(event.src_path, None)
+            if event.dest_path not in self._paths:
+                # otherwise it's e.g. an atomic save, and the plist being
+                # replaced is still the same plist
+                self._add(event.dest_path)
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from typing import Dict, List
+
+from .bplist import PLIST_ERRORS, BinaryPlistReader, materialize
+from .changetypes import (
+    PSChangeTypeBase,
+    PSChangeTypeDictAdd,
+    PSChangeTypeDictAddMultiple,
+    PSChangeTypeImport
+)
+from .exceptions import PSChangeTypeException
+from .plistdiff import PlistDictPlan
+
+PER_KEY = "per-key"
+IMPORT = "import"
+
+SCRIPT_HEADER = "#!/bin/sh\nset -e\n"
+
+
+class ChangePlan:
+    """
+    Commands that bring one domain from a diff's "before" to its "after" state
+
+    ``strategy`` is PER_KEY for individual writes and deletes, or IMPORT
+    for a single defaults import of the whole "after" plist. ``errors`` are
+    changes the plan couldn't express as commands.
+    """
+
+    def __init__(self, strategy, changes: List[PSChangeTypeBase], cost,
+                 alternative_cost=None, errors=None):
+        self.strategy = strategy
+        self.changes = changes
+        self.cost = cost
+        # cost of the strategy that wasn't chosen, if there was one; an
+        # import's is only estimated if it clearly lost
+        self.alternative_cost = alternative_cost
+        if errors is None:
+            errors = []
+        self.errors = errors
+
+    def shell_script(self) -> str:
+        lines = [SCRIPT_HEADER]
+        for error in self.errors:
+            lines.append("# ERROR: %s" % error)
+        for change in self.changes:
+            lines.append(change.shell_command())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict:
+        commands = []
+        for change in self.changes:
+            command = {"change_type": change.change_type,
+                       "domain": change.domain,
+                       "byhost": change.byhost,
+                       "key": change.key,
+                       "argv": change.argv(quote=False)}
+            input_data = change.input_data()
+            if input_data is not None:
+                command["input"] = input_data.decode("utf-8")
+            commands.append(command)
+        return {"strategy": self.strategy,
+                "cost": self.cost,
+                "alternative_cost": self.alternative_cost,
+                "commands": commands,
+                "errors": [str(e) for e in self.errors]}
+
+
+class ChangePlanner:
+    """
+    Chooses between a diff's individual commands and one defaults import
+
+    Costs are in the same units as PlistDictPlan's: bytes of arguments or
+    stdin, plus a fixed charge for every defaults(1) process launched.
+    Each command means a process launch and a cfprefsd round trip, which
+    dwarf the cost of parsing its arguments, so the charge here is higher
+    than PlistDictPlan's, which only has to rank commands against each
+    other. Before costing, -dict-adds to the same key are folded into one
+    multi-pair -dict-add.
+
+    An import replaces the whole domain with the "after" state, so it also
+    expresses changes that have no defaults write form (data and date
+    values), and is chosen whenever the per-key plan would be incomplete.
+    Serializing the whole "after" plist for an import costs far more than
+    the per-key commands usually do, so it's only done if import_size()
+    says the import could win.
+    """
+    PER_COMMAND_COST = 8 * PlistDictPlan.PER_COMMAND_COST
+
+    def __init__(self, per_command_cost=PER_COMMAND_COST, allow_import=True):
+        self.per_command_cost = per_command_cost
+        self.allow_import = allow_import
+
+    def command_cost(self, change: PSChangeTypeBase):
+        cost = self.per_command_cost
+        cost += sum(len(arg) for arg in change.argv(quote=False))
+        input_data = change.input_data()
+        if input_data is not None:
+            cost += len(input_data)
+        return cost
+
+    @staticmethod
+    def fold_dict_adds(changes):
+        """
+        Merge -dict-adds to the same key into one command, where the first was
+        """
+        folded = []
+        # (domain, byhost, key) -> index into folded
+        dict_adds = {}
+        for change in changes:
+            if not isinstance(change, PSChangeTypeDictAdd):
+                folded.append(change)
+                continue
+            parent = (change.domain, change.byhost, change.key)
+            index = dict_adds.get(parent)
+            if index is None:
+                dict_adds[parent] = len(folded)
+                folded.append(change)
+                continue
+            first = folded[index]
+            if isinstance(first, PSChangeTypeDictAdd):
+                pairs = OrderedDict([(first.subkey, first.value)])
+            else:
+                pairs = OrderedDict(first.value)
+            pairs[change.subkey] = change.value
+            folded[index] = PSChangeTypeDictAddMultiple(
+                change.domain, change.byhost, change.key, pairs)
+        return folded
+
+    @staticmethod
+    def import_size(diffs) -> int:
+        """
+        Estimate of the bytes an import of a PrefSniff's "after" plist would take
+
+        This is the binary plist's own length, or PlistHasher's size for
+        one that's already decoded. The XML an import is fed is larger
+        than either, so an import estimated to lose does lose.
+        """
+        after = diffs.after
+        if isinstance(after, BinaryPlistReader):
+            return after.encoded_size
+        return diffs.tree_diff.hasher.size(after)
+
+    def plan(self, diffs) -> ChangePlan:
+        """
+        Plan the commands for a PrefSniff's changes
+        """
+        changes = [ch for ch in diffs.changes
+                   if isinstance(ch, PSChangeTypeBase)]
+        errors = [ch for ch in diffs.changes
+                  if not isinstance(ch, PSChangeTypeBase)]
+        changes = self.fold_dict_adds(changes)
+        per_key_cost = sum(self.command_cost(ch) for ch in changes)
+        if not (self.allow_import and diffs.changes):
+            return ChangePlan(PER_KEY, changes, per_key_cost, errors=errors)
+
+        estimate = self.per_command_cost + self.import_size(diffs)
+        if not errors and estimate >= per_key_cost:
+            return ChangePlan(PER_KEY, changes, per_key_cost,
+                              alternative_cost=estimate)
+        try:
+            import_change = PSChangeTypeImport(
+                diffs.pref_domain, diffs.byhost, materialize(diffs.after))
+        except PLIST_ERRORS:
+            # a value diffing never had to decode is corrupt
+            import_change = None
+        except (PSChangeTypeException, TypeError, OverflowError):
+            # e.g., the root isn't a dictionary
+            import_change = None
+        if import_change is None:
+            return ChangePlan(PER_KEY, changes, per_key_cost, errors=errors)
+
+        import_cost = self.command_cost(import_change)
+        if errors or import_cost < per_key_cost:
+            return ChangePlan(IMPORT, [import_change], import_cost,
+                              alternative_cost=per_key_cost)
+        return ChangePlan(PER_KEY, changes, per_key_cost,
+                          alternative_cost=import_cost)
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+
+
+class PlistFingerprint:
+    """
+    What a plist file looked like when it was last parsed
+    """
+
+    def __init__(self, mtime_ns, size, digest, recorded_ns):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        # when this fingerprint was taken, for detecting racy stat matches
+        self.recorded_ns = recorded_ns
+
+    @classmethod
+    def of_data(cls, data: bytes):
+        """
+        Fingerprint of plist data that wasn't just read from its file
+
+        Without the file's mtime, it can only ever be matched by digest.
+        """
+        return cls(0, len(data), PlistFingerprintCache.digest(data), 0)
+
+    def __repr__(self):
+        return "%s(mtime_ns=%d, size=%d, digest=%s)" % (
+            self.__class__.__name__, self.mtime_ns, self.size, self.digest.hex())
+
+
+class PlistFingerprintCache:
+    """
+    Per-path fingerprints of the last successfully parsed version of each plist
+
+    read_if_changed() skips files whose mtime and size are unchanged, unless
+    they were modified within a timestamp tick (HFS+'s one second) of being
+    fingerprinted, in which case their contents are digested and compared.
+    """
+    TIMESTAMP_GRANULARITY_NS = 1000000000
+
+    def __init__(self):
+        self._fingerprints = {}
+        # reads or parses skipped because the file hadn't changed
+        self.skipped_parses = 0
+
+    def read_if_changed(self, path):
+        """
+        Returns (data, fingerprint) if path differs from its last recorded
+        fingerprint, or None if it's unchanged. Record the fingerprint with
+        update() once the data parses.
+        """
+        st = os.stat(path)
+        old = self._fingerprints.get(path)
+        if old is not None and old.mtime_ns == st.st_mtime_ns \
+                and old.size == st.st_size \
+                and old.recorded_ns - old.mtime_ns > self.TIMESTAMP_GRANULARITY_NS:
+            self.skipped_parses += 1
+            return None
+
+        recorded_ns = time.time_ns()
+        with open(path, "rb") as f:
+            data = f.read()
+        fingerprint = PlistFingerprint(
+            st.st_mtime_ns, len(data), self.digest(data), recorded_ns)
+        if old is not None and old.digest == fingerprint.digest:
+            # touched or rewritten with identical bytes
+            self._fingerprints[path] = fingerprint
+            self.skipped_parses += 1
+            return None
+
+        return data, fingerprint
+
+    def data_if_changed(self, path, data):
+        """
+        As read_if_changed(), for path's data as already read, e.g. from an event log
+        """
+        old = self._fingerprints.get(path)
+        fingerprint = PlistFingerprint.of_data(data)
+        if old is not None and old.digest == fingerprint.digest:
+            self.skipped_parses += 1
+            return None
+        return data, fingerprint
+
+    def update(self, path, fingerprint: PlistFingerprint):
+        self._fingerprints[path] = fingerprint
+
+    def forget(self, path):
+        self._fingerprints.pop(path, None)
+
+    def get(self, path) -> PlistFingerprint:
+        return self._fingerprints.get(path)
+
+    @staticmethod
+    def digest(data: bytes) -> bytes:
+        return blake2b(data, digest_size=16).digest()
+
+
+class PlistBaselineCache:
+    """
+    LRU cache of the last parsed version of each plist in a watched directory
+
+    Baselines are charged their file's size, a rough but free proxy for
+    memory, and evicted once the total exceeds ``max_bytes``. A baseline
+    larger than ``max_bytes`` isn't cached.
+    """
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        # path -> (parsed plist, size in bytes)
+        self._baselines = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._baselines)
+
+    def __contains__(self, path):
+        return path in self._baselines
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, path):
+        """
+        Returns the cached baseline for path, or None
+        """
+        with self._lock:
+            entry = self._baselines.get(path)
+            if entry is None:
+                return None
+            self._baselines.move_to_end(path)
+            return entry[0]
+
+    def put(self, path, pref, size):
+        with self._lock:
+            self._discard(path)
+            if size > self.max_bytes:
+                return
+            self._baselines[path] = (pref, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, (_, old_size) = self._baselines.popitem(last=False)
+                self._total_bytes -= old_size
+                self.evictions += 1
+
+    def forget(self, path):
+        with self._lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        entry = self._baselines.pop(path, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
@@ -0,0 +1,391 @@
+import datetime
+import marshal
+import pickle
+import plistlib
+from hashlib import blake2b
+from typing import Dict, List, Tuple
+
+# Type tags folded into structural hashes and leaf keys so values that
+# compare equal in Python but differ as plist types (e.g., True vs 1,
+# 1 vs 1.0) are never treated as the same
+_TYPE_TAGS = {bool: "bool",
+              int: "int",
+              float: "real",
+              str: "string",
+              bytes: "data",
+              datetime.datetime: "date",
+              plistlib.UID: "uid"}
+
+_CONTAINERS = (dict, list, tuple)
+
+_DICT_TAG = "dict"
+_ARRAY_TAG = "array"
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+
+class PlistHasher:
+    """
+    Computes structural digests of plist object graphs
+
+    A container's digest is taken over its marshal serialization, which is
+    produced in C and, unlike ``==``, distinguishes True from 1 and 1 from 1.0.
+    Digests are memoized for the lifetime of the hasher, so once a subtree
+    is hashed it can be compared against another in O(1). Leaves are compared
+    by (type tag, value) directly. The serialized length doubles as a cheap
+    size estimate when choosing between commands.
+    """
+    # version 2 is the newest marshal format that doesn't emit back-references
+    # for shared objects, so its output depends only on structure and values
+    MARSHAL_VERSION = 2
+
+    def __init__(self):
+        # id(container) -> (container, digest, serialized size)
+        # the container itself is held so its id can't be reused while memoized
+        self._memo = {}
+
+    def node_key(self, value):
+        """
+        Hashable key for ``value``; equal keys always mean equal plist values
+        """
+        if isinstance(value, (dict, list, tuple)):
+            return self.digest(value)
+        return self._leaf_key(value)
+
+    def _leaf_key(self, value):
+        return (self.type_tag(value), value)
+
+    def type_tag(self, value):
+        cls = value.__class__
+        tag = _TYPE_TAGS.get(cls)
+        if tag is None:
+            tag = self._slow_tag(cls)
+        return tag
+
+    def _slow_tag(self, cls):
+        if issubclass(cls, dict):
+            return _DICT_TAG
+        if issubclass(cls, (list, tuple)):
+            return _ARRAY_TAG
+        for base, tag in _TYPE_TAGS.items():
+            if issubclass(cls, base):
+                # bool is a subclass of int, but is listed first
+                return tag
+        return cls.__name__
+
+    def digest(self, value, memoize=True) -> bytes:
+        if not memoize:
+            return blake2b(self.serialize(value), digest_size=16).digest()
+        return self._hash(value)[1]
+
+    def size(self, value) -> int:
+        """
+        Rough serialized size of ``value``, in bytes
+        """
+        if isinstance(value, (dict, list, tuple)):
+            return self._hash(value)[2]
+        if isinstance(value, (str, bytes)):
+            return len(value) + 1
+        return 8
+
+    def serialize(self, value) -> bytes:
+        try:
+            serialized = marshal.dumps(value, self.MARSHAL_VERSION)
+        except ValueError:
+            # dates and UIDs aren't marshallable
+            serialized = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return serialized
+
+    def _hash(self, value):
+        memo = self._memo.get(id(value))
+        if memo is not None:
+            return memo
+        serialized = self.serialize(value)
+        digest = blake2b(serialized, digest_size=16).digest()
+        memo = (value, digest, len(serialized))
+        self._memo[id(value)] = memo
+        return memo
+
+    def same(self, v1, v2) -> bool:
+        """
+        Whether v1 and v2 are the same plist value, including types
+        """
+        if v1 is v2:
+            return True
+        # Python equality is looser than plist equality, so inequality is final
+        if v1 != v2:
+            return False
+        if not isinstance(v1, (dict, list, tuple)):
+            return self.type_tag(v1) == self.type_tag(v2)
+        if self.digest(v1) == self.digest(v2):
+            return True
+        # Digests can differ for equal values, e.g., dictionaries with
+        # different key order, so settle it the slow way
+        return self._strict_equal(v1, v2)
+
+    def all_same(self, values1: List, values2: List) -> bool:
+        """
+        Whether each pair from two lists of Python-equal values is also plist-equal
+
+        Checked with one serialization of each list, which is much cheaper
+        than hashing pair by pair. A False result may be spurious (see
+        same()), so callers should then fall back to checking pairs individually.
+        """
+        return self.serialize(values1) == self.serialize(values2)
+
+    def _strict_equal(self, v1, v2):
+        tag = self.type_tag(v1)
+        if tag != self.type_tag(v2):
+            return False
+        if tag == _DICT_TAG:
+            if v1.keys() != v2.keys():
+                return False
+            return all(self._strict_equal(v, v2[k]) for k, v in v1.items())
+        if tag == _ARRAY_TAG:
+            if len(v1) != len(v2):
+                return False
+            return all(self._strict_equal(a, b) for a, b in zip(v1, v2))
+        return v1 == v2
+
+
+class PlistDiffEntry:
+    """
+    A single change at ``path``, a tuple of dictionary keys from the plist root
+    """
+
+    def __init__(self, path: Tuple, kind: str, old=None, new=None):
+        self.path = path
+        self.kind = kind
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        return "%s(%r, %s)" % (self.__class__.__name__, self.path, self.kind)
+
+
+class PlistDiff:
+    """
+    Recursive diff of two plist dictionaries
+
+    A top-level container whose PlistHasher digest is unchanged is never
+    walked. ``before_digests`` are an earlier diff's after_digests(), so
+    a baseline that's diffed again isn't hashed again. Changed containers
+    are walked with Python's C-level ``==``, which can't tell True from 1;
+    if undoing the changes found doesn't give back the "before" digest,
+    the container is walked again, confirming Python-equal siblings
+    type-for-type. Arrays and scalars are compared as whole values.
+
+    ``entries`` maps each changed path to a PlistDiffEntry, with changes
+    reported at the deepest dictionary level at which they occur.
+    """
+
+    # batches of Python-equal values at most this long are confirmed pair by pair
+    CONFIRM_SPLIT_MIN = 8
+
+    def __init__(self, before: Dict, after: Dict, hasher: PlistHasher = None,
+                 before_digests: Dict = None):
+        if hasher is None:
+            hasher = PlistHasher()
+        self.hasher = hasher
+        self.before = before
+        self.after = after
+        if before_digests is None:
+            before_digests = {}
+        self._before_digests = before_digests
+        self.entries: Dict[Tuple, PlistDiffEntry] = {}
+
+        # top-level summary, in the same shape PrefSniff has always exposed
+        self.added = {}
+        self.removed = []
+        self.modified = {}
+
+        self._diff_dicts((), before, after)
+        for path, entry in self.entries.items():
+            key = path[0]
+            if len(path) == 1 and entry.kind == ADDED:
+                self.added[key] = entry.new
+            elif len(path) == 1 and entry.kind == REMOVED:
+                self.removed.append(key)
+            elif key not in self.modified:
+                self.modified[key] = (before[key], after[key])
+
+    def after_digests(self) -> Dict:
+        """
+        Digests of the top-level containers in ``after``, for the next diff's before_digests
+        """
+        # keys left out of both sides, e.g. by changed_subsets(), are unchanged
+        digests = {k: d for k, d in self._before_digests.items()
+                   if k not in self.before and k not in self.after}
+        for k, v in self.after.items():
+            if isinstance(v, _CONTAINERS):
+                digests[k] = self.hasher.digest(v)
+        return digests
+
+    def _diff_dicts(self, path, d1, d2, confirm=False):
+        # Python-equal containers whose plist types still need confirming
+        equal_keys = []
+        equal1 = []
+        equal2 = []
+        for k, v2 in d2.items():
+            if k not in d1:
+                subpath = path + (k,)
+                self.entries[subpath] = PlistDiffEntry(
+                    subpath, ADDED, new=v2)
+                continue
+            v1 = d1[k]
+            if v1 is v2:
+                continue
+            if not path and isinstance(v1, _CONTAINERS) and \
+                    isinstance(v2, _CONTAINERS):
+                self._diff_top((k,), v1, v2)
+                continue
+            if v1 == v2:
+                if v1.__class__ is not v2.__class__:
+                    # e.g., True vs. 1
+                    if not self.hasher.same(v1, v2):
+                        self._diff_values(path + (k,), v1, v2, confirm)
+                elif confirm and isinstance(v1, _CONTAINERS):
+                    equal_keys.append(k)
+                    equal1.append(v1)
+                    equal2.append(v2)
+                continue
+            self._diff_values(path + (k,), v1, v2, confirm)
+
+        if equal_keys:
+            self._confirm_equal(path, equal_keys, equal1, equal2)
+
+        for k, v1 in d1.items():
+            if k not in d2:
+                subpath = path + (k,)
+                self.entries[subpath] = PlistDiffEntry(
+                    subpath, REMOVED, old=v1)
+
+    def _diff_top(self, path, v1, v2):
+        digest = self._before_digests.get(path[0])
+        if digest is None:
+            digest = self.hasher.digest(v1)
+        if digest == self.hasher.digest(v2):
+            return
+        if v1 == v2:
+            # only types or key order differ
+            if isinstance(v1, dict) and isinstance(v2, dict):
+                self._diff_dicts(path, v1, v2, confirm=True)
+            elif not self.hasher.same(v1, v2):
+                self._diff_values(path, v1, v2)
+            return
+        self._diff_values(path, v1, v2)
+        if not (isinstance(v1, dict) and isinstance(v2, dict)):
+            return
+        undone = self._undo(v1, v2, self._changed_paths(path))
+        if self.hasher.digest(undone, memoize=False) == digest:
+            return
+        # == missed something beside the changes it found
+        for subpath in [p for p in self.entries if p[:1] == path]:
+            del self.entries[subpath]
+        self._diff_dicts(path, v1, v2, confirm=True)
+
+    def _changed_paths(self, path):
+        # changed paths beneath path, as nested dicts of keys ending in None
+        tree = {}
+        for subpath in self.entries:
+            if subpath[:len(path)] != path:
+                continue
+            node = tree
+            for k in subpath[len(path):-1]:
+                node = node.setdefault(k, {})
+            node[subpath[-1]] = None
+        return tree
+
+    def _undo(self, d1, d2, changed):
+        # d2 with the changes in ``changed`` undone, in d1's key order
+        undone = {}
+        for k, v1 in d1.items():
+            if k not in changed:
+                undone[k] = d2[k]
+            elif changed[k] is None:
+                undone[k] = v1
+            else:
+                undone[k] = self._undo(v1, d2[k], changed[k])
+        return undone
+
+    def _confirm_equal(self, path, keys, values1, values2):
+        if self.hasher.all_same(values1, values2):
+            return
+        if len(keys) <= self.CONFIRM_SPLIT_MIN:
+            for k, v1, v2 in zip(keys, values1, values2):
+                if isinstance(v1, dict) and isinstance(v2, dict):
+                    # descending finds the differences, if there are any
+                    self._diff_dicts(path + (k,), v1, v2, confirm=True)
+                elif not self.hasher.same(v1, v2):
+                    self._diff_values(path + (k,), v1, v2)
+            return
+        # Bisect to find the culprits rather than hashing every pair
+        mid = len(keys) // 2
+        self._confirm_equal(path, keys[:mid], values1[:mid], values2[:mid])
+        self._confirm_equal(path, keys[mid:], values1[mid:], values2[mid:])
+
+    def _diff_values(self, path, v1, v2, confirm=False):
+        if isinstance(v1, dict) and isinstance(v2, dict):
+            self._diff_dicts(path, v1, v2, confirm)
+        else:
+            self.entries[path] = PlistDiffEntry(
+                path, MODIFIED, old=v1, new=v2)
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def subtree_entries(self, key) -> List[PlistDiffEntry]:
+        """
+        Entries beneath (not at) top-level ``key``
+        """
+        return [entry for path, entry in self.entries.items()
+                if len(path) > 1 and path[0] == key]
+
+
+class PlistDictPlan:
+    """
+    Cheapest way to bring top-level dictionary ``key`` up to date
+
+    ``defaults`` can only address a top-level key, or a key one level beneath
+    it via -dict-add, and has no way to remove a sub-key. So a changed
+    dictionary is either rewritten whole, or each changed first-level sub-key
+    is re-added with its new value. Removing a first-level sub-key forces a
+    rewrite; otherwise whichever is cheaper under a simple cost model wins.
+    """
+    # Estimated cost of launching one defaults(1) process, in bytes of
+    # serialized value. Deliberately rough; it only needs to get the
+    # ordering right.
+    PER_COMMAND_COST = 512
+
+    def __init__(self, diff: PlistDiff, key):
+        self.key = key
+        new_dict = diff.after[key]
+        rewrite_cost = self.PER_COMMAND_COST + diff.hasher.size(new_dict)
+
+        self.rewrite = False
+        # first-level sub-key -> new value, in after-dict order
+        self.dict_adds = {}
+        changed_subkeys = set()
+        for entry in diff.subtree_entries(key):
+            if len(entry.path) == 2 and entry.kind == REMOVED:
+                self.rewrite = True
+                break
+            changed_subkeys.add(entry.path[1])
+
+        if not self.rewrite:
+            add_cost = 0
+            for subkey, subval in new_dict.items():
+                if subkey in changed_subkeys:
+                    self.dict_adds[subkey] = subval
+                    add_cost += self.PER_COMMAND_COST + \
+                        diff.hasher.size(subval)
+            if add_cost > rewrite_cost:
+                self.rewrite = True
+
+        if self.rewrite:
+            self.dict_adds = {}
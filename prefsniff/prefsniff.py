@@ -3,19 +3,44 @@
 import argparse
 import datetime
 import difflib
+import io
+import json
+import multiprocessing
 import os
 import plistlib
 import re
+import signal
 import subprocess
 import sys
-from pwd import getpwuid
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed
+)
 from queue import Empty as QueueEmpty
 from queue import Queue
-from typing import List
-
-from watchdog.events import FileSystemEventHandler
+from typing import Iterator, List, Tuple
+
+from watchdog.events import (
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirMovedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileMovedEvent,
+    FileSystemEventHandler
+)
 from watchdog.observers import Observer
+from watchdog.version import VERSION_INFO as WATCHDOG_VERSION
 
+from . import pathindex
+from .apply import ChangeApplier
+from .arraydiff import SAME as ARRAY_SAME
+from .arraydiff import ArrayDiff
+from .bplist import PLIST_ERRORS, changed_subsets, load_plist, materialize
 from .changetypes import (
     PSChangeTypeArray,
     PSChangeTypeArrayAdd,
@@ -25,25 +50,95 @@ from .changetypes import (
     PSChangeTypeDate,
     PSChangeTypeDict,
     PSChangeTypeDictAdd,
-    PSChangeTypeFactory,
     PSChangeTypeFloat,
     PSChangeTypeInt,
     PSChangeTypeKeyDeleted,
     PSChangeTypeString
 )
-from .exceptions import PSChangeTypeNotImplementedException
+from .eventlog import (
+    EventLogException,
+    EventLogWriter,
+    RecordedPathIndex,
+    read_event_log
+)
+from .eventqueue import (
+    BLOCK,
+    DROP_OLDEST,
+    OVERFLOW_POLICIES,
+    BoundedEventQueue,
+    event_path
+)
+from .exceptions import PSChangeTypeNotImplementedException, PSniffException
+from .output import BufferedOutputWriter, change_records, ndjson_lines
+from .pathfilter import PathFilter
+from .pathindex import PlistPathIndex, PlistPathInfo, pair_trees
+from .plan import ChangePlanner
+from .plistcache import (
+    PlistBaselineCache,
+    PlistFingerprint,
+    PlistFingerprintCache
+)
+from .plistdiff import PlistDictPlan, PlistDiff
+from .snapshot import SnapshotStore, snapshot_differences
+from .stats import (
+    BYTES_READ,
+    CHANGES_EMITTED,
+    COMPARE,
+    DIFF,
+    EVENTS_RECEIVED,
+    EVENTS_SKIPPED,
+    GENERATE,
+    NULL_STATS,
+    PARSE,
+    PLISTS_PARSED,
+    READ,
+    RENDER,
+    PipelineStats,
+    StatsReporter
+)
 from .version import PrefsniffAbout
 
+try:
+    from watchdog.events import FileClosedEvent
+except ImportError:
+    # watchdog before 2.1; close-write isn't available
+    FileClosedEvent = None
+
 STARS = "*****************************"
 
+# plist pairs handed to a diff-tree worker at a time
+DIFF_TREE_BATCH = 16
+
+# what gets a plist looked at: every write to it, or its being closed
+# after it was written to, which only inotify reports
+TRIGGER_MODIFY = "modify"
+TRIGGER_CLOSE_WRITE = "close-write"
+TRIGGERS = (TRIGGER_MODIFY, TRIGGER_CLOSE_WRITE)
+# close-write needs Observer.schedule()'s event_filter
+CLOSE_WRITE_WATCHDOG = (4, 0)
+
 
 class PSChangeTypeErrorMessage(str):
     def __new__(cls, err_msg, *args, **kwargs):
         return super().__new__(cls, err_msg)
 
 
+def add_output_arguments(parser):
+    parser.add_argument(
+        "--show-diffs", help="Show diff of changed plist files.", action="store_true")
+    parser.add_argument(
+        "--scoped-diffs", help="Like --show-diffs, but limit diffs to the top-level keys that changed.", action="store_true")
+    parser.add_argument("--format", choices=["text", "ndjson"], default="text",
+                        help="Output format. ndjson writes one JSON record per change, with the change's fields plus the plist's path, a timestamp, and the number of filesystem events it accounts for. Output is buffered unless it's text to a terminal. (Default: text)")
+    parser.add_argument("--plan", choices=["script", "json"],
+                        help="Print each set of changes as the cheapest equivalent plan: a shell script, or JSON describing its commands. Many writes to one domain may be replaced by a single defaults import of the whole domain.")
+    parser.add_argument("--no-import", action="store_true",
+                        help="Never plan a defaults import; only fold -dict-adds together.")
+
+
 def parse_args(argv):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog="Also: prefsniff snapshot STORE PATH, prefsniff diff-snapshot STORE [PATH], prefsniff diff-tree A B, and prefsniff replay FILE; see their --help.")
     parser.add_argument(
         "watchpath", help="Directory or plist file to watch for changes.")
     parser.add_argument(
@@ -51,8 +146,39 @@ def parse_args(argv):
         help="Show version and exit.",
         action='version',
         version=str(PrefsniffAbout()))
-    parser.add_argument(
-        "--show-diffs", help="Show diff of changed plist files.", action="store_true")
+    add_output_arguments(parser)
+    parser.add_argument("--coalesce-ms", type=int, default=100,
+                        help="Wait for this many milliseconds of quiet before acting on a burst of writes to the same file. Set to 0 to disable. (Default: 100)")
+    parser.add_argument("--baseline-cache-mb", type=int, default=64,
+                        help="In directory mode, keep at most this many megabytes of plists cached for diffing against. (Default: 64)")
+    parser.add_argument("--queue-size", type=int, default=BoundedEventQueue.MAXSIZE,
+                        help="Hold at most this many filesystem events waiting to be handled. (Default: %d)" % BoundedEventQueue.MAXSIZE)
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=BLOCK,
+                        help="What to do with a new event when the queue is full: block until there's room, drop the oldest queued event, or coalesce events for the same path into one, which is done even before the queue fills. (Default: block)")
+    parser.add_argument("--trigger", choices=TRIGGERS, default=TRIGGER_MODIFY,
+                        help="Look at a plist whenever it's written to, or only once it's closed after being written to or renamed into place, so it's never read mid-write. close-write needs inotify, so is only available on Linux. (Default: modify)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="In directory mode, parse and diff changed plists in a pool of this many worker processes. Changes to any one file are still handled in order, and output is printed in the order changes were detected. (Default: 0, no pool)")
+    parser.add_argument("--worker-threads", action="store_true",
+                        help="Use threads rather than processes for --workers.")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="In directory mode, only watch plists matching this glob. A glob without a leading / matches the end of a path, e.g. 'com.apple.*' or 'ByHost/*'; ** matches across directories. May be given more than once.")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="In directory mode, ignore plists matching this glob. May be given more than once.")
+    parser.add_argument("--include-regex", action="append", metavar="REGEX",
+                        help="Like --include, but a regular expression searched for in the path.")
+    parser.add_argument("--exclude-regex", action="append", metavar="REGEX",
+                        help="Like --exclude, but a regular expression searched for in the path.")
+    parser.add_argument("--stats", action="store_true",
+                        help="Time each phase of handling changes (reading, parsing, comparing, generating commands, rendering output), count events, plists, changes and bytes read, and print a summary on exit.")
+    parser.add_argument("--stats-interval", type=float, metavar="SECONDS",
+                        help="Also write the stats to stderr as an NDJSON record this often. Implies --stats.")
+    parser.add_argument("--resume", metavar="STORE",
+                        help="In directory mode, start by printing what changed since the last snapshot of the directory in this snapshot store, and save a new snapshot on exit, so changes made while prefsniff wasn't running aren't missed.")
+    parser.add_argument("--net", action="store_true",
+                        help="When watching a file, don't print each change as it happens. Instead, print the fewest commands that have the same net effect as all of them, on exit or when sent SIGUSR1. Changes that were later undone are left out.")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Record each event handled, and the plist's contents after it, to this file, along with the contents of every plist when watching started, for prefsniff replay.")
     parser.add_argument("--plist2",
                         help="Optionally compare WATCHPATH against this plist rather than waiting for changes to the original."
                         )
@@ -60,9 +186,67 @@ def parse_args(argv):
     return args
 
 
+def parse_snapshot_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="prefsniff snapshot",
+        description="Save the contents of every plist under a directory to a snapshot store, for diff-snapshot or --resume to compare against later.")
+    parser.add_argument(
+        "store", help="Snapshot store (an SQLite database) to add the snapshot to. Created if it doesn't exist.")
+    parser.add_argument("path", help="Directory of plists to snapshot.")
+    return parser.parse_args(argv)
+
+
+def parse_diff_snapshot_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="prefsniff diff-snapshot",
+        description="Print the changes between a snapshot and the plists on disk now, or another snapshot.")
+    parser.add_argument("store", help="Snapshot store to read snapshots from.")
+    parser.add_argument(
+        "path", nargs="?",
+        help="Directory to compare against the snapshot. (Default: the directory the snapshot was taken of)")
+    parser.add_argument("--snapshot", type=int, metavar="ID",
+                        help="Snapshot to compare against. (Default: the latest snapshot of PATH, or the latest snapshot)")
+    parser.add_argument("--against", type=int, metavar="ID",
+                        help="Compare against this later snapshot rather than what's on disk.")
+    parser.add_argument("--list", action="store_true",
+                        help="List the snapshots in the store and exit.")
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def parse_diff_tree_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="prefsniff diff-tree",
+        description="Print the changes that turn each plist under one directory into the plist for the same domain under another. ByHost plists are paired up regardless of their host UUIDs.")
+    parser.add_argument("tree_a", metavar="A", help="Directory of plists to diff from, e.g. a golden Preferences directory.")
+    parser.add_argument("tree_b", metavar="B", help="Directory of plists to diff to.")
+    parser.add_argument("--workers", type=int,
+                        help="Diff plists in a pool of this many worker processes, printing results as they finish. 0 diffs them in order, in this process. (Default: one per CPU)")
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def parse_replay_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="prefsniff replay",
+        description="Push events recorded with --record through the same parse, diff and output steps as watching does, and report throughput and latency.")
+    parser.add_argument("log", metavar="FILE", help="Event log to replay.")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Replay at this multiple of the recorded speed, e.g. 1 for as fast as events arrived. Latency is measured from when each event is due. (Default: 0, as fast as possible)")
+    parser.add_argument("--coalesce-ms", type=int, default=0,
+                        help="Wait for this many milliseconds of quiet before acting on a burst of events for the same file, as with watching. Recorded events were already coalesced while watching. (Default: 0)")
+    parser.add_argument("--queue-size", type=int, default=BoundedEventQueue.MAXSIZE,
+                        help="Hold at most this many events waiting to be handled. (Default: %d)" % BoundedEventQueue.MAXSIZE)
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=BLOCK,
+                        help="What to do with an event when the queue is full, as with watching. (Default: block)")
+    parser.add_argument("--stats", action="store_true",
+                        help="Also print time spent in each phase, and counts of events, plists, changes and bytes, as with watching.")
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+
 class PrefSniff:
-    STANDARD_PATHS = ["~/Library/Preferences",
-                      "/Library/Preferences"]
+    STANDARD_PATHS = pathindex.STANDARD_PATHS
 
     CHANGE_TYPES = {int: PSChangeTypeInt,
                     float: PSChangeTypeFloat,
@@ -75,96 +259,82 @@ class PrefSniff:
 
     @classmethod
     def is_nsglobaldomain(cls, plistpath):
-        nsglobaldomain = False
-        base = os.path.basename(plistpath)
-        if base.startswith(".GlobalPreferences"):
-            nsglobaldomain = True
-
-        return nsglobaldomain
+        return pathindex.is_nsglobaldomain(plistpath)
 
     @classmethod
     def is_byhost(cls, plistpath):
-        byhost = False
-        dirname = os.path.dirname(plistpath)
-        immediate_parent = os.path.basename(dirname)
-        if "ByHost" == immediate_parent:
-            byhost = True
-
-        return byhost
+        return pathindex.is_byhost(plistpath)
 
     @classmethod
     def is_root_owned(cls, plistpath):
-        return getpwuid(os.stat(plistpath).st_uid).pw_name == 'root'
+        return pathindex.is_root_owned(plistpath)
 
     @classmethod
     def standard_path(cls, plistpath: str):
-        standard = False
-        path: str
-        for path in cls.STANDARD_PATHS:
-            path_real = os.path.expanduser(path)
-            if plistpath.startswith(path):
-                standard = True
-                break
-            elif plistpath.startswith(path_real):
-                standard = True
-                break
-
-        return standard
+        return pathindex.is_standard_path(plistpath, cls.STANDARD_PATHS)
 
     @classmethod
     def getdomain(cls, plistpath, byhost=False):
-        domain = None
-
-        globaldomain = cls.is_nsglobaldomain(plistpath)
-        root_owned = cls.is_root_owned(plistpath)
-        standard_path = cls.standard_path(plistpath)
-        real_path = os.path.realpath(plistpath)
-        # if root owned (like in /Library/Preferences), need to specify fully qualified
-        # literal filename rather than a namespace
-        if root_owned:
-            domain = real_path
-        elif not standard_path:
-            domain = real_path
-        elif globaldomain:
-            domain = "NSGlobalDomain"
-        elif byhost:
-            # e.g.,
-            # '~/Library/Preferences/ByHost/com.apple.windowserver.000E4DFD-62C8-5DC5-A2A4-42AFE04AAB87.plist
-            # get just the filename
-            base = os.path.basename(plistpath)
-            # strip off .plist
-            base = os.path.splitext(base)[0]
-            # strip off UUID, leaving e.g., com.apple.windowserver
-            domain = os.path.splitext(base)[0]
-        else:
-            base = os.path.basename(plistpath)
-            domain = os.path.splitext(base)[0]
-
-        return domain
-
-    def __init__(self, plistpath, plistpath2=None):
+        # Watchers look domains up in a PlistPathIndex instead, since this
+        # stat()s the plist and resolves its real path every time
+        return pathindex.plist_domain(plistpath, byhost,
+                                      cls.is_nsglobaldomain(plistpath),
+                                      cls.is_root_owned(plistpath),
+                                      cls.standard_path(plistpath),
+                                      os.path.realpath(plistpath))
+
+    def __init__(self, plistpath, plistpath2=None, before=None, after=None,
+                 raw_event_count=1, path_info: PlistPathInfo = None,
+                 stats: PipelineStats = None, before_digests=None):
+        if stats is None:
+            stats = NULL_STATS
+        self.stats = stats
         self.plist_dir = os.path.dirname(plistpath)
         self.plist_base = os.path.basename(plistpath)
-        self.byhost = self.is_byhost(plistpath)
-        self.pref_domain = self.getdomain(plistpath, byhost=self.byhost)
+        if path_info is None:
+            self.byhost = self.is_byhost(plistpath)
+            self.pref_domain = self.getdomain(plistpath, byhost=self.byhost)
+        else:
+            self.byhost = path_info.byhost
+            self.pref_domain = path_info.domain
 
         self.plistpath = plistpath
 
-        # Read the preference file before it changed
-        with open(plistpath, 'rb') as f:
-            pref1 = plistlib.load(f)
+        # Read the preference file before it changed, unless
+        # the caller already has it parsed (e.g., a watch session
+        # handing us the previous iteration's "after" state).
+        # Parsed plists are dicts or, for binary plists, lazily decoded
+        # BinaryPlistReaders; see load_plist()
+        if before is None:
+            pref1 = self._load_plist_file(plistpath)
+        else:
+            pref1 = before
 
         if plistpath2 is None:
             self.plistpath2 = plistpath
-            self._wait_for_prefchange()
         else:
             self.plistpath2 = plistpath2
 
-        # Read the preference file after it changed
-        with open(self.plistpath2, 'rb') as f:
-            pref2 = plistlib.load(f)
-
-        added, removed, modified, same = self._dict_compare(pref1, pref2)
+        if after is None:
+            if plistpath2 is None:
+                self._wait_for_prefchange()
+            # Read the preference file after it changed
+            pref2 = self._load_plist_file(self.plistpath2)
+        else:
+            pref2 = after
+
+        self.before = pref1
+        self.after = pref2
+        # number of filesystem events this diff accounts for
+        self.raw_event_count = raw_event_count
+        # when the change was detected, in seconds since the epoch
+        self.timestamp = time.time()
+
+        # For binary plists, top-level keys whose encoded bytes are
+        # unchanged are dropped here without ever being decoded
+        with stats.timer(COMPARE):
+            self.tree_diff = PlistDiff(*changed_subsets(pref1, pref2),
+                                       before_digests=before_digests)
         self.removed = {}
         self.added = {}
         self.modified = {}
@@ -172,15 +342,18 @@ class PrefSniff:
         # At this stage, added and removed would be
         # a key:value added or removed from the top-level
         # <dict> of the plist
-        if len(added):
-            self.added = added
-        if len(removed):
-            self.removed = removed
-        if len(modified):
-            self.modified = modified
-
-        self.changes = self._generate_changes()
-        self.diff = self._unified_diff(pref1, pref2, plistpath)
+        if len(self.tree_diff.added):
+            self.added = self.tree_diff.added
+        if len(self.tree_diff.removed):
+            self.removed = self.tree_diff.removed
+        if len(self.tree_diff.modified):
+            self.modified = self.tree_diff.modified
+
+        with stats.timer(GENERATE):
+            self.changes = self._generate_changes()
+        # unified diffs are only computed if asked for; see diff and scoped_diff
+        self._diff = None
+        self._scoped_diff = None
 
     def _dict_compare(self, d1, d2):
         d1_keys = set(d1.keys())
@@ -195,26 +368,48 @@ class PrefSniff:
         same = set(o for o in intersect_keys if d1[o] == d2[o])
         return added, removed, modified, same
 
-    def _list_compare(self, list1, list2):
-        list_diffs = {"same": False, "append_to_l1": None,
-                      "subtract_from_l1": None}
-        if list1 == list2:
-            list_diffs["same"] = True
-            return list_diffs
-        if len(list2) > len(list1):
-            if list1 == list2[:len(list1)]:
-                list_diffs["append_to_l1"] = list2[len(list1):]
-
-            return list_diffs
-        elif len(list1) > len(list2):
-            if list2 == list1[:len(list2)]:
-                list_diffs["subtract_from_l1"] = list1[len(list2):]
-
-            return list_diffs
+    @property
+    def diff(self) -> List[str]:
+        """
+        Unified diff of the XML serializations of the entire before and after plists
+        """
+        if self._diff is None:
+            self._diff = self._unified_diff(
+                materialize(self.before), materialize(self.after),
+                self.plistpath)
+        return self._diff
 
-        return list_diffs
+    @property
+    def scoped_diff(self) -> List[str]:
+        """
+        Unified diff covering only the top-level keys that changed
+
+        Much cheaper than diff for large plists, since unchanged keys are
+        never serialized.
+        """
+        if self._scoped_diff is None:
+            changed = list(self.added) + list(self.removed) + list(self.modified)
+            frompref = {k: self.before[k] for k in changed if k in self.before}
+            topref = {k: self.after[k] for k in changed if k in self.after}
+            self._scoped_diff = self._unified_diff(
+                frompref, topref, self.plistpath)
+        return self._scoped_diff
+
+    def _load_plist_file(self, path):
+        with self.stats.timer(READ):
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.stats.count(BYTES_READ, len(data))
+        with self.stats.timer(PARSE):
+            pref = load_plist(data)
+        self.stats.count(PLISTS_PARSED)
+        return pref
 
     def _unified_diff(self, frompref, topref, path):
+        with self.stats.timer(DIFF):
+            return self._unified_diff_lines(frompref, topref, path)
+
+    def _unified_diff_lines(self, frompref, topref, path):
         # Convert both preferences to XML format
         fromxml = plistlib.dumps(
             frompref, fmt=plistlib.FMT_XML).decode('utf-8')
@@ -222,7 +417,7 @@ class PrefSniff:
             topref, fmt=plistlib.FMT_XML).decode('utf-8')
 
         fromlines, tolines = fromxml.splitlines(), toxml.splitlines()
-        return difflib.unified_diff(fromlines, tolines, path, path)
+        return list(difflib.unified_diff(fromlines, tolines, path, path))
 
     def _wait_for_prefchange(self):
         event_queue = Queue()
@@ -235,12 +430,7 @@ class PrefSniff:
             while not pref_updated:
                 try:
                     event = event_queue.get(True, 0.5)
-                    if event[0] == "moved" and os.path.basename(event[1].dest_path) == self.plist_base:
-                        pref_updated = True
-                    if event[0] == "modified" and os.path.basename(event[1].src_path) == self.plist_base:
-                        pref_updated = True
-                    if event[0] == "created" and os.path.basename(event[1].src_path) == self.plist_base:
-                        pref_updated = True
+                    pref_updated = is_prefchange_event(event, self.plist_base)
                 except QueueEmpty:
                     pass
         except KeyboardInterrupt:
@@ -264,71 +454,66 @@ class PrefSniff:
 
         return None
 
-    def _generate_changes(self) -> List[PSChangeTypeArray]:
-        change: PSChangeTypeBase = None
+    def _typed_change(self, key, value):
+        change_type = self._change_type_lookup(value.__class__)
+        if not change_type:
+            print(value.__class__)
+        try:
+            change = change_type(self.pref_domain, self.byhost, key, value)
+        except PSChangeTypeNotImplementedException as e:
+            err_msg = f"key: {key}, {e}"
+            change = PSChangeTypeErrorMessage(err_msg)
+        return change
+
+    def _generate_changes(self) -> List[PSChangeTypeBase]:
         changes = []
         # sub-dictionaries that must be rewritten because
-        # something was removed.
+        # something was removed, or because rewriting is cheaper
+        # than adding each changed sub-key
         rewrite_dictionaries = {}
 
         # we can only append to existing arrays
         # if an array changes in any other way, we have to rewrite it
+        # (see ArrayDiff)
         rewrite_lists = {}
         domain = self.pref_domain
         for k, v in self.added.items():
-            # pprint(v)
-            change_type = self._change_type_lookup(v.__class__)
-            if not change_type:
-                print(v.__class__)
-            try:
-                change = change_type(domain, self.byhost, k, v)
-            except PSChangeTypeNotImplementedException as e:
-                err_msg = f"key: {k}, {e}"
-                change = PSChangeTypeErrorMessage(err_msg)
-
-            changes.append(change)
+            changes.append(self._typed_change(k, v))
 
         for k in self.removed:
             change = PSChangeTypeKeyDeleted(domain, self.byhost, k)
             changes.append(change)
 
         for key, val in self.modified.items():
-            if isinstance(val[1], dict):
-                added, removed, modified, same = self._dict_compare(
-                    val[0], val[1])
-                if len(removed):
-                    # There is no -dict-delete so we have to
-                    # rewrite this sub-dictionary
+            if isinstance(val[0], dict) and isinstance(val[1], dict):
+                plan = PlistDictPlan(self.tree_diff, key)
+                if plan.rewrite:
                     rewrite_dictionaries[key] = val[1]
                     continue
-                for subkey, subval in added.items():
+                for subkey, subval in plan.dict_adds.items():
                     change = PSChangeTypeDictAdd(
                         domain, self.byhost, key, subkey, subval)
                     changes.append(change)
-                for subkey, subval_tuple in modified.items():
-                    change = PSChangeTypeDictAdd(
-                        domain, self.byhost, key, subkey, subval_tuple[1])
-                    changes.append(change)
-            elif isinstance(val[1], list):
-                list_diffs = self._list_compare(val[0], val[1])
-                if list_diffs["same"]:
+            elif isinstance(val[1], dict):
+                rewrite_dictionaries[key] = val[1]
+            elif isinstance(val[0], list) and isinstance(val[1], list):
+                array_diff = ArrayDiff(val[0], val[1], self.tree_diff.hasher)
+                if array_diff.kind == ARRAY_SAME:
                     continue
-                elif list_diffs["append_to_l1"]:
-                    append = list_diffs["append_to_l1"]
-                    change = PSChangeTypeArrayAdd(domain, key, append)
+                elif array_diff.can_append:
+                    change = PSChangeTypeArrayAdd(
+                        domain, self.byhost, key, array_diff.appended)
                     changes.append(change)
                 else:
+                    # defaults(1) can't remove or insert array elements,
+                    # so anything but an append means rewriting the array
                     rewrite_lists[key] = val[1]
+            elif isinstance(val[1], list):
+                rewrite_lists[key] = val[1]
             else:
                 # for modified keys that aren't dictionaries, we treat them
                 # like adds
-                change_type = self._change_type_lookup(val[1].__class__)
-                try:
-                    change = change_type(domain, self.byhost, key, val[1])
-                except PSChangeTypeNotImplementedException as e:
-                    err_msg = f"key: {key}, {e}"
-                    change = PSChangeTypeErrorMessage(err_msg)
-                changes.append(change)
+                changes.append(self._typed_change(key, val[1]))
 
         for key, val in rewrite_dictionaries.items():
             change = PSChangeTypeDict(domain, self.byhost, key, val)
@@ -348,96 +533,1148 @@ class PrefSniff:
     def execute(self, args, stdout=None):
         subprocess.check_call(args, stdout=stdout)
 
+    def apply(self, runner=None, max_workers=ChangeApplier.MAX_WORKERS):
+        """
+        Run this diff's commands, returning an ApplyReport
+
+        Changes that couldn't be represented as commands are left out,
+        having already been reported as errors in self.changes.
+        """
+        changes = [ch for ch in self.changes
+                   if not isinstance(ch, PSChangeTypeErrorMessage)]
+        applier = ChangeApplier(runner=runner, max_workers=max_workers)
+        return applier.apply(changes)
+
+
+def load_and_diff(path, before, after, stats: PipelineStats = None,
+                  **kwargs) -> Tuple[PrefSniff, Exception]:
+    """
+    Parse and diff two versions of the plist at ``path``
+
+    Each version is raw data or a parsed plist. Returns (PrefSniff, None),
+    or (None, error) if either is corrupt; binary plists decode lazily, so
+    that can surface mid-diff. Other keyword arguments go to PrefSniff.
+    """
+    if stats is None:
+        stats = NULL_STATS
+    try:
+        if isinstance(before, bytes):
+            with stats.timer(PARSE):
+                before = load_plist(before)
+        if isinstance(after, bytes):
+            with stats.timer(PARSE):
+                after = load_plist(after)
+            stats.count(PLISTS_PARSED)
+        diffs = PrefSniff(path, before=before, after=after, stats=stats,
+                          **kwargs)
+    except PLIST_ERRORS as e:
+        return None, e
+    return diffs, None
+
+
+class PrefWatchSession:
+    """
+    Long-lived watch of a single plist file
+
+    Each change is diffed against the previous change's "after" state, so
+    the file is read once per change.
+    """
+
+    def __init__(self, plistpath, coalesce_window=0.0, event_queue=None,
+                 queue_size=BoundedEventQueue.MAXSIZE, overflow=BLOCK,
+                 stats: PipelineStats = None, recorder=None,
+                 trigger=TRIGGER_MODIFY):
+        self.plistpath = plistpath
+        self.plist_dir = os.path.dirname(plistpath)
+        self.plist_base = os.path.basename(plistpath)
+        self.coalesce_window = coalesce_window
+        self.trigger = trigger
+        # anything with a put() method will do; see prefsniff.aio.
+        # Otherwise a fresh BoundedEventQueue is made on each start()
+        self._own_queue = event_queue is None
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.event_queue = event_queue
+        if stats is None:
+            stats = NULL_STATS
+        self.stats = stats
+        # EventLogWriter to record events to, if any
+        self.recorder = recorder
+        self.event_handler = None
+        self.observer = None
+        self.baseline = None
+        # PlistDiff.after_digests() of the baseline
+        self.baseline_digests = None
+        self.fingerprints = PlistFingerprintCache()
+        # the plist's domain, worked out once rather than for every change
+        self.path_info = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        if self.observer is not None:
+            return
+        if self.path_info is None:
+            self.path_info = PlistPathInfo.for_path(self.plistpath)
+        if self._own_queue:
+            self.event_queue = BoundedEventQueue(self.queue_size,
+                                                 self.overflow)
+        self.event_handler = PrefChangedEventHandler(
+            self.plist_base, self.event_queue,
+            coalesce_window=self.coalesce_window, trigger=self.trigger)
+        self.observer = self.event_handler.watch(self.plist_dir,
+                                                 self._read_baseline)
+
+    def stop(self):
+        if self.observer is None:
+            return
+        self.event_handler.unwatch(
+            self.observer, self.event_queue if self._own_queue else None)
+        self.observer = None
+        self.event_handler = None
 
-class PrefsWatcher:
-    class _PrefsWatchFilter:
-
-        def __init__(self, pattern_string, pattern_is_regex=False, negative_match=False):
-            self.pattern = pattern_string
-            self.regex = None
-            if pattern_is_regex:
-                self.regex = re.compile(pattern_string)
-            self.negative_match = negative_match
-
-        def passes_filter(self, input_string):
-            match = False
-            passes = False
-            if not self.regex:
-                match = self.pattern_string in input_string
+    @property
+    def skipped_parses(self):
+        """
+        Number of change events ignored because the file's contents hadn't changed
+        """
+        return self.fingerprints.skipped_parses
+
+    def _read_baseline(self):
+        if self.baseline is not None:
+            # kept from before the session was stopped
+            return
+        # nothing is fingerprinted yet, so this always reads
+        with self.stats.timer(READ):
+            data, fingerprint = self.fingerprints.read_if_changed(
+                self.plistpath)
+        self.stats.count(BYTES_READ, len(data))
+        with self.stats.timer(PARSE):
+            self.baseline = load_plist(data)
+        self.stats.count(PLISTS_PARSED)
+        self.fingerprints.update(self.plistpath, fingerprint)
+        if self.recorder is not None:
+            self.recorder.baseline(self.plistpath, data, self.path_info)
+
+    def changes(self, yield_idle=False):
+        """
+        Generator yielding a PrefSniff object for each detected change
+
+        With ``yield_idle``, None is yielded after each idle half second.
+        """
+        self.start()
+        while True:
+            try:
+                event = self.event_queue.get(True, 0.5)
+            except QueueEmpty:
+                if yield_idle:
+                    yield None
+                continue
+            diffs = self.diff_event(event)
+            if diffs is not None:
+                yield diffs
+
+    def diff_event(self, event):
+        """
+        Diff the plist against the baseline if ``event`` changed it
+
+        Returns a PrefSniff, which becomes the new baseline, or None.
+        """
+        self.stats.count(EVENTS_RECEIVED)
+        if not is_prefchange_event(event, self.plist_base):
+            self.stats.count(EVENTS_SKIPPED)
+            return None
+        try:
+            with self.stats.timer(READ):
+                # None if the file is byte-for-byte what we last parsed
+                read = self.fingerprints.read_if_changed(self.plistpath)
+        except FileNotFoundError:
+            # unlinked to be replaced; the following event will pick up
+            # the new contents
+            read = None
+        if self.recorder is not None:
+            self.recorder.record(*event, None if read is None else read[0],
+                                 self.path_info)
+        diffs = None
+        if read is not None:
+            data, fingerprint = read
+            self.stats.count(BYTES_READ, len(data))
+            # None if we caught it mid-write
+            diffs, _ = load_and_diff(self.plistpath, self.baseline, data,
+                                     self.stats, raw_event_count=event[2],
+                                     path_info=self.path_info,
+                                     before_digests=self.baseline_digests)
+        if diffs is None:
+            self.stats.count(EVENTS_SKIPPED)
+            return None
+        self.fingerprints.update(self.plistpath, fingerprint)
+        self.baseline = diffs.after
+        self.baseline_digests = diffs.tree_diff.after_digests()
+        return diffs
+
+
+class NetChangeAccumulator:
+    """
+    Net effect of a series of changes to one plist
+
+    update() folds in each PrefSniff's changed top-level keys, keeping each
+    key's first value as its original; a key back at its original is
+    dropped. net_changes() diffs just the keys left over.
+    """
+    # stands in for a key that isn't in the plist
+    _ABSENT = object()
+
+    def __init__(self, plistpath, path_info: PlistPathInfo = None):
+        self.plistpath = plistpath
+        self.path_info = path_info
+        # key -> value before the first change folded in, or _ABSENT
+        self._original = {}
+        # key -> latest value, or _ABSENT, for keys that differ from
+        # their original
+        self._latest = {}
+        # the whole plist as of the last change folded in
+        self._after = None
+        # changes and filesystem events folded in so far
+        self.updates = 0
+        self.raw_event_count = 0
+
+    def __len__(self):
+        return len(self._latest)
+
+    def update(self, diffs: PrefSniff):
+        tree_diff = diffs.tree_diff
+        # only the changed keys, already decoded
+        before = tree_diff.before
+        after = tree_diff.after
+        hasher = tree_diff.hasher
+        absent = self._ABSENT
+        for key in (list(diffs.added) + list(diffs.removed) +
+                    list(diffs.modified)):
+            original = self._original.setdefault(key, before.get(key, absent))
+            latest = after.get(key, absent)
+            if original is absent or latest is absent:
+                reverted = original is latest
             else:
-                re_match = self.regex.match(input_string)
-                if re_match is not None:
-                    match = True
-
-            if self.negative_match:
-                passes = (not match)
+                reverted = hasher.node_key(original) == hasher.node_key(latest)
+            if reverted:
+                del self._original[key]
+                self._latest.pop(key, None)
             else:
-                passes = match
+                self._latest[key] = latest
+        self._after = diffs.after
+        self.updates += 1
+        self.raw_event_count += diffs.raw_event_count
+
+    def net_changes(self) -> PrefSniff:
+        """
+        A PrefSniff whose changes take the plist from before the first
+        update to after the last in as few commands as possible
+        """
+        absent = self._ABSENT
+        before = {key: self._original[key] for key in self._latest
+                  if self._original[key] is not absent}
+        after = {key: value for key, value in self._latest.items()
+                 if value is not absent}
+        net = PrefSniff(self.plistpath, before=before, after=after,
+                        raw_event_count=self.raw_event_count,
+                        path_info=self.path_info)
+        if self._after is not None:
+            # Changes are worked out from the keys left over, but a plan
+            # may import the whole "after" plist, and --verify replays
+            # the changes onto the whole "before" one, so hand the net
+            # diff both in full
+            try:
+                net.after = materialize(self._after)
+            except PLIST_ERRORS:
+                # a key that never changed is corrupt; leave the plist
+                # as it is, so anything that needs it whole fails as it
+                # would for any other diff
+                net.after = self._after
+                return net
+            net.before = dict(net.after)
+            for key, original in self._original.items():
+                if original is absent:
+                    del net.before[key]
+                else:
+                    net.before[key] = original
+        return net
+
+
+class PlistTreeBaselines:
+    """
+    The last parsed version of every plist under a directory
+
+    Shared by PrefsWatcher, prefsniff.aio and replay_event_log(). With
+    ``keep_data``, baselines are raw data, for worker processes. ``index``
+    replaces the PlistPathIndex of ``root``, e.g. with a RecordedPathIndex.
+    """
+
+    def __init__(self, root, path_filter=None,
+                 max_bytes=PlistBaselineCache.MAX_BYTES, keep_data=False,
+                 stats: PipelineStats = None, recorder=None, index=None):
+        if path_filter is None:
+            path_filter = PathFilter()
+        self.path_filter = path_filter
+        if stats is None:
+            stats = NULL_STATS
+        self.stats = stats
+        # EventLogWriter to record events to, if any
+        self.recorder = recorder
+        self.keep_data = keep_data
+        # every plist being watched, and its domain
+        if index is None:
+            index = PlistPathIndex(root)
+        self.index = index
+        self.baselines = PlistBaselineCache(max_bytes)
+        self.fingerprints = PlistFingerprintCache()
+
+    def load(self):
+        """
+        Read and parse every plist, returning how many were loaded
+        """
+        loaded = 0
+        self.index.build()
+        for path in self.index.paths():
+            if not self.path_filter.matches(path):
+                continue
+            try:
+                # nothing is fingerprinted yet, so this always reads
+                data, fingerprint = self.fingerprints.read_if_changed(path)
+            except OSError:
+                continue
+            if self.add(path, data, fingerprint):
+                loaded += 1
+        return loaded
+
+    def add(self, path, data, fingerprint=None) -> bool:
+        """
+        Take plist data as the baseline for ``path``, returning whether it parsed
+        """
+        try:
+            pref = load_plist(data)
+        except PLIST_ERRORS:
+            return False
+        if fingerprint is None:
+            fingerprint = PlistFingerprint.of_data(data)
+        self.fingerprints.update(path, fingerprint)
+        self.baselines.put(path, data if self.keep_data else pref, len(data))
+        if self.recorder is not None:
+            self.recorder.baseline(path, data, self.index.get(path))
+        return True
+
+    def changed_path(self, changed):
+        """
+        The plist a queued (event_type, event, raw_event_count) is about,
+        or None if it's about a directory
+        """
+        event_type, event, raw_event_count = changed
+        self.stats.count(EVENTS_RECEIVED)
+        self.index.update(event_type, event)
+        if event.is_directory:
+            return None
+        path = event_path(event_type, event)
+        if event_type == "deleted" and self.recorder is not None:
+            # nothing will be read for it
+            self.recorder.record(event_type, event, raw_event_count, None)
+        # atomic saves rename a temp file over the plist
+        return path
+
+    def diff_args(self, path, raw_event_count, formatter=None,
+                  data=None) -> tuple:
+        """
+        Arguments to diff_plist_file() for a change to the plist at ``path``
+        """
+        fingerprint = self.fingerprints.get(path)
+        before = self.baselines.get(path)
+        if before is None and fingerprint is None:
+            # a plist we've never parsed is new, so all of its keys are added
+            before = {}
+        try:
+            path_info = self.index.get(path)
+        except OSError:
+            # gone already; the diff will find that out too
+            path_info = None
+        return (path, before, fingerprint, raw_event_count, formatter,
+                self.keep_data, path_info, self.stats.enabled, data)
+
+    def finish(self, changed, result: "PlistFileDiff"):
+        """
+        Keep the baseline the diff for a queued event left behind
+        """
+        path = event_path(changed[0], changed[1])
+        if self.recorder is not None:
+            try:
+                path_info = self.index.get(path)
+            except OSError:
+                path_info = None
+            self.recorder.record(*changed, result.data, path_info)
+        if result.stats is not None:
+            self.stats.merge(result.stats)
+        if result.fingerprint is not None:
+            self.fingerprints.update(path, result.fingerprint)
+            self.baselines.put(path, result.baseline, result.baseline_size)
 
-            return passes
 
-    def __init__(self, prefsdir):
+class PrefsWatcher:
+    class _DiffJob:
+        def __init__(self, path, raw_event_count, header, changed=None):
+            self.path = path
+            self.raw_event_count = raw_event_count
+            self.header = header
+            # the queued event it's for
+            self.changed = changed
+            self.output = None
+            self.errors = None
+
+    def __init__(self, prefsdir, coalesce_window=0.0, formatter=None,
+                 writer=None, baseline_max_bytes=PlistBaselineCache.MAX_BYTES,
+                 workers=0, worker_processes=True, path_filter=None,
+                 queue_size=BoundedEventQueue.MAXSIZE, overflow=BLOCK,
+                 stats: PipelineStats = None, resume_store=None,
+                 recorder=None, trigger=TRIGGER_MODIFY):
         self.prefsdir = prefsdir
-        self.filters = [self._PrefsWatchFilter(
-            r".*\.plist$", pattern_is_regex=True)]
+        # SnapshotStore to resume from, and snapshot on exit
+        self.resume_store = resume_store
+        # EventLogWriter to record events to, if any
+        self.recorder = recorder
+        if stats is None:
+            stats = NULL_STATS
+        self.stats = stats
+        self.coalesce_window = coalesce_window
+        self.trigger = trigger
+        self.event_queue = BoundedEventQueue(queue_size, overflow)
+        if formatter is None:
+            formatter = ChangeFormatter()
+        self.formatter = formatter
+        if writer is None:
+            writer = BufferedOutputWriter(sys.stdout, max_delay=0)
+        self.writer = writer
+        # applied to events before they're queued; see PrefChangedEventHandler
+        if path_filter is None:
+            path_filter = PathFilter()
+        self.path_filter = path_filter
+        self.workers = workers
+        # Worker processes are handed baselines as raw plist data rather
+        # than parsed plists, which are costly to pickle
+        self.keep_data = bool(workers and worker_processes)
+        self.tree = PlistTreeBaselines(
+            prefsdir, path_filter, baseline_max_bytes, self.keep_data,
+            stats, recorder)
+        self._pool = None
+        if workers and worker_processes:
+            self._pool = process_pool(workers)
+        elif workers:
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+        # (job, future) pairs for jobs that have finished in a worker
+        self._finished = Queue()
+        # path -> jobs for that path waiting on the one in flight
+        self._waiting = {}
+        # all unprinted jobs, in the order their events arrived
+        self._jobs = deque()
         self._watch_prefsdir()
 
+    def _resume(self):
+        snapshot_id = self.resume_store.latest(self.prefsdir)
+        if snapshot_id is None:
+            print("No snapshot of %s to resume from" % self.prefsdir,
+                  file=self.formatter.status_file)
+            return
+        # Baselines were just read, so anything that differs from the
+        # snapshot changed while we weren't watching
+        for diffs in diff_snapshot(self.resume_store, snapshot_id,
+                                   root=self.prefsdir, stats=self.stats):
+            if not diffs.changes or \
+                    not self.path_filter.matches(diffs.plistpath):
+                continue
+            job = self._DiffJob(diffs.plistpath, 0,
+                                "Changed since snapshot %d: %s\n" % (
+                                    snapshot_id, diffs.plistpath))
+            with self.stats.timer(RENDER):
+                job.output, job.errors = self.formatter.render(diffs)
+            self.stats.count(CHANGES_EMITTED, len(diffs.changes))
+            self._jobs.append(job)
+        self._print_finished()
+
+    def _queue_event(self, changed):
+        event_type, event, raw_event_count = changed
+        path = self.tree.changed_path(changed)
+        if path is None:
+            return
+        header = "Detected change: [%s] %s" % (event_type, path)
+        if raw_event_count > 1:
+            header += " (%d events)" % raw_event_count
+        job = self._DiffJob(path, raw_event_count, header + "\n", changed)
+        self._jobs.append(job)
+        # A deleted plist is usually about to be replaced, so its baseline
+        # is kept for diffing the replacement against
+        if event_type == "deleted":
+            job.output = ""
+        elif path in self._waiting:
+            # Changes to the same file are diffed one at a time, each
+            # against the baseline the previous one left behind
+            self._waiting[path].append(job)
+        else:
+            self._submit(job)
+
+    def _submit(self, job):
+        path = job.path
+        self._waiting.setdefault(path, deque())
+        args = self.tree.diff_args(path, job.raw_event_count, self.formatter)
+        if self._pool is None:
+            self._finish(job, diff_plist_file(*args))
+            return
+        future = self._pool.submit(diff_plist_file, *args)
+        future.add_done_callback(
+            lambda future: self._finished.put((job, future)))
+
+    def _finish(self, job, result):
+        self.tree.finish(job.changed, result)
+        job.output = result.output
+        job.errors = result.errors
+        waiting = self._waiting[job.path]
+        if waiting:
+            self._submit(waiting.popleft())
+        else:
+            del self._waiting[job.path]
+
+    def _drain_finished(self):
+        while True:
+            try:
+                job, future = self._finished.get_nowait()
+            except QueueEmpty:
+                break
+            try:
+                result = future.result()
+            except Exception as e:
+                result = PlistFileDiff(errors="ERROR: %s: %s\n" % (job.path, e))
+            self._finish(job, result)
+
+    def _print_finished(self):
+        # Output is printed in event order, no matter which worker
+        # finishes first
+        while self._jobs and self._jobs[0].output is not None:
+            job = self._jobs.popleft()
+            if self.formatter.status_file is sys.stdout:
+                self.writer.write(job.header + job.output)
+            else:
+                print(job.header, end="", file=self.formatter.status_file)
+                self.writer.write(job.output)
+            if job.errors:
+                sys.stderr.write(job.errors)
+
+    def _load_baselines(self):
+        loaded = self.tree.load()
+        print("Cached baselines for %d plists" % loaded,
+              file=self.formatter.status_file)
+        if self.resume_store is not None:
+            self._resume()
+
     def _watch_prefsdir(self):
-        event_queue = Queue()
-        event_handler = PrefChangedEventHandler(None, event_queue)
-        observer = Observer()
-        observer.schedule(event_handler, self.prefsdir, recursive=False)
-        observer.start()
+        event_queue = self.event_queue
+        event_handler = PrefChangedEventHandler(
+            None, event_queue, coalesce_window=self.coalesce_window,
+            path_filter=self.path_filter, trigger=self.trigger)
+        # ByHost plists live in a subdirectory
+        observer = event_handler.watch(self.prefsdir, self._load_baselines,
+                                       recursive=True)
 
         while True:
             try:
-                changed = event_queue.get(True, 0.5)
-                src_path = changed[1].src_path
-                passes = True
-                for _filter in self.filters:
-                    if not _filter.passes_filter(src_path):
-                        passes = False
-                        break
-                if not passes:
-                    continue
-                print("Detected change: [%s] %s" %
-                      (changed[0], changed[1].src_path))
+                # poll more often while workers have jobs in flight
+                timeout = 0.05 if self._waiting else 0.5
+                changed = event_queue.get(True, timeout)
+                self._queue_event(changed)
             except QueueEmpty:
                 pass
             except KeyboardInterrupt:
                 break
-        observer.stop()
-        observer.join()
+            self._drain_finished()
+            self._print_finished()
+        event_handler.unwatch(observer, event_queue)
+        self.writer.flush()
+        print("Filtered events: %d passed, %d dropped" % (
+            self.path_filter.passed, self.path_filter.dropped),
+            file=self.formatter.status_file)
+        print("Event queue: high water %d, %d dropped, %d coalesced" % (
+            event_queue.high_water, event_queue.dropped,
+            event_queue.coalesced), file=self.formatter.status_file)
+        if self.resume_store is not None:
+            snapshot_id, scan = self.resume_store.take(self.prefsdir)
+            print("Saved snapshot %d of %d plists" % (
+                snapshot_id, len(scan.entries)),
+                file=self.formatter.status_file)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def process_pool(max_workers) -> ProcessPoolExecutor:
+    """
+    A pool of worker processes that leave Ctrl-C to the process that started them
+    """
+    # Forking while an observer's threads hold locks can leave a worker
+    # deadlocked, so always start workers fresh
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=signal.signal,
+        initargs=(signal.SIGINT, signal.SIG_IGN))
+
+
+class PlistFileDiff:
+    """
+    Outcome of diffing a plist file against its baseline; see diff_plist_file()
+    """
+
+    def __init__(self, fingerprint=None, baseline=None, baseline_size=0,
+                 output="", errors="", data=None):
+        # None if the file was unchanged or unreadable,
+        # in which case the baseline stays as it was
+        self.fingerprint = fingerprint
+        self.baseline = baseline
+        self.baseline_size = baseline_size
+        self.output = output
+        self.errors = errors
+        # the data read, even if it didn't parse; None if the file was
+        # unchanged or gone
+        self.data = data
+        # the PrefSniff itself, if it wasn't rendered
+        self.diffs = None
+        # PipelineStats.snapshot() of the work done, if it was collected
+        self.stats = None
+
+
+def diff_plist_file(path, before, fingerprint, raw_event_count=1,
+                    formatter=None, keep_data=False, path_info=None,
+                    collect_stats=False, data=None) -> PlistFileDiff:
+    """
+    Read the plist at path and render its changes relative to ``before``
+
+    ``before`` is the last parsed plist, or None, and ``fingerprint`` the
+    PlistFingerprint it came from. With ``keep_data``, ``before`` and the
+    returned baseline are raw data, so this can run in a worker process.
+    Without a ``formatter``, the PrefSniff is returned unrendered. ``data``
+    is used instead of reading ``path``, e.g. for a replay.
+    """
+    stats = NULL_STATS
+    if collect_stats:
+        stats = PipelineStats()
+    result = _diff_plist_file(path, before, fingerprint, raw_event_count,
+                              formatter, keep_data, path_info, stats, data)
+    if collect_stats:
+        result.stats = stats.snapshot()
+    return result
+
+
+def _diff_plist_file(path, before, fingerprint, raw_event_count, formatter,
+                     keep_data, path_info, stats, data) -> PlistFileDiff:
+    fingerprints = PlistFingerprintCache()
+    if fingerprint is not None:
+        fingerprints.update(path, fingerprint)
+    try:
+        with stats.timer(READ):
+            if data is None:
+                read = fingerprints.read_if_changed(path)
+            else:
+                read = fingerprints.data_if_changed(path, data)
+    except FileNotFoundError:
+        # caught it mid-replacement; the following event will have it
+        read = None
+    if read is None:
+        stats.count(EVENTS_SKIPPED)
+        return PlistFileDiff()
+    data, fingerprint = read
+    stats.count(BYTES_READ, len(data))
+    if before is None:
+        try:
+            with stats.timer(PARSE):
+                after = load_plist(data)
+        except PLIST_ERRORS:
+            stats.count(EVENTS_SKIPPED)
+            return PlistFileDiff(data=data)
+        stats.count(PLISTS_PARSED)
+        result = PlistFileDiff(fingerprint, data if keep_data else after,
+                               len(data), data=data)
+        result.output = "No cached baseline for %s, diffing from its next change\n" % path
+        return result
+    try:
+        diffs, _ = load_and_diff(path, before, data, stats,
+                                 raw_event_count=raw_event_count,
+                                 path_info=path_info)
+    except FileNotFoundError:
+        # gone before its domain could be worked out; as with a deleted
+        # plist, the baseline is kept for diffing its replacement against
+        stats.count(EVENTS_SKIPPED)
+        return PlistFileDiff(data=data)
+    if diffs is None:
+        # caught it mid-write; keep the baseline as it was
+        stats.count(EVENTS_SKIPPED)
+        return PlistFileDiff(data=data)
+    result = PlistFileDiff(fingerprint, data if keep_data else diffs.after,
+                           len(data), data=data)
+    if formatter is None:
+        result.diffs = diffs
+    elif diffs.changes:
+        with stats.timer(RENDER):
+            result.output, result.errors = formatter.render(diffs)
+        stats.count(CHANGES_EMITTED, len(diffs.changes))
+    return result
+
+
+def diff_snapshot(store: SnapshotStore, snapshot_id, against=None, root=None,
+                  stats=None, err_file=None) -> Iterator[PrefSniff]:
+    """
+    Yield a PrefSniff for each plist that differs between a snapshot and ``against``
+
+    See snapshot_differences() for the arguments. Added and removed plists
+    are diffed against an empty plist; unparseable ones are reported to
+    ``err_file`` and skipped.
+    """
+    if err_file is None:
+        err_file = sys.stderr
+    for path, path_info, old_data, new_data in snapshot_differences(
+            store, snapshot_id, against=against, root=root):
+        diffs, error = load_and_diff(
+            path, {} if old_data is None else old_data,
+            {} if new_data is None else new_data, stats, path_info=path_info)
+        if diffs is None:
+            print("ERROR: %s: %s" % (path, error), file=err_file)
+            continue
+        yield diffs
+
+
+def diff_plist_pair(path_a, path_b, path_info, formatter) -> Tuple[str, str, int]:
+    """
+    Render the changes that turn the plist at path_a into the one at path_b
+
+    A path of None is diffed as an empty plist. Returns (output, error
+    output, number of changes).
+    """
+    data = []
+    for path in (path_a, path_b):
+        if path is None:
+            data.append(None)
+            continue
+        try:
+            with open(path, "rb") as f:
+                data.append(f.read())
+        except OSError as e:
+            return "", "ERROR: %s\n" % e, 0
+    if data[0] == data[1]:
+        return "", "", 0
+    before, after = [{} if d is None else d for d in data]
+    diffs, error = load_and_diff(path_a or path_b, before, after,
+                                 plistpath2=path_b or path_a,
+                                 path_info=path_info)
+    if diffs is None:
+        return "", "ERROR: %s -> %s: %s\n" % (path_a, path_b, error), 0
+    if not diffs.changes:
+        return "", "", 0
+    output, errors = formatter.render(diffs)
+    return output, errors, len(diffs.changes)
+
+
+def _diff_plist_pairs(pairs, formatter):
+    # one batch of diff_plist_pair()s, to spread the cost of handing
+    # work to a worker process over several plists
+    results = []
+    for path_a, info_a, path_b, info_b in pairs:
+        output, errors, count = diff_plist_pair(path_a, path_b,
+                                                info_a or info_b, formatter)
+        results.append((path_a, path_b, output, errors, count))
+    return results
+
+
+def replay_event_log(path, formatter, writer, speed=0.0, stats=None,
+                     status_file=None, coalesce_window=0.0,
+                     queue_size=BoundedEventQueue.MAXSIZE,
+                     overflow=BLOCK) -> List[float]:
+    """
+    Handle the events in a log recorded with --record, as a watcher would have
+
+    Events go through the same queue, coalescer and PlistTreeBaselines as
+    PrefsWatcher's, but each plist's data comes from the log. With a
+    ``speed``, events are queued at that multiple of the recorded speed,
+    else as fast as they're handled. Returns each handled event's latency.
+    """
+    if stats is None:
+        stats = NULL_STATS
+    if status_file is None:
+        status_file = formatter.status_file
+    index = RecordedPathIndex()
+    tree = PlistTreeBaselines(None, stats=stats, index=index)
+    event_queue = BoundedEventQueue(queue_size, overflow)
+    coalescer = None
+    if coalesce_window > 0:
+        coalescer = PrefEventCoalescer(event_queue, coalesce_window)
+    # path -> its data as of the last event queued for it, standing in
+    # for the file
+    files = {}
+    # path -> when the last event queued for it was due
+    due = {}
+    latencies = []
+
+    def handle(changed):
+        event_type, event, raw_event_count = changed
+        plistpath = tree.changed_path(changed)
+        if plistpath is None or event_type == "deleted":
+            # as with watching, a deleted plist's baseline is kept for
+            # diffing its replacement against
+            pass
+        elif plistpath not in files:
+            # never read while it was recorded
+            stats.count(EVENTS_SKIPPED)
+        else:
+            result = diff_plist_file(*tree.diff_args(
+                plistpath, raw_event_count, formatter, files[plistpath]))
+            tree.finish(changed, result)
+            if result.output:
+                header = "Replayed change: [%s] %s\n" % (
+                    event_type, plistpath)
+                if status_file is sys.stdout:
+                    writer.write(header + result.output)
+                else:
+                    print(header, end="", file=status_file)
+                    writer.write(result.output)
+            if result.errors:
+                sys.stderr.write(result.errors)
+        latency = time.perf_counter() - due[event_path(event_type, event)]
+        latencies.append(latency)
+
+    def handle_queued(timeout=None):
+        # handle events until none arrives within ``timeout`` seconds,
+        # or until none is waiting
+        while True:
+            try:
+                changed = event_queue.get(timeout is not None, timeout)
+            except QueueEmpty:
+                return
+            handle(changed)
+            if timeout is not None:
+                return
+
+    start = time.perf_counter()
+    try:
+        for record in read_event_log(path):
+            index.add(record)
+            plistpath = record.path
+            if record.event_type is None:
+                if record.data is not None:
+                    files[plistpath] = record.data
+                    tree.add(plistpath, record.data)
+                continue
+            now = time.perf_counter()
+            if speed:
+                when = start + record.time / speed
+                while now < when:
+                    handle_queued(when - now)
+                    now = time.perf_counter()
+            if overflow != DROP_OLDEST and \
+                    event_queue.depth >= event_queue.maxsize:
+                # this thread is the only one taking events off the queue
+                handle(event_queue.get())
+            if record.event_type == "deleted":
+                files.pop(plistpath, None)
+            elif record.data is not None:
+                files[plistpath] = record.data
+            due[plistpath] = now
+            changed = (record.event_type, record.event(),
+                       record.raw_event_count)
+            if coalescer is None:
+                event_queue.put(changed)
+            else:
+                coalescer.put(changed)
+            if not speed:
+                handle_queued()
+        if coalescer is not None:
+            coalescer.flush()
+        handle_queued()
+    finally:
+        if coalescer is not None:
+            coalescer.stop()
+    return latencies
+
+
+def is_prefchange_event(event, plist_base):
+    event_type, fs_event = event[0], event[1]
+    pref_updated = False
+    if event_type == "moved" and os.path.basename(fs_event.dest_path) == plist_base:
+        pref_updated = True
+    if event_type == "modified" and os.path.basename(fs_event.src_path) == plist_base:
+        pref_updated = True
+    if event_type == "created" and os.path.basename(fs_event.src_path) == plist_base:
+        pref_updated = True
+    return pref_updated
+
+
+class PrefEventCoalescer:
+    """
+    Collapse bursts of filesystem events for the same path into one
+
+    An event is queued once its path has been quiet for ``window`` seconds,
+    along with the number of raw events it absorbed.
+    """
+
+    def __init__(self, event_queue, window):
+        self.event_queue = event_queue
+        self.window = window
+        # path -> [event_type, event, raw_count, deadline]
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="PrefEventCoalescer", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        event_type, event = item[0], item[1]
+        path = event_path(event_type, event)
+        deadline = time.monotonic() + self.window
+        with self._cond:
+            pending = self._pending.get(path)
+            if pending is None:
+                self._pending[path] = [event_type, event, 1, deadline]
+            else:
+                pending[0] = event_type
+                pending[1] = event
+                pending[2] += 1
+                pending[3] = deadline
+            self._cond.notify()
+
+    def _pop_expired(self, now):
+        expired = []
+        for path, pending in list(self._pending.items()):
+            if pending[3] <= now:
+                expired.append(tuple(pending[:3]))
+                del self._pending[path]
+        return expired
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    break
+                now = time.monotonic()
+                expired = self._pop_expired(now)
+                if not expired:
+                    timeout = None
+                    if self._pending:
+                        timeout = min(p[3] for p in self._pending.values()) - now
+                    self._cond.wait(timeout)
+                    continue
+            for item in expired:
+                self.event_queue.put(item)
+
+    def flush(self):
+        """
+        Queue all pending events immediately, regardless of their deadlines
+        """
+        with self._cond:
+            pending = [tuple(p[:3]) for p in self._pending.values()]
+            self._pending.clear()
+        for item in pending:
+            self.event_queue.put(item)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
 
 
 class PrefChangedEventHandler(FileSystemEventHandler):
-
-    def __init__(self, file_base_name, event_queue):
+    """
+    Queue filesystem events as (event_type, event, raw_event_count) tuples
+
+    Events are debounced if there's a ``coalesce_window``, and dropped if
+    ``path_filter`` rejects their path. With the close-write ``trigger``, a
+    file is queued once it's closed after writing, rather than on each write.
+    """
+    # the events the close-write trigger needs. Asking for directories'
+    # modified events would have inotify report every write to a file
+    # in them too
+    CLOSE_WRITE_EVENTS = [FileCreatedEvent, FileDeletedEvent, FileMovedEvent,
+                          FileClosedEvent, DirCreatedEvent, DirDeletedEvent,
+                          DirMovedEvent]
+
+    def __init__(self, file_base_name, event_queue, coalesce_window=0.0,
+                 path_filter=None, trigger=TRIGGER_MODIFY):
         super(self.__class__, self).__init__()
         if file_base_name is None:
             file_base_name = ""
         self.file_base_name = file_base_name
+        self.coalescer = None
+        if coalesce_window:
+            self.coalescer = PrefEventCoalescer(event_queue, coalesce_window)
+            event_queue = self.coalescer
         self.event_queue = event_queue
+        self.path_filter = path_filter
+        self.close_write = trigger == TRIGGER_CLOSE_WRITE
+        if self.close_write and WATCHDOG_VERSION < CLOSE_WRITE_WATCHDOG:
+            raise PSniffException(
+                "the close-write trigger needs watchdog %d.%d or later" %
+                CLOSE_WRITE_WATCHDOG)
+        # files created in place whose first close hasn't arrived yet;
+        # only touched from the observer's thread
+        self._writing = set()
+        # files queued as created when their directory was moved in
+        self._moved_in = set()
+
+    def stop(self):
+        if self.coalescer is not None:
+            self.coalescer.stop()
+
+    def observer(self, path, recursive=False):
+        """
+        An observer, not yet started, handing events under ``path`` to this handler
+        """
+        if not self.close_write:
+            observer = Observer()
+            observer.schedule(self, path, recursive=recursive)
+            return observer
+        # Linux only, which main() checks. Full events report a move
+        # from outside the watch as a move rather than a creation, so
+        # it's told apart from a file created in place and still open
+        from watchdog.observers.inotify import InotifyObserver
+        observer = InotifyObserver(generate_full_events=True)
+        observer.schedule(self, path, recursive=recursive,
+                          event_filter=self.CLOSE_WRITE_EVENTS)
+        return observer
+
+    def watch(self, path, load_baselines, recursive=False):
+        """
+        Start an observer on ``path``, then call ``load_baselines``
+
+        Watching starts first so that a write landing while baselines are
+        read is queued rather than missed.
+        """
+        observer = self.observer(path, recursive=recursive)
+        try:
+            observer.start()
+        except BaseException:
+            self.stop()
+            raise
+        try:
+            load_baselines()
+        except BaseException:
+            self.unwatch(observer)
+            raise
+        return observer
+
+    def unwatch(self, observer, event_queue=None):
+        """
+        Stop an observer from watch()
+
+        ``event_queue`` is closed first, if given, so the observer isn't
+        left blocked putting to it while it's full.
+        """
+        if event_queue is not None:
+            event_queue.close()
+        observer.stop()
+        observer.join()
+        self.stop()
+
+    def _filtered(self, event, path):
+        if self.path_filter is None or event.is_directory:
+            return False
+        return not self.path_filter.accept(path)
 
     def on_created(self, event):
         if self.file_base_name not in os.path.basename(event.src_path):
             return
-        self.event_queue.put(("created", event))
+        if self._filtered(event, event.src_path):
+            return
+        if self.close_write and not event.is_directory:
+            if event.src_path in self._moved_in:
+                self._moved_in.discard(event.src_path)
+            else:
+                # still open for writing; queued once it's closed
+                self._writing.add(event.src_path)
+            return
+        self.event_queue.put(("created", event, 1))
 
     def on_deleted(self, event):
         if self.file_base_name not in os.path.basename(event.src_path):
             return
-        self.event_queue.put(("deleted", event))
+        if self._filtered(event, event.src_path):
+            return
+        self._writing.discard(event.src_path)
+        self._moved_in.discard(event.src_path)
+        self.event_queue.put(("deleted", event, 1))
 
     def on_modified(self, event):
         if self.file_base_name not in os.path.basename(event.src_path):
             return
-        self.event_queue.put(("modified", event))
+        if self.path_filter is not None and event.is_directory:
+            return
+        if self.close_write and not event.is_directory:
+            # still being written; wait for it to be closed
+            return
+        if self._filtered(event, event.src_path):
+            return
+        self.event_queue.put(("modified", event, 1))
+
+    def on_closed(self, event):
+        # only reported for files that were written to
+        if not self.close_write:
+            return
+        if self.file_base_name not in os.path.basename(event.src_path):
+            return
+        if self._filtered(event, event.src_path):
+            return
+        event_type = "modified"
+        if event.src_path in self._writing:
+            self._writing.discard(event.src_path)
+            event_type = "created"
+        self.event_queue.put((event_type, event, 1))
 
     def on_moved(self, event):
-        if self.file_base_name not in os.path.basename(event.src_path):
+        # close-write's full events report the ends of moves into and
+        # out of the watch on their own
+        if not event.dest_path:
+            cls = DirDeletedEvent if event.is_directory else FileDeletedEvent
+            self.on_deleted(cls(event.src_path))
+            return
+        if not event.src_path:
+            self._moved_in_from_outside(event)
+            return
+        # An atomic save renames a temp file of any name into place, so
+        # either end of the move may be the file we care about
+        if self.file_base_name not in os.path.basename(event.src_path) and \
+                self.file_base_name not in os.path.basename(event.dest_path):
             return
-        self.event_queue.put(("moved", event))
+        if self._filtered(event, event.dest_path):
+            return
+        # a temp file renamed into place was finished being written
+        # when it was closed, if that even happened yet
+        self._writing.discard(event.src_path)
+        self.event_queue.put(("moved", event, 1))
+
+    def _moved_in_from_outside(self, event):
+        if not event.is_directory:
+            self._put_complete(event.dest_path)
+            return
+        self.on_created(DirCreatedEvent(event.dest_path))
+        # watchdog follows up with a created event for everything in the
+        # directory, but its files are already complete
+        for dirpath, dirnames, filenames in os.walk(event.dest_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if self._put_complete(path):
+                    self._moved_in.add(path)
+
+    def _put_complete(self, path):
+        if self.file_base_name not in os.path.basename(path):
+            return False
+        event = FileCreatedEvent(path)
+        if self._filtered(event, path):
+            return False
+        self.event_queue.put(("created", event, 1))
+        return True
 
 
 def test_dict_add(domain, key, subkey, value):
@@ -483,10 +1720,284 @@ def parse_test_args(argv):
         exit(0)
 
 
+def print_changes(diffs, show_diffs, file=None, err_file=None):
+    if file is None:
+        file = sys.stdout
+    if err_file is None:
+        err_file = sys.stderr
+    print(STARS, file=file)
+    print("", file=file)
+    for ch in diffs.changes:
+        if isinstance(ch, PSChangeTypeErrorMessage):
+            print(f"ERROR: {ch}", file=err_file)
+            continue
+        print(ch.shell_command(), file=file)
+        print("", file=file)
+    if show_diffs == "scoped":
+        print('\n'.join(diffs.scoped_diff), file=file)
+    elif show_diffs:
+        print('\n'.join(diffs.diff), file=file)
+    print(STARS, file=file)
+
+
+def print_plan(diffs, planner, plan_format, show_diffs=None, file=None,
+               err_file=None):
+    """
+    Print the ChangePlan for a diff as a shell script or as JSON
+    """
+    if file is None:
+        file = sys.stdout
+    if err_file is None:
+        err_file = sys.stderr
+    plan = planner.plan(diffs)
+    for error in plan.errors:
+        print(f"ERROR: {error}", file=err_file)
+    if plan_format == "json":
+        print(json.dumps(plan.to_dict(), indent=2), file=file)
+        return
+    print(plan.shell_script(), file=file)
+    diff_lines = []
+    if show_diffs == "scoped":
+        diff_lines = diffs.scoped_diff
+    elif show_diffs:
+        diff_lines = diffs.diff
+    for line in diff_lines:
+        # keep the script runnable
+        print("# " + line.rstrip("\n"), file=file)
+
+
+class ChangeFormatter:
+    """
+    Renders a PrefSniff's changes in the output format chosen on the command line
+
+    ``output_format`` is "text" or "ndjson". With a ChangePlanner, the plan
+    is rendered instead. Formatters can be handed to worker processes.
+    """
+
+    def __init__(self, output_format="text", show_diffs=None, planner=None,
+                 plan_format="script"):
+        self.output_format = output_format
+        self.show_diffs = show_diffs
+        self.planner = planner
+        self.plan_format = plan_format
+
+    @property
+    def status_file(self):
+        """
+        Where status messages go, so as to stay out of machine-readable output
+        """
+        if self.output_format == "text" and self.planner is None:
+            return sys.stdout
+        return sys.stderr
+
+    def render(self, diffs) -> Tuple[str, str]:
+        """
+        Returns (output, error output) for diffs
+
+        A corrupt value that diffing never decoded makes the output an error.
+        """
+        try:
+            return self._render(diffs)
+        except PLIST_ERRORS as e:
+            return "", "ERROR: %s: %s\n" % (diffs.plistpath2, e)
+
+    def _render(self, diffs):
+        if self.output_format == "ndjson":
+            changes = diffs.changes
+            if self.planner is not None:
+                plan = self.planner.plan(diffs)
+                changes = plan.changes + plan.errors
+            records = change_records(changes, diffs.plistpath2,
+                                     diffs.timestamp, diffs.raw_event_count)
+            return ndjson_lines(records), ""
+        out = io.StringIO()
+        err = io.StringIO()
+        if self.planner is not None:
+            print_plan(diffs, self.planner, self.plan_format,
+                       self.show_diffs, file=out, err_file=err)
+        else:
+            print_changes(diffs, self.show_diffs, file=out, err_file=err)
+        return out.getvalue(), err.getvalue()
+
+
+def formatter_from_args(args) -> ChangeFormatter:
+    show_diffs = None
+    if args.scoped_diffs:
+        show_diffs = "scoped"
+    elif args.show_diffs:
+        show_diffs = "full"
+    planner = None
+    if args.plan:
+        planner = ChangePlanner(allow_import=not args.no_import)
+    return ChangeFormatter(output_format=args.format, show_diffs=show_diffs,
+                           planner=planner, plan_format=args.plan)
+
+
+def output_writer(args) -> BufferedOutputWriter:
+    max_delay = BufferedOutputWriter.MAX_DELAY
+    if args.format == "text" and sys.stdout.isatty():
+        # someone's reading along
+        max_delay = 0
+    return BufferedOutputWriter(sys.stdout, max_delay=max_delay)
+
+
+def snapshot_main(argv):
+    args = parse_snapshot_args(argv)
+    if not os.path.isdir(args.path):
+        print("Error: %s is not a directory, or does not exist." % args.path)
+        exit(1)
+    with SnapshotStore(args.store) as store:
+        snapshot_id, scan = store.take(args.path)
+    print("Snapshot %d of %s: %d plists, %d read (%d bytes), %d new in store" % (
+        snapshot_id, os.path.abspath(args.path), len(scan.entries),
+        len(scan.data), scan.bytes_read, scan.new_blobs))
+
+
+def diff_snapshot_main(argv):
+    args = parse_diff_snapshot_args(argv)
+    formatter = formatter_from_args(args)
+    status_file = formatter.status_file
+    writer = output_writer(args)
+    with SnapshotStore(args.store) as store:
+        if args.list:
+            for snapshot_id, root, created_ns in store.snapshots():
+                created = datetime.datetime.fromtimestamp(created_ns / 1e9)
+                print("%d\t%s\t%s" % (snapshot_id, created.isoformat(" ", "seconds"), root))
+            return
+        snapshot_id = args.snapshot
+        if snapshot_id is None and args.path is not None:
+            snapshot_id = store.latest(args.path)
+        if snapshot_id is None:
+            snapshot_id = store.latest()
+        if snapshot_id is None:
+            print("Error: no snapshots in %s" % args.store)
+            exit(1)
+        try:
+            changed = diff_snapshot(store, snapshot_id, against=args.against,
+                                    root=args.path)
+            for diffs in changed:
+                if not diffs.changes:
+                    continue
+                out, err = formatter.render(diffs)
+                if args.against is None:
+                    header = "Changed since snapshot %d: %s\n" % (
+                        snapshot_id, diffs.plistpath)
+                else:
+                    header = "Changed between snapshots %d and %d: %s\n" % (
+                        snapshot_id, args.against, diffs.plistpath)
+                if status_file is sys.stdout:
+                    writer.write(header + out)
+                else:
+                    print(header, end="", file=status_file)
+                    writer.write(out)
+                if err:
+                    sys.stderr.write(err)
+        except KeyError as e:
+            print("Error: %s" % e.args[0])
+            exit(1)
+    writer.close()
+
+
+def diff_tree_main(argv):
+    args = parse_diff_tree_args(argv)
+    for tree in (args.tree_a, args.tree_b):
+        if not os.path.isdir(tree):
+            print("Error: %s is not a directory, or does not exist." % tree)
+            exit(1)
+    formatter = formatter_from_args(args)
+    status_file = formatter.status_file
+    writer = output_writer(args)
+    workers = args.workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    pairs = pair_trees(args.tree_a, args.tree_b)
+    batches = [pairs[i:i + DIFF_TREE_BATCH]
+               for i in range(0, len(pairs), DIFF_TREE_BATCH)]
+    pool = None
+    if workers:
+        pool = process_pool(workers)
+        futures = [pool.submit(_diff_plist_pairs, batch, formatter)
+                   for batch in batches]
+        # results are printed as they finish, in no particular order
+        finished = (future.result() for future in as_completed(futures))
+    else:
+        finished = (_diff_plist_pairs(batch, formatter) for batch in batches)
+    files = 0
+    differing = 0
+    try:
+        for results in finished:
+            for path_a, path_b, output, errors, count in results:
+                files += (path_a is not None) + (path_b is not None)
+                if errors:
+                    sys.stderr.write(errors)
+                if not count:
+                    continue
+                differing += 1
+                header = "Differs: %s -> %s\n" % (path_a, path_b)
+                if status_file is sys.stdout:
+                    writer.write(header + output)
+                else:
+                    print(header, end="", file=status_file)
+                    writer.write(output)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown(wait=False)
+    elapsed = time.perf_counter() - start
+    print("Compared %d plists in %d pairs in %.2f seconds (%.0f files/sec), %d differ" % (
+        files, len(pairs), elapsed, files / elapsed if elapsed else 0,
+        differing), file=status_file)
+
+
+def replay_main(argv):
+    args = parse_replay_args(argv)
+    formatter = formatter_from_args(args)
+    status_file = formatter.status_file
+    writer = output_writer(args)
+    stats = NULL_STATS
+    if args.stats:
+        stats = PipelineStats()
+    start = time.perf_counter()
+    try:
+        latencies = replay_event_log(
+            args.log, formatter, writer, speed=args.speed, stats=stats,
+            coalesce_window=args.coalesce_ms / 1000.0,
+            queue_size=args.queue_size, overflow=args.overflow)
+    except (OSError, EventLogException) as e:
+        print("Error: %s" % e)
+        exit(1)
+    except KeyboardInterrupt:
+        latencies = []
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    if latencies:
+        latencies.sort()
+        print("Replayed %d events in %.2f seconds (%.0f events/sec); latency p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+            len(latencies), elapsed, len(latencies) / elapsed if elapsed else 0,
+            latencies[len(latencies) // 2] * 1e3,
+            latencies[int(len(latencies) * 0.99)] * 1e3,
+            latencies[-1] * 1e3), file=status_file)
+    if stats.enabled:
+        print(stats.summary(), end="", file=status_file)
+
+
+SUBCOMMANDS = {"snapshot": snapshot_main,
+               "diff-snapshot": diff_snapshot_main,
+               "diff-tree": diff_tree_main,
+               "replay": replay_main}
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
     args = parse_args(sys.argv[1:])
     monitor_dir_events = False
-    show_diffs = False
 
     plistpath = args.watchpath
     if os.path.isdir(plistpath):
@@ -495,45 +2006,129 @@ def main():
         print("Error: %s is not a directory or file, or does not exist." % plistpath)
         exit(1)
 
-    if args.show_diffs:
-        show_diffs = True
+    if args.trigger == TRIGGER_CLOSE_WRITE and \
+            not sys.platform.startswith("linux"):
+        print("Error: --trigger close-write needs inotify, which is only available on Linux.")
+        exit(1)
+    if args.trigger == TRIGGER_CLOSE_WRITE and \
+            WATCHDOG_VERSION < CLOSE_WRITE_WATCHDOG:
+        print("Error: --trigger close-write needs watchdog %d.%d or later." %
+              CLOSE_WRITE_WATCHDOG)
+        exit(1)
+
+    coalesce_window = args.coalesce_ms / 1000.0
+    formatter = formatter_from_args(args)
+    # status messages stay out of machine-readable output
+    status_file = formatter.status_file
+    writer = output_writer(args)
+    stats = NULL_STATS
+    reporter = None
+    if args.stats or args.stats_interval:
+        stats = PipelineStats()
+    if args.stats_interval:
+        reporter = StatsReporter(stats, args.stats_interval, sys.stderr)
+        reporter.start()
+
+    def output(diffs):
+        with stats.timer(RENDER):
+            out, err = formatter.render(diffs)
+        stats.count(CHANGES_EMITTED, len(diffs.changes))
+        writer.write(out)
+        if err:
+            sys.stderr.write(err)
+
+    recorder = None
+    if args.record:
+        recorder = EventLogWriter(args.record)
+
+    def print_stats():
+        if recorder is not None:
+            recorder.close()
+            print("Recorded %d events and baselines to %s" % (
+                recorder.records, recorder.path), file=status_file)
+        if reporter is not None:
+            reporter.stop()
+        if stats.enabled:
+            print(stats.summary(), end="", file=status_file)
+
     print("{} version {}".format(
-        PrefsniffAbout.TITLE.upper(), PrefsniffAbout.VERSION))
+        PrefsniffAbout.TITLE.upper(), PrefsniffAbout.VERSION), file=status_file)
     if monitor_dir_events:
-        print("Watching directory: {}".format(plistpath))
-        PrefsWatcher(plistpath)
+        resume_store = None
+        if args.resume:
+            resume_store = SnapshotStore(args.resume)
+        try:
+            path_filter = PathFilter(include=args.include,
+                                     exclude=args.exclude,
+                                     include_regex=args.include_regex,
+                                     exclude_regex=args.exclude_regex)
+        except re.error as e:
+            print("Error: bad regular expression: %s" % e)
+            exit(1)
+        print("Watching directory: {}".format(plistpath), file=status_file)
+        PrefsWatcher(plistpath, coalesce_window=coalesce_window,
+                     formatter=formatter, writer=writer,
+                     baseline_max_bytes=args.baseline_cache_mb * 1024 * 1024,
+                     workers=args.workers,
+                     worker_processes=not args.worker_threads,
+                     path_filter=path_filter,
+                     queue_size=args.queue_size, overflow=args.overflow,
+                     stats=stats, resume_store=resume_store,
+                     recorder=recorder, trigger=args.trigger)
+        if resume_store is not None:
+            resume_store.close()
+        print_stats()
+    elif args.plist2:
+        print("Watching prefs file: %s" % plistpath, file=status_file)
+        diffs = PrefSniff(plistpath, plistpath2=args.plist2, stats=stats)
+        output(diffs)
+        writer.close()
+        print_stats()
     else:
-        print("Watching prefs file: %s" % plistpath)
-        done = False
-        while not done:
-            plist2 = None
-            if args.plist2:
-                plist2 = args.plist2
-                done = True
+        print("Watching prefs file: %s" % plistpath, file=status_file)
+        net = None
+        # set by SIGUSR1 to ask for the net changes so far
+        net_requested = threading.Event()
+
+        def output_net():
+            diffs = net.net_changes()
+            if not diffs.changes:
+                print("No net changes to %s" % plistpath, file=status_file)
+                return
+            print("Net changes to %s from %d changes (%d events):" % (
+                plistpath, net.updates, net.raw_event_count),
+                file=status_file)
+            output(diffs)
+            writer.flush()
 
-            try:
-                diffs = PrefSniff(plistpath, plistpath2=plist2)
-            except KeyboardInterrupt:
-                print("Exiting.")
-                exit(0)
-
-            print(STARS)
-            print("")
-            for ch in diffs.changes:
-                if isinstance(ch, PSChangeTypeErrorMessage):
-                    print(f"ERROR: {ch}", file=sys.stderr)
-                    continue
-                try:
-                    ch_dict = dict(ch)
-                except ValueError:
-                    print(f"type(ch): {type(ch)}")
-                    print(ch)
-                new_ch = PSChangeTypeFactory.ps_change_type_from_dict(ch_dict)
-                print(new_ch.shell_command())
-                print("")
-            if show_diffs:
-                print('\n'.join(diffs.diff))
-            print(STARS)
+        try:
+            with PrefWatchSession(plistpath,
+                                  coalesce_window=coalesce_window,
+                                  queue_size=args.queue_size,
+                                  overflow=args.overflow,
+                                  stats=stats,
+                                  recorder=recorder,
+                                  trigger=args.trigger) as session:
+                if args.net:
+                    net = NetChangeAccumulator(plistpath, session.path_info)
+                    signal.signal(signal.SIGUSR1,
+                                  lambda signum, frame: net_requested.set())
+                    for diffs in session.changes(yield_idle=True):
+                        if diffs is not None:
+                            net.update(diffs)
+                        if net_requested.is_set():
+                            net_requested.clear()
+                            output_net()
+                else:
+                    for diffs in session.changes():
+                        output(diffs)
+        except KeyboardInterrupt:
+            if net is not None:
+                output_net()
+            writer.close()
+            print_stats()
+            print("Exiting.", file=status_file)
+            exit(0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import time
+import zlib
+from typing import Dict, Iterator, Tuple
+
+from .pathindex import PlistPathIndex, PlistPathInfo
+from .plistcache import PlistFingerprintCache
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    created_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    path TEXT NOT NULL,
+    digest BLOB NOT NULL REFERENCES blobs(digest),
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    domain TEXT NOT NULL,
+    byhost INTEGER NOT NULL,
+    root_owned INTEGER NOT NULL,
+    standard INTEGER NOT NULL,
+    PRIMARY KEY (snapshot_id, path)
+);
+"""
+
+
+class SnapshotEntry:
+    """
+    One plist as it was when a snapshot was taken
+
+    ``path`` is relative to the snapshot's root, so snapshots of
+    different trees can be compared.
+    """
+    __slots__ = ("path", "digest", "mtime_ns", "size", "path_info")
+
+    def __init__(self, path, digest, mtime_ns, size, path_info: PlistPathInfo):
+        self.path = path
+        self.digest = digest
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.path_info = path_info
+
+
+class TreeScan:
+    """
+    Every plist under a directory, read only where it may have changed
+
+    Files whose mtime and size match their entry in ``previous`` (a
+    snapshot's entries) are trusted to be unchanged, as long as they
+    were last modified well before that snapshot was taken, for the same
+    reason PlistFingerprintCache doesn't trust racy matches. Everything
+    else is read and digested, and its data kept in ``data``.
+    """
+
+    def __init__(self, root, previous=None, previous_ns=0):
+        self.root = root
+        # relative path -> SnapshotEntry
+        self.entries: Dict[str, SnapshotEntry] = {}
+        # relative path -> plist data, for files that were read
+        self.data: Dict[str, bytes] = {}
+        self.bytes_read = 0
+        # distinct contents stored for the first time, if this scan was
+        # taken as a snapshot
+        self.new_blobs = 0
+        if previous is None:
+            previous = {}
+        granularity = PlistFingerprintCache.TIMESTAMP_GRANULARITY_NS
+        index = PlistPathIndex(root)
+        for path, info, st in index.walk():
+            relpath = os.path.relpath(path, root)
+            old = previous.get(relpath)
+            if old is not None and old.mtime_ns == st.st_mtime_ns \
+                    and old.size == st.st_size \
+                    and previous_ns - old.mtime_ns > granularity:
+                digest = old.digest
+            else:
+                try:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                self.data[relpath] = data
+                self.bytes_read += len(data)
+                digest = PlistFingerprintCache.digest(data)
+            self.entries[relpath] = SnapshotEntry(
+                relpath, digest, st.st_mtime_ns, st.st_size, info)
+
+
+class SnapshotStore:
+    """
+    Snapshots of plist trees in one SQLite database
+
+    Plist data is stored once per distinct content, zlib-compressed and
+    keyed by its digest, so a snapshot of a tree that has barely changed
+    since the last one costs little more than a row per plist. Taking a
+    snapshot is one pass over the tree in one transaction, and files
+    that haven't changed since the previous snapshot of the same root
+    aren't even read; see TreeScan.
+    """
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self._db = sqlite3.connect(dbpath)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def snapshots(self):
+        """
+        (id, root, created_ns) for every snapshot, oldest first
+        """
+        return self._db.execute(
+            "SELECT id, root, created_ns FROM snapshots ORDER BY id").fetchall()
+
+    def snapshot_info(self, snapshot_id):
+        """
+        (root, created_ns) of a snapshot, or None if there's no such snapshot
+        """
+        return self._db.execute(
+            "SELECT root, created_ns FROM snapshots WHERE id = ?",
+            (snapshot_id,)).fetchone()
+
+    def latest(self, root=None):
+        """
+        Id of the most recent snapshot (of ``root``, if given), or None
+        """
+        if root is None:
+            row = self._db.execute("SELECT MAX(id) FROM snapshots").fetchone()
+        else:
+            row = self._db.execute(
+                "SELECT MAX(id) FROM snapshots WHERE root = ?",
+                (os.path.abspath(root),)).fetchone()
+        return row[0]
+
+    def entries(self, snapshot_id) -> Dict[str, SnapshotEntry]:
+        rows = self._db.execute(
+            "SELECT path, digest, mtime_ns, size, domain, byhost, root_owned,"
+            " standard FROM entries WHERE snapshot_id = ?", (snapshot_id,))
+        entries = {}
+        for path, digest, mtime_ns, size, domain, byhost, root_owned, \
+                standard in rows:
+            info = PlistPathInfo(domain, bool(byhost), bool(root_owned),
+                                 bool(standard))
+            entries[path] = SnapshotEntry(path, digest, mtime_ns, size, info)
+        return entries
+
+    def data(self, digest) -> bytes:
+        row = self._db.execute(
+            "SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest.hex())
+        return zlib.decompress(row[0])
+
+    def scan(self, root, snapshot_id=None) -> TreeScan:
+        """
+        Scan ``root``, trusting unchanged files to match ``snapshot_id``, if given
+        """
+        previous = None
+        previous_ns = 0
+        if snapshot_id is not None:
+            previous = self.entries(snapshot_id)
+            previous_ns = self.snapshot_info(snapshot_id)[1]
+        return TreeScan(root, previous, previous_ns)
+
+    def take(self, root):
+        """
+        Snapshot every plist under ``root``, returning (snapshot id, TreeScan)
+        """
+        root = os.path.abspath(root)
+        created_ns = time.time_ns()
+        scan = self.scan(root, self.latest(root))
+        with self._db:
+            known = set()
+            digests = list({scan.entries[relpath].digest
+                            for relpath in scan.data})
+            # stay under SQLite's limit on query parameters
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                known.update(row[0] for row in self._db.execute(
+                    "SELECT digest FROM blobs WHERE digest IN (%s)"
+                    % ",".join("?" * len(chunk)), chunk))
+            blobs = {}
+            for relpath, data in scan.data.items():
+                digest = scan.entries[relpath].digest
+                if digest not in known and digest not in blobs:
+                    blobs[digest] = zlib.compress(data)
+            self._db.executemany("INSERT INTO blobs VALUES (?, ?)",
+                                 blobs.items())
+            cursor = self._db.execute(
+                "INSERT INTO snapshots (root, created_ns) VALUES (?, ?)",
+                (root, created_ns))
+            snapshot_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((snapshot_id, e.path, e.digest, e.mtime_ns, e.size,
+                  e.path_info.domain, e.path_info.byhost,
+                  e.path_info.root_owned, e.path_info.standard)
+                 for e in scan.entries.values()))
+        scan.new_blobs = len(blobs)
+        return snapshot_id, scan
+
+
+def snapshot_differences(store: SnapshotStore, snapshot_id, against=None,
+                         root=None) -> Iterator[Tuple]:
+    """
+    Yield (path, path info, old data, new data) for each plist that
+    differs between a snapshot and ``against``
+
+    ``against`` is another snapshot's id, or None for what's on disk now
+    under ``root`` (by default, the snapshot's own root). The data is
+    None for a plist that isn't in one side or the other. Plists are
+    yielded in path order, with paths under the newer tree's root.
+    """
+    info = store.snapshot_info(snapshot_id)
+    if info is None:
+        raise KeyError("no snapshot %s" % snapshot_id)
+    before = store.entries(snapshot_id)
+    if against is None:
+        if root is None:
+            root = info[0]
+        # A file's stat only vouches for its contents in the tree the
+        # snapshot was taken of; in any other tree, a file that happens
+        # to have the same mtime and size could hold anything
+        trusted = None
+        if os.path.abspath(root) == info[0]:
+            trusted = snapshot_id
+        scan = store.scan(root, trusted)
+        after = scan.entries
+        data = scan.data
+    else:
+        against_info = store.snapshot_info(against)
+        if against_info is None:
+            raise KeyError("no snapshot %s" % against)
+        root = against_info[0]
+        after = store.entries(against)
+        data = {}
+
+    for relpath in sorted(set(before) | set(after)):
+        old = before.get(relpath)
+        new = after.get(relpath)
+        if old is not None and new is not None and old.digest == new.digest:
+            continue
+        old_data = None
+        new_data = None
+        if old is not None:
+            old_data = store.data(old.digest)
+        if new is not None:
+            new_data = data.get(relpath)
+            if new_data is None:
+                new_data = store.data(new.digest)
+        yield (os.path.join(root, relpath), (new or old).path_info,
+               old_data, new_data)
@@ -0,0 +1,184 @@
+import datetime
+import json
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+# phases of handling a change, in pipeline order
+READ = "read"
+PARSE = "parse"
+COMPARE = "compare"
+GENERATE = "generate"
+RENDER = "render"
+DIFF = "diff"
+
+PHASES = [READ, PARSE, COMPARE, GENERATE, RENDER, DIFF]
+
+# counters
+EVENTS_RECEIVED = "events_received"
+EVENTS_SKIPPED = "events_skipped"
+PLISTS_PARSED = "plists_parsed"
+CHANGES_EMITTED = "changes_emitted"
+BYTES_READ = "bytes_read"
+
+COUNTERS = [EVENTS_RECEIVED, EVENTS_SKIPPED, PLISTS_PARSED, CHANGES_EMITTED,
+            BYTES_READ]
+
+
+class _PhaseTimer:
+    __slots__ = ("stats", "phase", "start")
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add_time(self.phase, time.perf_counter() - self.start)
+
+
+class PipelineStats:
+    """
+    Where the time goes in handling changes, and how much was handled
+
+    Time spent in each phase is accumulated with::
+
+        with stats.timer(PARSE):
+            ...
+
+    and events, plists and bytes are tallied with count(). Phases nest
+    where the work does: DIFF, the unified diff for --show-diffs, is part
+    of RENDER, and serializing XML fragments for composite values is part
+    of GENERATE, since change objects do it as they're constructed.
+
+    Everything is safe to update from several threads. Worker processes
+    keep their own PipelineStats and send back snapshot()s to merge().
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        # phase -> [calls, seconds]
+        self.phases = {phase: [0, 0.0] for phase in PHASES}
+        self.counters = Counter({name: 0 for name in COUNTERS})
+
+    def timer(self, phase):
+        return _PhaseTimer(self, phase)
+
+    def add_time(self, phase, seconds, calls=1):
+        with self._lock:
+            totals = self.phases.setdefault(phase, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "phases": {phase: {"calls": calls, "seconds": seconds}
+                               for phase, (calls, seconds)
+                               in self.phases.items()}}
+
+    def merge(self, snapshot: Dict):
+        with self._lock:
+            self.counters.update(snapshot["counters"])
+            for phase, totals in snapshot["phases"].items():
+                mine = self.phases.setdefault(phase, [0, 0.0])
+                mine[0] += totals["calls"]
+                mine[1] += totals["seconds"]
+
+    def record(self) -> Dict:
+        """
+        A snapshot as an NDJSON stats record
+        """
+        record = {"record_type": "stats",
+                  "timestamp": datetime.datetime.now(
+                      datetime.timezone.utc).isoformat(),
+                  "elapsed": time.time() - self.started}
+        record.update(self.snapshot())
+        return record
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = ["Stats after %.1f seconds:" % (time.time() - self.started)]
+        for name, value in snapshot["counters"].items():
+            lines.append("  %-16s %12d" % (name, value))
+        lines.append("  %-16s %12s %12s %12s" % (
+            "phase", "calls", "total ms", "mean us"))
+        for phase, totals in snapshot["phases"].items():
+            calls, seconds = totals["calls"], totals["seconds"]
+            mean = seconds / calls * 1e6 if calls else 0.0
+            lines.append("  %-16s %12d %12.1f %12.1f" % (
+                phase, calls, seconds * 1e3, mean))
+        return "\n".join(lines) + "\n"
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullStats(PipelineStats):
+    """
+    Stats that are thrown away, costing next to nothing to keep
+    """
+    enabled = False
+
+    def timer(self, phase):
+        return _NULL_TIMER
+
+    def add_time(self, phase, seconds, calls=1):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def merge(self, snapshot: Dict):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+class StatsReporter:
+    """
+    Writes a PipelineStats' record() to a stream as NDJSON every ``interval`` seconds
+    """
+
+    def __init__(self, stats: PipelineStats, interval, stream):
+        self.stats = stats
+        self.interval = interval
+        self.stream = stream
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._report_loop, name="StatsReporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _report_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.stream.write(json.dumps(self.stats.record()) + "\n")
+            self.stream.flush()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,163 @@
+import datetime
+import marshal
+import re
+import threading
+from base64 import b64encode
+from collections import OrderedDict
+
+# same set plistlib refuses to serialize
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class PlistXmlFragSerializer:
+    """
+    Serializes a plist value directly to an XML fragment such as
+    ``<dict><key>a</key><integer>1</integer></dict>``
+
+    Output is byte-for-byte what PSChangeTypeCompositeBase.to_xmlfrag() used
+    to produce by way of plistlib.dumps() and an ElementTree round trip,
+    quirks included: whitespace at the start and end of each line of a
+    multi-line string is dropped along with the line breaks, empty elements
+    are written as ``<tag />``, and non-ASCII characters become character
+    references.
+
+    Fragments for dictionaries and arrays are memoized in a bounded LRU
+    cache keyed on the value's contents, so repeated values (e.g., the same
+    sub-dictionary re-added on every change) are only serialized once.
+    """
+    CACHE_SIZE = 1024
+    # cap on the combined size of cached keys and fragments
+    CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, cache_size=CACHE_SIZE, cache_max_bytes=CACHE_MAX_BYTES):
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def serialize(self, value) -> str:
+        if not self.cache_size or not isinstance(value, (dict, list, tuple)):
+            return self._serialize(value)
+
+        try:
+            # marshal is type-exact, so True and 1 can't share an entry
+            cache_key = marshal.dumps(value, 2)
+        except ValueError:
+            # e.g., contains dates
+            return self._serialize(value)
+
+        with self._lock:
+            xmlfrag = self._cache.get(cache_key)
+            if xmlfrag is not None:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                return xmlfrag
+
+        xmlfrag = self._serialize(value)
+        entry_bytes = len(cache_key) + len(xmlfrag)
+        with self._lock:
+            self.misses += 1
+            if entry_bytes > self.cache_max_bytes or cache_key in self._cache:
+                return xmlfrag
+            self._cache[cache_key] = xmlfrag
+            self._cache_bytes += entry_bytes
+            while len(self._cache) > self.cache_size or \
+                    self._cache_bytes > self.cache_max_bytes:
+                old_key, old_frag = self._cache.popitem(last=False)
+                self._cache_bytes -= len(old_key) + len(old_frag)
+        return xmlfrag
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    def _serialize(self, value):
+        parts = []
+        self._write_value(value, parts)
+        return "".join(parts)
+
+    def _write_value(self, value, parts):
+        if isinstance(value, str):
+            self._write_text("string", value, parts)
+        elif value is True:
+            parts.append("<true />")
+        elif value is False:
+            parts.append("<false />")
+        elif isinstance(value, int):
+            if not (-1 << 63 <= value < 1 << 64):
+                raise OverflowError(value)
+            parts.append("<integer>%d</integer>" % value)
+        elif isinstance(value, float):
+            parts.append("<real>%s</real>" % repr(value))
+        elif isinstance(value, dict):
+            self._write_dict(value, parts)
+        elif isinstance(value, (bytes, bytearray)):
+            self._write_data(value, parts)
+        elif isinstance(value, datetime.datetime):
+            parts.append("<date>%04d-%02d-%02dT%02d:%02d:%02dZ</date>" % (
+                value.year, value.month, value.day,
+                value.hour, value.minute, value.second))
+        elif isinstance(value, (tuple, list)):
+            self._write_array(value, parts)
+        else:
+            raise TypeError("unsupported type: %s" % type(value))
+
+    def _write_dict(self, value, parts):
+        if not value:
+            parts.append("<dict />")
+            return
+        parts.append("<dict>")
+        for key, subval in sorted(value.items()):
+            if not isinstance(key, str):
+                raise TypeError("keys must be strings")
+            self._write_text("key", key, parts)
+            self._write_value(subval, parts)
+        parts.append("</dict>")
+
+    def _write_array(self, value, parts):
+        if not value:
+            parts.append("<array />")
+            return
+        parts.append("<array>")
+        for subval in value:
+            self._write_value(subval, parts)
+        parts.append("</array>")
+
+    def _write_data(self, value, parts):
+        if not value:
+            parts.append("<data />")
+            return
+        parts.append("<data>%s</data>" % b64encode(value).decode("ascii"))
+
+    def _write_text(self, tag, text, parts):
+        if _CONTROL_CHARS.search(text):
+            raise ValueError(
+                "strings can't contain control characters; use bytes instead")
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        text = text.replace("&", "&amp;").replace(
+            "<", "&lt;").replace(">", "&gt;")
+        # plistlib puts the start and end tags on the first and last
+        # lines of a multi-line string, and every line was stripped
+        lines = ("<%s>%s</%s>" % (tag, text, tag)).splitlines()
+        if len(lines) > 1:
+            text = "".join(line.strip() for line in lines)
+            text = text[len(tag) + 2:-(len(tag) + 3)]
+        if not text:
+            parts.append("<%s />" % tag)
+            return
+        text = text.encode("ascii", "xmlcharrefreplace").decode("ascii")
+        parts.append("<%s>%s</%s>" % (tag, text, tag))
+
+
+_default_serializer = PlistXmlFragSerializer()
+
+
+def plist_to_xmlfrag(value) -> str:
+    """
+    Serialize ``value`` to an XML fragment using the shared, memoized serializer
+    """
+    return _default_serializer.serialize(value)